@@ -1,10 +1,18 @@
-from flask import jsonify, request, send_file
-from gtts import gTTS
+import io
+import re
+
+from flask import jsonify, request, send_file, url_for
 from flasgger import swag_from
 
-def text_to_audio(text, path):
-    tts = gTTS(text=text, lang='ru')
-    tts.save(path)
+from utils.tts import FORMATS, default_format, get_tts_engine
+from utils.tts_cache import TTS_CACHE_MAX_AGE, tts_cache
+
+_KEY_RE = re.compile(r'^[0-9a-f]{64}$')
+
+def text_to_audio(text, fmt):
+    # Синтез локальным движком TTS_ENGINE по предложениям, через кэш по хэшу текста:
+    # повторные фразы не синтезируются заново
+    return tts_cache.get(text, fmt)
 
 @swag_from({
     'tags': ['Audio'],
@@ -16,11 +24,23 @@ def text_to_audio(text, path):
             'type': 'string',
             'required': True,
             'description': 'Текст для преобразования в аудио'
+        },
+        {
+            'name': 'format',
+            'in': 'formData',
+            'type': 'string',
+            'enum': sorted(FORMATS),
+            'required': False,
+            'description': 'Формат аудио (по умолчанию TTS_FORMAT); raw — PCM s16le моно, частота в X-TTS-Sample-Rate'
         }
     ],
     'responses': {
         200: {
-            'description': 'Аудиофайл успешно сгенерирован',
+            'description': 'Аудиофайл успешно сгенерирован. X-TTS-Key — хэш текста, голоса и формата, '
+                           'Content-Location — адрес GET /api/tts/<format>/<key>, по которому это аудио '
+                           'кэшируется браузером и прокси; '
+                           'X-TTS-Cache — откуда взят ответ: memory, disk, miss или shared; '
+                           'после синтеза — X-TTS-Engine, X-TTS-Audio-Seconds, X-TTS-Synth-Seconds, X-TTS-RTF',
             'schema': {
                 'type': 'file',
                 'format': 'binary'
@@ -42,12 +62,102 @@ def convert_text_to_audio():
         return jsonify({'error': 'Text parameter is missing'}), 400
 
     text = request.form['text']
+    if not text.strip():
+        return jsonify({'error': 'Text parameter is empty'}), 400
+
+    fmt = (request.form.get('format') or default_format()).lower()
+    if fmt not in FORMATS:
+        return jsonify({'error': f'Unsupported format, expected one of {sorted(FORMATS)}'}), 400
+
+    # Преобразование текста в аудио (буфер из кэша или свежий синтез)
+    try:
+        audio = text_to_audio(text, fmt)
+    except ValueError as e:
+        # движок не умеет этот формат (gtts отдаёт только mp3)
+        return jsonify({'error': str(e)}), 400
+
+    # Отдаём аудио прямо из буфера; POST не кэшируется, поэтому указываем
+    # GET-адрес этого же аудио — повторно его можно брать оттуда
+    response = _audio_response(audio, fmt, as_attachment=True)
+    response.headers['Content-Location'] = url_for('get_tts_audio', fmt=fmt, key=audio.key)
+    if audio.speech is not None:
+        timings = audio.speech.timings()
+        response.headers['X-TTS-Engine'] = timings['engine']
+        response.headers['X-TTS-Audio-Seconds'] = str(timings['audio_seconds'])
+        response.headers['X-TTS-Synth-Seconds'] = str(round(timings['synth_seconds'] + timings['encode_seconds'], 3))
+        response.headers['X-TTS-RTF'] = str(timings['rtf'])
+    return response
+
 
-    # Уникальное имя для аудиофайла
-    audio_file_path = 'output_audio.wav'
+def _audio_response(audio, fmt, as_attachment=False, conditional=False):
+    response = send_file(
+        io.BytesIO(audio.data),
+        mimetype=audio.mimetype,
+        as_attachment=as_attachment,
+        download_name=f'output_audio{audio.extension}',
+        etag=audio.key if conditional else False,
+        conditional=conditional,
+        max_age=TTS_CACHE_MAX_AGE if conditional else None
+    )
+    response.headers['X-TTS-Key'] = audio.key
+    response.headers['X-TTS-Cache'] = audio.cache
+    if fmt == 'raw':
+        response.headers['X-TTS-Sample-Rate'] = str(get_tts_engine().sample_rate)
+    return response
 
-    # Преобразование текста в аудиофайл
-    text_to_audio(text, audio_file_path)
 
-    # Посылаем аудиофайл обратно в ответе
-    return send_file(audio_file_path, as_attachment=True)
\ No newline at end of file
+@swag_from({
+    'tags': ['Audio'],
+    'parameters': [
+        {
+            'name': 'fmt',
+            'in': 'path',
+            'type': 'string',
+            'enum': sorted(FORMATS),
+            'required': True,
+            'description': 'Формат аудио, как при синтезе'
+        },
+        {
+            'name': 'key',
+            'in': 'path',
+            'type': 'string',
+            'required': True,
+            'description': 'X-TTS-Key из ответа POST /api/converttexttoaudio/'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Ранее синтезированное аудио. Содержимое по ключу не меняется: '
+                           'ETag — ключ, Cache-Control: public, max-age=TTS_CACHE_MAX_AGE',
+            'schema': {
+                'type': 'file',
+                'format': 'binary'
+            }
+        },
+        304: {
+            'description': 'Аудио не изменилось (If-None-Match совпал с ETag)'
+        },
+        400: {
+            'description': 'Неизвестный формат или некорректный ключ',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        },
+        404: {
+            'description': 'Аудио вытеснено из кэша — синтезируйте его заново через POST'
+        }
+    }
+})
+def get_tts_audio(fmt, key):
+    if fmt not in FORMATS:
+        return jsonify({'error': f'Unsupported format, expected one of {sorted(FORMATS)}'}), 400
+    if not _KEY_RE.match(key):
+        return jsonify({'error': 'Invalid audio key'}), 400
+
+    audio = tts_cache.lookup(key, fmt)
+    if audio is None:
+        return jsonify({'error': 'Audio not found'}), 404
+    return _audio_response(audio, fmt, conditional=True)
@@ -3,7 +3,25 @@ from flasgger import swag_from
 from Models.Chat import Chat, db
 from Models.User import User
 from Models.Message import Message
+from utils.pagination import (
+    CursorError,
+    decode_cursor,
+    encode_cursor,
+    keyset_window,
+    make_etag,
+    not_modified,
+    parse_limit,
+)
+from utils.list_query import ListQuery, ListQueryError
 
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+CHAT_LIST = ListQuery(
+    Chat,
+    fields={'id': Chat.id, 'name': Chat.name, 'user_id': Chat.user_id},
+    filters={'user_id': Chat.user_id},
+)
 
 
 
@@ -12,6 +30,7 @@ from Models.Message import Message
 # ---------------------------------------------
 @swag_from({
     'tags': ['Chats'],
+    'parameters': CHAT_LIST.swagger_parameters(),
     'responses': {
         200: {
             'description': 'Список чатов',
@@ -30,28 +49,29 @@ from Models.Message import Message
                                 'user_id': {'type': 'integer'}
                             }
                         }
-                    }
+                    },
+                    'next_cursor': {'type': 'string'}
                 }
             }
-        }
+        },
+        400: {'description': 'Неизвестный фильтр или поле, некорректный курсор или limit'}
     }
 })
 def get_chats():
-    chats = Chat.query.all()
+    try:
+        page = CHAT_LIST.page(request.args)
+    except ListQueryError as e:
+        return jsonify({'status': False, 'message': str(e)}), 400
     output = {
-        'status': True if len(chats) > 0 else False,
-        'message': "OK" if len(chats) > 0 else "Empty table",
-        'data': []
+        'status': True if len(page.items) > 0 else False,
+        'message': "OK" if len(page.items) > 0 else "Empty table",
+        'data': page.items,
+        'next_cursor': page.next_cursor
     }
-    for chat in chats:
-        chat_data = {
-            'id': chat.id,
-            'name': chat.name,
-            'user_id': chat.user_id
-        }
-        output['data'].append(chat_data)
+    if page.total is not None:
+        output['total'] = page.total
 
-    return jsonify(output)
+    return jsonify(output), 200, page.headers
 
 
 # ---------------------------------------------
@@ -258,6 +278,12 @@ def delete_chat(chat_id):
 
 @swag_from({
     'tags': ['Chats'],
+    'description': (
+        'История чата окнами по (time, id), без OFFSET. Без параметров — последние limit сообщений; '
+        'before=next_cursor — следующее окно более старых; since_id — только сообщения новее указанного '
+        '(для опроса). Внутри окна сообщения идут от старых к новым. Ответ несёт ETag '
+        '(последнее сообщение чата + параметры): с If-None-Match вернётся 304 без выборки сообщений.'
+    ),
     'parameters': [
         {
             'name': 'chat_id',
@@ -265,6 +291,34 @@ def delete_chat(chat_id):
             'type': 'integer',
             'required': True,
             'description': 'ID чата'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': f'Размер окна (по умолчанию {HISTORY_PAGE_SIZE}, не больше {HISTORY_MAX_PAGE_SIZE})'
+        },
+        {
+            'name': 'before',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Курсор next_cursor из предыдущего ответа: сообщения старше него'
+        },
+        {
+            'name': 'since_id',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'ID последнего сообщения, которое уже есть у клиента: сообщения новее него'
+        },
+        {
+            'name': 'If-None-Match',
+            'in': 'header',
+            'type': 'string',
+            'required': False,
+            'description': 'ETag предыдущего ответа'
         }
     ],
     'responses': {
@@ -276,6 +330,9 @@ def delete_chat(chat_id):
                     'status': {'type': 'boolean'},
                     'chat_id': {'type': 'integer'},
                     'chat_name': {'type': 'string'},
+                    'last_message_id': {'type': 'integer'},
+                    'has_more': {'type': 'boolean'},
+                    'next_cursor': {'type': 'string'},
                     'messages': {
                         'type': 'array',
                         'items': {
@@ -292,6 +349,12 @@ def delete_chat(chat_id):
                 }
             }
         },
+        304: {
+            'description': 'Окно не изменилось с прошлого запроса (If-None-Match)'
+        },
+        400: {
+            'description': 'Неверный limit, before или since_id'
+        },
         404: {
             'description': 'Чат не найден',
             'schema': {
@@ -309,22 +372,65 @@ def get_chat_history(chat_id):
     if not chat:
         return jsonify({'status': False, 'message': 'Chat not found'}), 404
 
-    messages = [
-        {
-            'id': m.id,
-            'message': m.message,
-            'time': m.time.strftime('%Y-%m-%d %H:%M:%S'),
-            'type': m.type,
-            'sender': m.sender
-        } for m in chat.messages
-    ]
+    try:
+        limit = parse_limit(request.args.get('limit'), HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE)
+        before = decode_cursor(request.args['before']) if request.args.get('before') else None
+        since_id = int(request.args['since_id']) if request.args.get('since_id') else None
+    except CursorError as e:
+        return jsonify({'status': False, 'message': str(e)}), 400
+    except ValueError:
+        return jsonify({'status': False, 'message': f"Invalid since_id: {request.args['since_id']!r}"}), 400
 
-    return jsonify({
+    messages_query = Message.query.filter(Message.chat_id == chat_id)
+
+    # Сообщения только добавляются, поэтому версия чата — его последнее сообщение.
+    # Одна строка по индексу (chat_id, time, id) — цена не зависит от длины истории
+    last = messages_query.with_entities(Message.id)\
+        .order_by(Message.time.desc(), Message.id.desc())\
+        .first()
+    last_message_id = last.id if last else None
+    etag = make_etag(chat.id, chat.name, last_message_id, limit, request.args.get('before'), since_id)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    after = None
+    if since_id is not None:
+        known = Message.query.filter_by(id=since_id, chat_id=chat_id).first()
+        if not known:
+            return jsonify({'status': False, 'message': 'since_id is not a message of this chat'}), 400
+        after = (known.time, known.id)
+
+    rows, has_more = keyset_window(messages_query, Message.time, Message.id, limit, before=before, after=after)
+    if after is None:
+        rows.reverse()  # окно выбрано от новых к старым, отдаём от старых к новым
+
+    response = jsonify({
         'status': True,
         'chat_id': chat.id,
         'chat_name': chat.name,
-        'messages': messages
+        'last_message_id': last_message_id,
+        'has_more': has_more,
+        # старое окно продолжают с before=next_cursor, а since_id — с id последнего сообщения
+        'next_cursor': (
+            encode_cursor(rows[0].time, rows[0].id) if rows and has_more and after is None else None
+        ),
+        'messages': [_message_data(m) for m in rows]
     })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _message_data(m):
+    return {
+        'id': m.id,
+        'message': m.message,
+        'time': m.time.strftime('%Y-%m-%d %H:%M:%S'),
+        'type': m.type,
+        'sender': m.sender
+    }
+
 
 @swag_from({
     'tags': ['Chats'],
@@ -390,19 +496,12 @@ def get_last_messages(chat_id):
 
     # Берём последние n сообщений по времени
     messages = Message.query.filter_by(chat_id=chat_id)\
-        .order_by(Message.time.desc())\
+        .order_by(Message.time.desc(), Message.id.desc())\
         .limit(limit)\
         .all()
 
-    messages_data = [
-        {
-            'id': m.id,
-            'message': m.message,
-            'time': m.time.strftime('%Y-%m-%d %H:%M:%S'),
-            'type': m.type,
-            'sender': m.sender
-        } for m in reversed(messages)  # переворачиваем, чтобы старые были первыми
-    ]
+    # переворачиваем, чтобы старые были первыми
+    messages_data = [_message_data(m) for m in reversed(messages)]
 
     return jsonify({
         'status': True,
@@ -4,9 +4,17 @@ from database import db
 from Models.DocCall import DocCall
 from Models.User import User
 from Models.Document import Document
+from utils.doc_call_buffer import upsert_doc_calls
+from utils.list_query import ListQuery, ListQueryError
 
 doc_call_bp = Blueprint("doc_call", __name__, url_prefix="/api/doc_call")
 
+DOC_CALL_LIST = ListQuery(
+    DocCall,
+    fields={"id": DocCall.id, "user_id": DocCall.user_id, "doc_id": DocCall.doc_id, "call_count": DocCall.call_count},
+    filters={"user_id": DocCall.user_id, "doc_id": DocCall.doc_id},
+)
+
 
 # -------------------------
 # CREATE DocCall
@@ -22,7 +30,8 @@ doc_call_bp = Blueprint("doc_call", __name__, url_prefix="/api/doc_call")
     'responses': {
         201: {'description': 'DocCall created'},
         400: {'description': 'Bad input'},
-        404: {'description': 'User or Document not found'}
+        404: {'description': 'User or Document not found'},
+        409: {'description': 'DocCall already exists'}
     }
 })
 def create_doc_call():
@@ -39,6 +48,9 @@ def create_doc_call():
     if not Document.query.get(doc_id):
         return jsonify({"status": False, "message": "Document not found"}), 404
 
+    if DocCall.query.filter_by(user_id=user_id, doc_id=doc_id).first():
+        return jsonify({"status": False, "message": "DocCall for this user and document already exists"}), 409
+
     dc = DocCall(user_id=user_id, doc_id=doc_id, call_count=call_count)
     db.session.add(dc)
     db.session.commit()
@@ -47,25 +59,20 @@ def create_doc_call():
 
 
 # -------------------------
-# GET ALL DocCalls
+# GET DocCalls (one page, cursor in X-Next-Cursor)
 # -------------------------
 @doc_call_bp.route("/", methods=["GET"])
 @swag_from({
     'tags': ['DocCall'],
-    'responses': {200: {'description': 'List of DocCall records'}}
+    'parameters': DOC_CALL_LIST.swagger_parameters(),
+    'responses': {200: {'description': 'List of DocCall records'}, 400: {'description': 'Bad list query'}}
 })
 def get_all_doc_calls():
-    calls = DocCall.query.all()
-    result = [
-        {
-            "id": c.id,
-            "user_id": c.user_id,
-            "doc_id": c.doc_id,
-            "call_count": c.call_count
-        }
-        for c in calls
-    ]
-    return jsonify(result), 200
+    try:
+        page = DOC_CALL_LIST.page(request.args)
+    except ListQueryError as e:
+        return jsonify({"status": False, "message": str(e)}), 400
+    return jsonify(page.items), 200, page.headers
 
 
 # -------------------------
@@ -173,19 +180,13 @@ def increase_call_count(doc_id):
     if not doc:
         return jsonify({"status": False, "message": "Document not found"}), 404
 
-    dc = DocCall.query.filter_by(user_id=user_id, doc_id=doc_id).first()
-
-    if not dc:
-        dc = DocCall(user_id=user_id, doc_id=doc_id, call_count=1)
-        db.session.add(dc)
-    else:
-        dc.call_count += 1
-
+    # атомарный INSERT ... ON CONFLICT, без гонки между воркерами
+    row = upsert_doc_calls({(user.id, doc.id): 1})[0]
     db.session.commit()
 
     return jsonify({
         "status": True,
-        "user_id": dc.user_id,
-        "doc_id": dc.doc_id,
-        "call_count": dc.call_count
+        "user_id": row.user_id,
+        "doc_id": row.doc_id,
+        "call_count": row.call_count
     }), 200
\ No newline at end of file
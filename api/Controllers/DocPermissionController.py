@@ -5,9 +5,27 @@ from database import db
 from Models.DocPermission import DocPermission
 from Models.User import User
 from Models.Document import Document
+from utils.user_context import invalidate_user_context
+from utils.list_query import Computed, ListQuery, ListQueryError
 
 doc_permission_bp = Blueprint("doc_permission", __name__, url_prefix="/api/doc_permissions")
 
+PERMISSION_LIST = ListQuery(
+    DocPermission,
+    fields={
+        "id": DocPermission.id,
+        "issuer_id": DocPermission.issuer_id,
+        "recipient_id": DocPermission.recipient_id,
+        "doc_id": DocPermission.doc_id,
+        "set_on": Computed([DocPermission.set_on], datetime.isoformat),
+    },
+    filters={
+        "issuer_id": DocPermission.issuer_id,
+        "recipient_id": DocPermission.recipient_id,
+        "doc_id": DocPermission.doc_id,
+    },
+)
+
 
 # -------------------------
 # CREATE — issue permission
@@ -54,33 +72,29 @@ def create_permission():
     )
     db.session.add(permission)
     db.session.commit()
+    invalidate_user_context(issuer_id, recipient_id)
 
     return jsonify({"status": True, "permission_id": permission.id}), 201
 
 
 # -------------------------
-# GET ALL permissions
+# GET permissions (one page, cursor in X-Next-Cursor)
 # -------------------------
 @doc_permission_bp.route("/", methods=["GET"])
 @swag_from({
     'tags': ['DocPermissions'],
+    'parameters': PERMISSION_LIST.swagger_parameters(),
     'responses': {
-        200: {'description': 'List of permissions'}
+        200: {'description': 'List of permissions'},
+        400: {'description': 'Bad list query'}
     }
 })
 def get_all_permissions():
-    permissions = DocPermission.query.all()
-    result = [
-        {
-            "id": p.id,
-            "issuer_id": p.issuer_id,
-            "recipient_id": p.recipient_id,
-            "doc_id": p.doc_id,
-            "set_on": p.set_on.isoformat()
-        }
-        for p in permissions
-    ]
-    return jsonify(result), 200
+    try:
+        page = PERMISSION_LIST.page(request.args)
+    except ListQueryError as e:
+        return jsonify({"status": False, "message": str(e)}), 400
+    return jsonify(page.items), 200, page.headers
 
 
 # -------------------------
@@ -130,8 +144,10 @@ def delete_permission(permission_id):
     if not p:
         return jsonify({"status": False, "message": "Not found"}), 404
 
+    affected = (p.issuer_id, p.recipient_id)
     db.session.delete(p)
     db.session.commit()
+    invalidate_user_context(*affected)
     return jsonify({"status": True, "message": "Deleted"}), 200
 
 
@@ -1,14 +1,26 @@
 from database import db  
 from Models.Document import Document
 from flask import Blueprint, jsonify, request
+from utils.user_context import user_context_cache
+from utils.answer_cache import answer_cache
+from utils.list_query import ListQuery, ListQueryError
+
+DOCUMENT_LIST = ListQuery(
+    Document,
+    fields={"id": Document.id, "name": Document.name, "path": Document.path},
+    filters={"name": Document.name},
+)
 
 
 # ------------------ CRUD Functions ------------------
 
-# GET /api/documents/ — все документы
+# GET /api/documents/ — страница документов, курсор следующей в X-Next-Cursor
 def get_documents():
-    docs = Document.query.all()
-    return jsonify([{"id": d.id, "name": d.name, "path": d.path} for d in docs])
+    try:
+        page = DOCUMENT_LIST.page(request.args)
+    except ListQueryError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(page.items), 200, page.headers
 
 # GET /api/documents/<id> — один документ
 def get_document(item_id):
@@ -34,6 +46,8 @@ def update_document(item_id):
     doc.name = data.get("name", doc.name)
     doc.path = data.get("path", doc.path)
     db.session.commit()
+    # ответы, построенные на старой версии документа, больше не годятся
+    answer_cache.clear()
     return jsonify({"id": doc.id, "name": doc.name, "path": doc.path})
 
 # DELETE /api/documents/<id> — удалить документ
@@ -43,4 +57,7 @@ def delete_document(item_id):
         return jsonify({"error": "Document not found"}), 404
     db.session.delete(doc)
     db.session.commit()
+    # вместе с документом каскадно удалены права на него
+    user_context_cache.clear()
+    answer_cache.clear()
     return jsonify({"status": "deleted"})
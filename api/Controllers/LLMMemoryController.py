@@ -4,9 +4,23 @@ from flasgger import swag_from
 from database import db
 from Models.LLMMemory import LLMMemory
 from Models.User import User
+from utils.memory_utils import (
+    compact_user_memory,
+    index_memory_snippets,
+    rebuild_user_memory_summary,
+    unindex_memory_snippets,
+)
+from utils.user_context import invalidate_user_context
+from utils.list_query import ListQuery, ListQueryError
 
 llm_memory_bp = Blueprint("llm_memory", __name__, url_prefix="/api/llm_memory")
 
+MEMORY_LIST = ListQuery(
+    LLMMemory,
+    fields={"id": LLMMemory.id, "user_id": LLMMemory.user_id, "info": LLMMemory.info},
+    filters={"user_id": LLMMemory.user_id},
+)
+
 
 # -------------------------
 # CREATE memory
@@ -37,22 +51,29 @@ def create_memory():
     memory = LLMMemory(user_id=user_id, info=info)
     db.session.add(memory)
     db.session.commit()
+    index_memory_snippets(int(user_id), [memory])
+    compact_user_memory(int(user_id))
+    db.session.commit()
+    invalidate_user_context(user_id)
 
     return jsonify({"status": True, "id": memory.id}), 201
 
 
 # -------------------------
-# GET ALL memories
+# GET memories (one page, cursor in X-Next-Cursor)
 # -------------------------
 @llm_memory_bp.route("/", methods=["GET"])
 @swag_from({
     'tags': ['LLM Memory'],
-    'responses': {200: {'description': 'List of all memories'}}
+    'parameters': MEMORY_LIST.swagger_parameters(),
+    'responses': {200: {'description': 'List of memories'}, 400: {'description': 'Bad list query'}}
 })
 def get_all_memories():
-    memories = LLMMemory.query.all()
-    result = [{"id": m.id, "user_id": m.user_id, "info": m.info} for m in memories]
-    return jsonify(result), 200
+    try:
+        page = MEMORY_LIST.page(request.args)
+    except ListQueryError as e:
+        return jsonify({"status": False, "message": str(e)}), 400
+    return jsonify(page.items), 200, page.headers
 
 
 # -------------------------
@@ -91,6 +112,9 @@ def update_memory(id):
         m.info = info
 
     db.session.commit()
+    index_memory_snippets(m.user_id, [m])
+    # запись могла уже войти в сводку — пересобираем её
+    rebuild_user_memory_summary(m.user_id)
     return jsonify({"status": True, "message": "Updated"}), 200
 
 
@@ -107,8 +131,12 @@ def delete_memory(id):
     if not m:
         return jsonify({"status": False, "message": "Not found"}), 404
 
+    user_id = m.user_id
+    memory_id = m.id
     db.session.delete(m)
     db.session.commit()
+    unindex_memory_snippets(user_id, [memory_id])
+    rebuild_user_memory_summary(user_id)
     return jsonify({"status": True, "message": "Deleted"}), 200
 
 
@@ -1,58 +1,64 @@
-from flask import jsonify, request
+from flask import Response, current_app, jsonify, request, stream_with_context
 from Models.Message import Message, db
 from Models.DocPermission import DocPermission
 from Models.User import User
 from Models.Chat import Chat
-from sqlalchemy import desc
+from sqlalchemy import desc, select
 from datetime import datetime
-from Models.DocCall import DocCall
-from utils.memory_utils import build_memory_snippet, get_user_memory_context, update_user_memory
-import speech_recognition as sr
+from utils.doc_call_buffer import doc_call_buffer
+from utils.memory_utils import (
+    enqueue_memory_update,
+    get_user_memory_context,
+    retrieve_user_memories,
+)
+from utils import rag_client
+from utils.rag_client import RagServiceError
+from utils.user_context import UserContext, user_context_cache
+from utils.stage_plan import StagePlan
+from utils.answer_cache import ANSWER_CACHE_ENABLED, CachedAnswer, answer_cache
 import asyncio
 import json
 import os
 import requests
 from pathlib import Path
 import re
-from openai import OpenAI
+from utils.llm_gateway import LLMGateway
+from utils.prompt_builder import build_prompt
+from utils.voice_pipeline import transcribe_voice_message
+from utils.voice_reply import VoiceReply
+from utils.export import FORMATS as EXPORT_FORMATS, export_stream
+from utils.list_query import ListQuery, ListQueryError
+from utils.tts import FORMATS as TTS_FORMATS, default_format as default_tts_format
 from flasgger import swag_from
-from qdrant_client import QdrantClient
-from sentence_transformers import SentenceTransformer, CrossEncoder
 
 
-# грузим один раз (можно вынести выше)
-rerank_model = CrossEncoder("BAAI/bge-reranker-base")
-rag_model = SentenceTransformer("all-MiniLM-L6-v2")
+# Эмбеддинги и CrossEncoder живут в rag_service, API только ходит к нему по HTTP
+RAG_CANDIDATES = 10
+RAG_TOP_K = 3
+# Сколько первых кандидатов реранкать (None — все); подбирается rag_pipeline/benchmark.py
+RAG_RERANK_DEPTH = None
+
+# Режим учёта прав на документы:
+#   permitted — ищем только среди разрешённых документов (фильтр в Qdrant)
+#   annotate  — ищем по всем документам и помечаем доступ в ответе
+PERMISSION_MODE_PERMITTED = "permitted"
+PERMISSION_MODE_ANNOTATE = "annotate"
+RAG_PERMISSION_MODE = os.getenv("RAG_PERMISSION_MODE", PERMISSION_MODE_PERMITTED).strip().lower()
 
-    
 
 def rerank_local(query: str, documents: list, top_k: int = 3):
     """
     Возвращает top_k документов после reranking'а.
     documents — список строк (тексты документов)
+    Если rag_service недоступен, возвращает документы в исходном порядке.
     """
     if not query or not documents:
         return documents[:top_k]
 
-    # готовим пары (query, doc)
-    pairs = [(query, doc) for doc in documents]
-
-    # получаем relevance score
-    scores = rerank_model.predict(pairs)
-
-    # сортируем по убыванию
-    ranked = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)
-
-    return [doc for doc, score in ranked[:top_k]]
-
-QDRANT_HOST = "qdrant"  
-QDRANT_PORT = 6333
-COLLECTION_NAME = "documents_rag"
-
-rag_client = QdrantClient(
-    host=QDRANT_HOST,
-    port=QDRANT_PORT
-)
+    try:
+        return rag_client.rerank(query, documents, top_k=top_k)
+    except RagServiceError:
+        return documents[:top_k]
 
 API_URL = "https://openrouter.ai/api/v1/chat/completions"
 
@@ -124,9 +130,40 @@ def get_last_chat_messages(chat_id, limit=6):
     return llm_messages
 
 
-client = OpenAI(
-    base_url="https://api.polza.ai/api/v1",
-    api_key=os.getenv("OPENROUTER_API_KEY")
+def load_user_context(user_id):
+    """
+    Профиль, разрешённые документы и долговременная память пользователя.
+    Результат кэшируется в процессе, кэш сбрасывается хуками при изменениях.
+    Возвращает None, если пользователь не найден.
+    """
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    return user_context_cache.get_or_load(user_id, _load_user_context_from_db)
+
+
+def _load_user_context_from_db(user_id):
+    user = User.query.get(user_id)
+    if not user:
+        return None
+    permitted = DocPermission.query.with_entities(DocPermission.doc_id).filter_by(issuer_id=user_id).all()
+    return UserContext(
+        user_id=user.id,
+        description=user.description,
+        long_term_memory=get_user_memory_context(user.id),
+        permitted_doc_ids=frozenset(doc_id for (doc_id,) in permitted),
+    )
+
+
+LLM_MODEL = os.getenv("LLM_MODEL", "qwen/qwen-turbo")
+
+# Все вызовы LLM идут через шлюз: склейка одинаковых запросов, лимит
+# одновременных вызовов, пул соединений, ретраи и хеджирование
+llm = LLMGateway(
+    base_url=os.getenv("LLM_BASE_URL", "https://api.polza.ai/api/v1"),
+    api_key=os.getenv("OPENROUTER_API_KEY"),
+    model=LLM_MODEL
 )
 
 
@@ -139,36 +176,29 @@ def _auth_header() -> str:
 
 
 def audio_to_text(audio):
-    # Создаем объект распознавателя речи
-    recognizer = sr.Recognizer()
-
-    # Загружаем аудио файл
-    audio_file = sr.AudioFile(audio)
+    # Распознаём речь движком STT_ENGINE (по умолчанию локальный faster-whisper на CPU);
+    # длинные записи режутся по паузам и распознаются параллельно
+    return transcribe_voice_message(audio).text
 
-    # Распознаем речь из аудио файла
-    with audio_file as source:
-        audio_data = recognizer.record(source)
-        text = recognizer.recognize_google(audio_data, language="ru-RU")
-
-    return text
-
-def query_rag_context(query: str, top_k=5, return_list=False):
+def query_rag_context(query: str, top_k=5, return_list=False, candidates=None, rerank=True, doc_ids=None,
+                      query_vector=None, rerank_depth=None):
     """
-    Возвращает топ-K документов для RAG с текстом и метаданными
+    Возвращает топ-K документов для RAG с текстом и метаданными.
+    candidates — сколько кандидатов достать из Qdrant до реранка (по умолчанию top_k)
+    rerank_depth — сколько первых кандидатов реранкать (по умолчанию все)
+    doc_ids — если задан, поиск идёт только по этим документам (payload-фильтр Qdrant)
+    query_vector — эмбеддинг запроса, если уже посчитан
     """
     try:
-        emb = rag_model.encode(query).tolist()
-        results = rag_client.search(
-            collection_name=COLLECTION_NAME,
-            query_vector=emb,
-            limit=top_k
+        docs = rag_client.retrieve(
+            query,
+            candidates=candidates or top_k,
+            top_k=top_k,
+            rerank=rerank,
+            doc_ids=doc_ids,
+            query_vector=query_vector,
+            rerank_depth=rerank_depth
         )
-        docs = []
-        for hit in results:
-            docs.append({
-                'text': hit.payload.get("text", ""),
-                'doc_id': hit.payload.get("doc_id", hit.id)  # уникальный id документа
-            })
 
         if return_list:
             return docs
@@ -180,91 +210,140 @@ def query_rag_context(query: str, top_k=5, return_list=False):
         return f"RAG context unavailable: {e}"
 
 
-def request_gpt_openrouter(
+def retrieve_documents(text, permitted_doc_ids=None, permission_mode=None, query_vector=None):
+    """
+    Топ документов для вопроса с учётом режима прав (см. RAG_PERMISSION_MODE).
+    """
+    mode = permission_mode or RAG_PERMISSION_MODE
+    # В режиме permitted фильтр по правам применяется в самом поиске,
+    # поэтому кандидаты и rerank тратятся только на доступные документы
+    search_doc_ids = None
+    if mode == PERMISSION_MODE_PERMITTED:
+        search_doc_ids = permitted_doc_ids or frozenset()
+
+    # rag_service достаёт много кандидатов и сам делает rerank
+    return query_rag_context(
+        text,
+        top_k=RAG_TOP_K,
+        return_list=True,
+        candidates=RAG_CANDIDATES,
+        doc_ids=search_doc_ids,
+        query_vector=query_vector,
+        rerank_depth=RAG_RERANK_DEPTH
+    )
+
+
+def build_llm_request(
     text,
     previous_messages=None,
     description=None,
     user_id=None,
     long_term_memory=None,
+    permission_mode=None,
+    permitted_doc_ids=None,
+    retrieved_docs=None,
+    memories=None,
 ):
     """
-    Sends a request to OpenRouter GPT-5.1 with reasoning support.
-    previous_messages: list of dicts [{'role': 'user'/'assistant', 'content': str, 'reasoning_details': {...}}]
+    Готовит всё, что нужно для запроса к LLM: RAG-контекст, права на документы
+    и список messages. Используется и обычным, и потоковым ответом.
+    retrieved_docs — уже найденные документы (если поиск выполнен заранее).
+    memories — заметки памяти, релевантные вопросу; остаток бюджета памяти
+    заполняется из сводки long_term_memory (без заметок — только она).
+    Размер промпта ограничен бюджетами токенов (utils/prompt_builder.py).
+    Возвращает {"messages", "context", "documents_info", "prompt_usage"}.
     """
-    asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
-    
-    if user_id:
+    if permitted_doc_ids is None:
         # Получаем все разрешения пользователя
         permissions = DocPermission.query.filter_by(issuer_id=user_id).all()
         permitted_doc_ids = {p.doc_id for p in permissions}  # множество ID доступных документов
-    else:
-        return {"status": False, "message": "User not found"}
 
-    # сначала получаем много кандидатов
-    raw_context_docs = query_rag_context(text, top_k=10, return_list=True)
+    if retrieved_docs is None:
+        retrieved_docs = retrieve_documents(text, permitted_doc_ids, permission_mode)
+    top_docs = retrieved_docs
 
-    # Берём только тексты для CrossEncoder
-    doc_texts = [d['text'] for d in raw_context_docs]
+    # Проверяем доступ к найденным документам
+    doc_access_info = {}
+    for i, d in enumerate(top_docs):
+        doc_id = d['doc_id']
+        has_permission = doc_id in permitted_doc_ids
+        # Формируем поля для ответа
+        doc_access_info[f"doc_{i+1}"] = doc_id
+        doc_access_info[f"doc_{i+1}_permission"] = has_permission
+
+    # 3️⃣ Собираем промпт в пределах бюджета токенов: чанки в порядке реранка,
+    # из памяти — самое относящееся к вопросу, из истории — самые свежие реплики
+    prompt = build_prompt(
+        text,
+        docs=top_docs,
+        memory=memories if memories is not None else long_term_memory,
+        history=previous_messages,
+        description=description,
+        # сводка дополняет заметки: память, ещё не попавшая в индекс, не теряется
+        memory_summary=long_term_memory if memories is not None else None
+    )
 
-    # Rerank
-    top_texts = rerank_local(text, doc_texts, top_k=3)
+    # 4️⃣ Сохраняем обращения к документам (буфер, сбрасывается в БД пачкой в фоне)
+    doc_call_buffer.add(user_id, [d['doc_id'] for d in prompt.docs])
 
+    return {
+        "messages": prompt.messages,
+        "context": prompt.context,
+        "documents_info": doc_access_info,
+        "prompt_usage": prompt.usage
+    }
 
-    # Восстанавливаем словари с doc_id и проверяем доступ
-    top_docs = []
-    doc_access_info = {}
-    for i, d in enumerate(raw_context_docs):
-        if d['text'] in top_texts:
-            doc_id = d['doc_id']
-            has_permission = doc_id in permitted_doc_ids
-            top_docs.append(d)
-            # Формируем поля для ответа
-            doc_access_info[f"doc_{i+1}"] = doc_id
-            doc_access_info[f"doc_{i+1}_permission"] = has_permission
-
-    # Формируем контекст из разрешённых и неразрешённых документов (можно включать все, а в тексте AI указывать доступ)
-    context = "\n\n".join([d['text'] for d in top_docs])
-
-    # 3️⃣ Сохраняем обращения к документам
-    if user_id:
-        for d in top_docs:
-            doc_id = d['doc_id']
-            dc = DocCall.query.filter_by(user_id=user_id, doc_id=doc_id).first()
-            if dc:
-                dc.call_count += 1
-            else:
-                dc = DocCall(user_id=user_id, doc_id=doc_id, call_count=1)
-                db.session.add(dc)
-        db.session.commit()
 
-    # 4️⃣ Подготавливаем системное сообщение
-    memory_context = long_term_memory if long_term_memory else "Нет сохранённых заметок о пользователе"
-    system_prompt = (
-        "Ты - документный помощник, который развернуто и грамотно отвечает на вопросы с "
-        "использованием информации из предоставленного документа. Твоя задача помогать в "
-        f"рабочих задачах, вот основная информация про меня: {description}."
-    )
+def request_gpt_openrouter(
+    text,
+    previous_messages=None,
+    description=None,
+    user_id=None,
+    long_term_memory=None,
+    permission_mode=None,
+    permitted_doc_ids=None,
+    retrieved_docs=None,
+    memories=None,
+):
+    """
+    Sends a request to OpenRouter GPT-5.1 with reasoning support.
+    previous_messages: list of dicts [{'role': 'user'/'assistant', 'content': str, 'reasoning_details': {...}}]
+    permission_mode: "permitted" / "annotate", по умолчанию RAG_PERMISSION_MODE
+    permitted_doc_ids: разрешённые doc_id, если уже известны (иначе грузим из БД)
+    retrieved_docs: документы, найденные заранее (иначе ищем здесь)
+    memories: релевантные вопросу заметки памяти, дополняются сводкой long_term_memory
+    """
+    asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+    
+    if not user_id:
+        return {"status": False, "message": "User not found"}
 
-    user_content = (
-        f"Контекст из документов: {context}. Долгосрочная память о пользователе: {memory_context}. "
-        f"Вопрос: {text}"
+    prepared = build_llm_request(
+        text,
+        previous_messages=previous_messages,
+        description=description,
+        user_id=user_id,
+        long_term_memory=long_term_memory,
+        permission_mode=permission_mode,
+        permitted_doc_ids=permitted_doc_ids,
+        retrieved_docs=retrieved_docs,
+        memories=memories
     )
-    messages = [{"role": "system", "content": system_prompt}]
-    if previous_messages:
-        for m in previous_messages:
-            if m.get("content") and isinstance(m.get("content"), str):
-                messages.append({"role": m["role"], "content": m["content"]})
-
-    messages.append({"role": "user", "content": user_content})
+    context = prepared["context"]
+    doc_access_info = prepared["documents_info"]
+    prompt_usage = prepared["prompt_usage"]
 
     # 5️⃣ Отправка запроса к GPT
     try:
-        response = client.chat.completions.create(
-            model="qwen/qwen-turbo",
-            messages=messages,
+        response = llm.complete(
+            prepared["messages"],
             extra_body={"reasoning": {"enabled": True}}
         )
         msg = response.choices[0].message
+        usage = getattr(response, "usage", None)
+        if usage is not None and getattr(usage, "prompt_tokens", None):
+            # сколько насчитал сам провайдер — для сверки с локальной оценкой
+            prompt_usage = dict(prompt_usage, upstream_prompt_tokens=usage.prompt_tokens)
         if isinstance(msg, dict):
             content = msg.get("content", "")
             reasoning_details = msg.get("reasoning_details", {})
@@ -277,30 +356,58 @@ def request_gpt_openrouter(
             "content": content,
             "reasoning_details": reasoning_details,
             "context": context,
-            "documents_info": doc_access_info
+            "documents_info": doc_access_info,
+            "prompt_usage": prompt_usage
         }
     except Exception as e:
         return {
             "content": f"Ошибка запроса к AI: {e}",
             "reasoning_details": {},
             "context": context,
-            "documents_info": doc_access_info
+            "documents_info": doc_access_info,
+            "prompt_usage": prompt_usage,
+            "failed": True
         }
 
 
+def stream_gpt_openrouter(messages):
+    """
+    Потоковый вариант запроса к LLM: отдаёт фрагменты текста по мере генерации.
+    """
+    return llm.stream(messages, extra_body={"reasoning": {"enabled": True}})
+
+
+MESSAGE_LIST = ListQuery(
+    Message,
+    fields={
+        'id': Message.id,
+        'message': Message.message,
+        'time': Message.time,
+        'type': Message.type,
+        'sender': Message.sender,
+        'chat_id': Message.chat_id,
+    },
+    default_fields=('id', 'message', 'time', 'type', 'sender'),
+    filters={'chat_id': Message.chat_id, 'type': Message.type, 'sender': Message.sender},
+)
+
+
 """
 method=GET
+query: limit, after, fields, count, chat_id, type, sender
 
 returns {
     status: true/false,
     message: OK / Error
     data = {{id, theme_id, message, time, type, sender}, ...} if success
+    next_cursor = id to pass as `after` for the next page, null on the last one
 }
 
 sender: false -> user / true -> server
 """
 @swag_from({
     'tags': ['Messages'],
+    'parameters': MESSAGE_LIST.swagger_parameters(),
     'responses': {
         200: {
             'description': 'Список сообщений',
@@ -321,29 +428,96 @@ sender: false -> user / true -> server
                             'sender': {'type': 'boolean'}
                         }
                         }
-                    }
+                    },
+                    'next_cursor': {'type': 'string'}
                 }
             }
-        }
+        },
+        400: {'description': 'Неизвестный фильтр или поле, некорректный курсор или limit'}
     }
 })
 def get_messages():
-    messages = Message.query.all()
+    try:
+        page = MESSAGE_LIST.page(request.args)
+    except ListQueryError as e:
+        return jsonify({'status': False, 'message': str(e)}), 400
     output = {
-        'status': True if len(messages) > 0 else False,
-        'message': "OK" if len(messages) > 0 else "Empty table",
-        'data': []
+        'status': True if len(page.items) > 0 else False,
+        'message': "OK" if len(page.items) > 0 else "Empty table",
+        'data': page.items,
+        'next_cursor': page.next_cursor
     }
-    for message in messages:
-        user_data = {
-            'id': message.id,
-            'message': message.message,
-            'time': message.time,
-            'type': message.type,
-            'sender': message.sender
+    if page.total is not None:
+        output['total'] = page.total
+    return jsonify(output), 200, page.headers
+
+
+EXPORT_FIELDS = ('id', 'chat_id', 'user_id', 'message', 'time', 'type', 'sender')
+
+
+@swag_from({
+    'tags': ['Messages'],
+    'description': (
+        'Выгрузка сообщений для аналитики потоком: NDJSON (одна JSON-строка на сообщение) или CSV, '
+        'по желанию сжатая gzip. Строки читаются из базы серверным курсором пачками по EXPORT_BATCH_SIZE, '
+        'так что память воркера не зависит от объёма выгрузки. Порядок — по id.'
+    ),
+    'produces': ['application/x-ndjson', 'text/csv', 'application/gzip'],
+    'parameters': [
+        {'name': 'format', 'in': 'query', 'type': 'string', 'enum': sorted(EXPORT_FORMATS), 'required': False,
+         'description': 'ndjson (по умолчанию) или csv'},
+        {'name': 'gzip', 'in': 'query', 'type': 'boolean', 'required': False,
+         'description': 'Сжать выгрузку (файл .gz)'},
+        {'name': 'chat_id', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Только этот чат'},
+        {'name': 'user_id', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Только чаты этого пользователя'},
+        {'name': 'since', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Время сообщения не раньше (ISO 8601, например 2024-05-01T00:00:00)'},
+        {'name': 'until', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Время сообщения раньше (ISO 8601)'}
+    ],
+    'responses': {
+        200: {'description': 'Файл выгрузки (отдаётся потоком)'},
+        400: {'description': 'Неверный формат или фильтр'}
+    }
+})
+def export_messages():
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'status': False, 'message': f'Unsupported format, expected one of {sorted(EXPORT_FORMATS)}'}), 400
+    compress = request.args.get('gzip', '0').lower() in ('1', 'true', 'yes')
+
+    stmt = (
+        select(Message.id, Message.chat_id, Chat.user_id, Message.message, Message.time, Message.type, Message.sender)
+        .join(Chat, Chat.id == Message.chat_id)
+        .order_by(Message.id)
+    )
+    try:
+        chat_id = int(request.args['chat_id']) if request.args.get('chat_id') else None
+        user_id = int(request.args['user_id']) if request.args.get('user_id') else None
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+        until = datetime.fromisoformat(request.args['until']) if request.args.get('until') else None
+    except ValueError as e:
+        return jsonify({'status': False, 'message': f'Invalid filter: {e}'}), 400
+    if chat_id is not None:
+        stmt = stmt.where(Message.chat_id == chat_id)
+    if user_id is not None:
+        stmt = stmt.where(Chat.user_id == user_id)
+    if since is not None:
+        stmt = stmt.where(Message.time >= since)
+    if until is not None:
+        stmt = stmt.where(Message.time < until)
+
+    filename = 'messages' + EXPORT_FORMATS[fmt]['extension'] + ('.gz' if compress else '')
+    return Response(
+        stream_with_context(export_stream(stmt, EXPORT_FIELDS, fmt, gzip=compress)),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt]['mimetype'],
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'
         }
-        output['data'].append(user_data)
-    return jsonify(output)
+    )
 
 """
 method=GET/message_id
@@ -415,6 +589,149 @@ def get_message(item_id):
         return jsonify({'status': False, 'message': 'Message not found'}), 404
 
 
+def _chat_exists(chat_id):
+    return Chat.query.get(chat_id) is not None
+
+
+def _embed_question(message_text):
+    """(эмбеддинг, поколение индекса) для кэша ответов или None."""
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    try:
+        return rag_client.embed(message_text)
+    except (RagServiceError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _lookup_cached_answer(user_context, embedding, previous_messages=None):
+    # Ответ в чате с историей зависит от предыдущих реплик — такие не кэшируем
+    if embedding is None or previous_messages:
+        return None
+    vector, generation = embedding
+    return answer_cache.lookup(vector, user_context.user_id, user_context.permitted_doc_ids, generation)
+
+
+def _retrieve_for_request(user_context, message_text, embedding, cached_answer):
+    if cached_answer is not None:
+        return []  # ответ уже есть, поиск не нужен
+    query_vector = embedding[0] if embedding else None
+    return retrieve_documents(message_text, user_context.permitted_doc_ids, query_vector=query_vector)
+
+
+def _retrieve_memories(user_context, message_text, embedding, cached_answer):
+    if cached_answer is not None:
+        return None
+    query_vector = embedding[0] if embedding else None
+    return retrieve_user_memories(user_context.user_id, message_text, query_vector=query_vector)
+
+
+def _remember_answer(req, answer):
+    """Кладёт ответ LLM в семантический кэш, если запрос это допускает."""
+    embedding = req['embedding']
+    if embedding is None or req['previous_messages'] or answer.get('failed') or not answer.get('content'):
+        return
+    vector, generation = embedding
+    answer_cache.put(
+        vector,
+        req['user_id'],
+        req['user_context'].permitted_doc_ids,
+        generation,
+        CachedAnswer(
+            content=answer['content'],
+            context=answer.get('context', ''),
+            documents_info=dict(answer.get('documents_info') or {}),
+            reasoning_details=answer.get('reasoning_details') or {},
+            doc_ids=tuple(d['doc_id'] for d in req['retrieved_docs'] if d.get('doc_id') is not None)
+        )
+    )
+
+
+def _resolve_message_request():
+    """
+    Общая часть add_message и add_message_stream: пользователь, чат, история,
+    текст сообщения (с распознаванием аудио) и поиск документов.
+    Независимые стадии выполняются параллельно (StagePlan), поэтому задержка
+    до LLM ближе к самой медленной стадии, а не к их сумме.
+    Возвращает (данные, None) или (None, ответ с ошибкой).
+    """
+    user_id = request.form.get('user_id', -1)
+    chat_id = request.form.get('chat_id')
+    time_now = datetime.now()
+    msg_type = request.form.get('type', '0')  # по умолчанию текст
+
+    # Обрабатываем аудио-сообщения
+    if msg_type == '1':
+        if 'message' not in request.files:
+            return None, (jsonify({'status': False, 'message': 'No file part'}), 400)
+        message_file = request.files['message']
+    else:
+        message_text = request.form.get('message')
+        if not message_text:
+            return None, (jsonify({'status': False, 'message': 'Message text is required'}), 400)
+
+    try:
+        chat_id = int(chat_id) if chat_id else None
+    except ValueError:
+        return None, (jsonify({'status': False, 'message': 'Invalid chat_id'}), 400)
+
+    # Пользователь и чат проверяются до стадий: запрос с неизвестным
+    # user_id или chat_id не тратит STT, эмбеддинг, поиск и память
+    user_context = load_user_context(user_id)  # профиль, права и память (обычно из кэша)
+    if not user_context:
+        return None, (jsonify({'status': False, 'message': 'User not found'}), 404)
+    user_id = user_context.user_id
+    if chat_id and not _chat_exists(chat_id):
+        return None, (jsonify({'status': False, 'message': 'Chat not found'}), 404)
+
+    plan = StagePlan(current_app._get_current_object())
+    if msg_type == '1':
+        # Распознавание по сегментам речи (VAD) параллельно; время, RTF и
+        # тайминги сегментов возвращаются в ответе как stt
+        plan.add('transcript', transcribe_voice_message, message_file)
+        plan.add('message_text', lambda transcript: transcript.text, after=('transcript',))
+    else:
+        plan.add('message_text', lambda: message_text)
+    if chat_id:
+        plan.add('history', get_last_chat_messages, chat_id, 6)
+    # Семантический кэш ответов: эмбеддинг вопроса + права пользователя (+ история)
+    plan.add('embedding', _embed_question, after=('message_text',))
+    lookup_after = ('embedding',) + (('history',) if chat_id else ())
+    plan.add('cached_answer', _lookup_cached_answer, user_context, after=lookup_after)
+    plan.add('retrieval', _retrieve_for_request, user_context, after=('message_text', 'embedding', 'cached_answer'))
+    # Из долговременной памяти берём только заметки, близкие к вопросу
+    plan.add('memory', _retrieve_memories, user_context, after=('message_text', 'embedding', 'cached_answer'))
+    results = plan.join()
+
+    if not results['message_text']:
+        return None, (jsonify({'status': False, 'message': 'Speech not recognized'}), 400)
+
+    # Создаём чат, если chat_id не указан
+    if not chat_id:
+        new_chat = Chat(name=f"Chat with User {user_id}", user_id=user_id)
+        db.session.add(new_chat)
+        db.session.commit()
+        chat_id = new_chat.id
+        previous_messages = []
+    else:
+        previous_messages = results['history']
+
+    return {
+        'user_context': user_context,
+        'user_id': user_id,
+        'chat_id': chat_id,
+        'msg_type': msg_type,
+        'time_now': time_now,
+        'message_text': results['message_text'],
+        'previous_messages': previous_messages,
+        'retrieved_docs': results['retrieval'],
+        'memories': results['memory'],
+        'stt': results['transcript'].timings() if 'transcript' in results else None,
+        'embedding': results['embedding'],
+        'cached_answer': results['cached_answer'],
+        'timings': plan.timings_ms()
+    }, None
+
+
 @swag_from({
     'tags': ['Messages'],
     'consumes': ['application/x-www-form-urlencoded', 'multipart/form-data'],
@@ -467,7 +784,8 @@ def get_message(item_id):
                     'redir': {'type': 'string', 'description': 'URL для перенаправления (если есть)'},
                     'message_id': {'type': 'integer', 'description': 'ID сохраненного сообщения пользователя'},
                     'chat_id': {'type': 'integer', 'description': 'ID чата'},
-                    'reasoning_details': {'type': 'object', 'description': 'Детали рассуждений AI (если включены)'}
+                    'reasoning_details': {'type': 'object', 'description': 'Детали рассуждений AI (если включены)'},
+                    'cached': {'type': 'boolean', 'description': 'Ответ взят из семантического кэша'}
                 }
             }
         },
@@ -484,59 +802,52 @@ def get_message(item_id):
     }
 })
 def add_message():
-    user_id = request.form.get('user_id', -1)
-    chat_id = request.form.get('chat_id')
-    time_now = datetime.now()
-    msg_type = request.form.get('type', '0')  # по умолчанию текст
     sender = False
     redir = ""
 
-    # Проверяем, что пользователь существует
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'status': False, 'message': 'User not found'}), 404
-
-    # Создаём чат, если chat_id не указан
-    if not chat_id:
-        new_chat = Chat(name=f"Chat with User {user_id}", user_id=user_id)
-        db.session.add(new_chat)
-        db.session.commit()
-        chat_id = new_chat.id
-    else:
-        chat_id = int(chat_id)
-        chat = Chat.query.get(chat_id)
-        if not chat:
-            return jsonify({'status': False, 'message': 'Chat not found'}), 404
-        
-    user_description = user.description
-    previous_messages = get_last_chat_messages(chat_id, limit=6)
-    long_term_memory = get_user_memory_context(user_id)
-
-    # Обрабатываем аудио-сообщения
-    if msg_type == '1':
-        if 'message' not in request.files:
-            return jsonify({'status': False, 'message': 'No file part'}), 400
-        message_file = request.files['message']
-        message_text = audio_to_text(message_file)
+    req, error = _resolve_message_request()
+    if error:
+        return error
+    user_context = req['user_context']
+    user_id = req['user_id']
+    chat_id = req['chat_id']
+    msg_type = req['msg_type']
+    time_now = req['time_now']
+    message_text = req['message_text']
+    previous_messages = req['previous_messages']
+    user_description = user_context.description
+    long_term_memory = user_context.long_term_memory
+
+    cached = req['cached_answer']
+    if cached is not None:
+        # Такой же вопрос при тех же правах и том же индексе уже задавали
+        doc_call_buffer.add(user_id, cached.doc_ids)
+        assistant_msg_obj = {
+            "content": cached.content,
+            "reasoning_details": cached.reasoning_details,
+            "context": cached.context,
+            "documents_info": cached.documents_info
+        }
     else:
-        message_text = request.form.get('message')
-        if not message_text:
-            return jsonify({'status': False, 'message': 'Message text is required'}), 400
-
-    # Отправка запроса с проверкой доступа к документам
-    assistant_msg_obj = request_gpt_openrouter(
-        text=message_text,
-        previous_messages=previous_messages,
-        description=user_description,
-        user_id=user_id,
-        long_term_memory=long_term_memory
-    )
+        # Отправка запроса с проверкой доступа к документам
+        assistant_msg_obj = request_gpt_openrouter(
+            text=message_text,
+            previous_messages=previous_messages,
+            description=user_description,
+            user_id=user_id,
+            long_term_memory=long_term_memory,
+            permitted_doc_ids=user_context.permitted_doc_ids,
+            retrieved_docs=req['retrieved_docs'],
+            memories=req['memories']
+        )
+        _remember_answer(req, assistant_msg_obj)
 
     # Извлечение данных из словаря
     assistant_msg = assistant_msg_obj.get("content", "")
     reasoning_details = assistant_msg_obj.get("reasoning_details", {})
     rag_context = assistant_msg_obj.get("context", "")
     documents_info = assistant_msg_obj.get("documents_info", {})  # doc_1, doc_1_permission ...
+    prompt_usage = assistant_msg_obj.get("prompt_usage")
 
     # Сохраняем сообщение пользователя в БД
     user_message = Message(
@@ -557,12 +868,11 @@ def add_message():
 
     db.session.add(user_message)
     db.session.add(ai_message)
+    db.session.flush()
+    # Память пользователя обновит фоновая очередь; задача коммитится вместе с сообщениями
+    enqueue_memory_update(user_id, message_text, assistant_msg, ai_message.id)
     db.session.commit()
 
-    # Обновляем долговременную память пользователя, чтобы последующие обращения учитывали контекст
-    memory_snippet = build_memory_snippet(message_text, assistant_msg)
-    update_user_memory(user_id, memory_snippet)
-
     # Возвращаем ответ с информацией о документах
     response_data = {
         'status': True,
@@ -575,8 +885,236 @@ def add_message():
         'chat_id': chat_id,
         'reasoning_details': reasoning_details,
         'chat_history_context': json.dumps(previous_messages, ensure_ascii=False),
-        'description': user_description
+        'description': user_description,
+        'cached': cached is not None,
+        'prompt_usage': prompt_usage,
+        'pre_llm_timings_ms': req['timings'],
+        'stt': req['stt']
     }
     response_data.update(documents_info)  # добавляем doc_1, doc_1_permission, ...
 
     return jsonify(response_data), 201
+
+
+def _sse(event, data):
+    """Одно событие Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _answer_events(req):
+    """
+    Готовит ответ AI на разобранный запрос и возвращает генератор событий
+    (event, data): meta, token..., error, done. Сообщение пользователя
+    сохраняется сразу, ответ AI — когда поток закончится.
+    """
+    user_context = req['user_context']
+    user_id = req['user_id']
+    chat_id = req['chat_id']
+    message_text = req['message_text']
+    cached = req['cached_answer']
+
+    if cached is not None:
+        doc_call_buffer.add(user_id, cached.doc_ids)
+        prepared = {
+            'messages': None,
+            'context': cached.context,
+            'documents_info': cached.documents_info,
+            'prompt_usage': None
+        }
+    else:
+        prepared = build_llm_request(
+            message_text,
+            previous_messages=req['previous_messages'],
+            description=user_context.description,
+            user_id=user_id,
+            long_term_memory=user_context.long_term_memory,
+            permitted_doc_ids=user_context.permitted_doc_ids,
+            retrieved_docs=req['retrieved_docs'],
+            memories=req['memories']
+        )
+
+    # Сообщение пользователя сохраняем сразу, ответ AI — когда поток закончится
+    user_message = Message(
+        message=message_text,
+        time=req['time_now'],
+        type=bool(int(req['msg_type'])),
+        sender=False,
+        chat_id=chat_id
+    )
+    db.session.add(user_message)
+    db.session.commit()
+
+    meta = {
+        'chat_id': chat_id,
+        'message_id': user_message.id,
+        'user_msg_time': user_message.time.strftime('%Y-%m-%d %H:%M:%S'),
+        'rag_context': prepared['context'],
+        'cached': cached is not None,
+        'prompt_usage': prepared['prompt_usage'],
+        'pre_llm_timings_ms': req['timings'],
+        'stt': req['stt']
+    }
+    meta.update(prepared['documents_info'])
+
+    def events():
+        parts = []
+        saved = False
+
+        def persist_answer():
+            assistant_msg = "".join(parts)
+            ai_message = Message(
+                message=assistant_msg,
+                time=datetime.now(),
+                type=False,
+                sender=True,
+                chat_id=chat_id
+            )
+            db.session.add(ai_message)
+            db.session.flush()
+            enqueue_memory_update(user_id, message_text, assistant_msg, ai_message.id)
+            db.session.commit()
+            return ai_message
+
+        try:
+            yield 'meta', meta
+            if cached is not None:
+                # Из кэша ответ готов целиком — отдаём одним событием
+                parts.append(cached.content)
+                yield 'token', {'content': cached.content}
+            else:
+                try:
+                    for delta in stream_gpt_openrouter(prepared['messages']):
+                        parts.append(delta)
+                        yield 'token', {'content': delta}
+                    _remember_answer(req, {
+                        'content': "".join(parts),
+                        'context': prepared['context'],
+                        'documents_info': prepared['documents_info']
+                    })
+                except Exception as e:
+                    parts[:] = [f"Ошибка запроса к AI: {e}"]
+                    yield 'error', {'message': parts[0]}
+
+            ai_message = persist_answer()
+            saved = True
+            yield 'done', {
+                'status': True,
+                'ai_message_id': ai_message.id,
+                'ai_msg_time': ai_message.time.strftime('%Y-%m-%d %H:%M:%S'),
+                'message': ai_message.message
+            }
+        finally:
+            # Клиент отключился посреди генерации — сохраняем то, что успели получить
+            if not saved and parts:
+                persist_answer()
+
+    return events()
+
+
+def _sse_response(stream):
+    return Response(
+        stream_with_context(stream),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@swag_from({
+    'tags': ['Messages'],
+    'consumes': ['application/x-www-form-urlencoded', 'multipart/form-data'],
+    'produces': ['text/event-stream'],
+    'description': (
+        'Потоковый вариант POST /api/messages/. Ответ — text/event-stream: '
+        'сначала событие meta (чат, id сообщения пользователя, RAG-контекст, doc_N/doc_N_permission), '
+        'затем события token с фрагментами ответа по мере генерации, в конце done '
+        '(id и время сохранённого ответа AI) или error.'
+    ),
+    'parameters': [
+        {'name': 'user_id', 'in': 'formData', 'type': 'integer', 'required': True, 'description': 'ID пользователя'},
+        {'name': 'chat_id', 'in': 'formData', 'type': 'integer', 'required': False,
+         'description': 'ID чата. Если не указан, будет создан новый чат'},
+        {'name': 'type', 'in': 'formData', 'type': 'string', 'required': True,
+         'description': 'Тип сообщения (0 - текст, 1 - аудио)'},
+        {'name': 'message', 'in': 'formData', 'type': 'string', 'required': False,
+         'description': 'Текст сообщения (для type=0) или аудиофайл (для type=1)'}
+    ],
+    'responses': {
+        200: {'description': 'Поток событий SSE'},
+        400: {'description': 'Ошибка в запросе'},
+        404: {'description': 'Пользователь или чат не найден'}
+    }
+})
+def add_message_stream():
+    req, error = _resolve_message_request()
+    if error:
+        return error
+    events = _answer_events(req)
+
+    def generate():
+        try:
+            for event, data in events:
+                yield _sse(event, data)
+        finally:
+            events.close()
+
+    return _sse_response(generate())
+
+
+@swag_from({
+    'tags': ['Messages'],
+    'consumes': ['application/x-www-form-urlencoded', 'multipart/form-data'],
+    'produces': ['text/event-stream'],
+    'description': (
+        'Голосовой ответ: те же события, что у POST /api/messages/stream, плюс события audio. '
+        'Ответ LLM режется на предложения по мере генерации, каждое синтезируется сразу, '
+        'пока модель пишет следующее; audio содержит index, text, format, mimetype и data '
+        '(base64, самостоятельный файл на предложение — проигрывать по порядку index). '
+        'В done добавляется voice: first_sentence_ms, first_audio_ms, synth_ms, audio_seconds.'
+    ),
+    'parameters': [
+        {'name': 'user_id', 'in': 'formData', 'type': 'integer', 'required': True, 'description': 'ID пользователя'},
+        {'name': 'chat_id', 'in': 'formData', 'type': 'integer', 'required': False,
+         'description': 'ID чата. Если не указан, будет создан новый чат'},
+        {'name': 'type', 'in': 'formData', 'type': 'string', 'required': True,
+         'description': 'Тип сообщения (0 - текст, 1 - аудио)'},
+        {'name': 'message', 'in': 'formData', 'type': 'string', 'required': False,
+         'description': 'Текст сообщения (для type=0) или аудиофайл (для type=1)'},
+        {'name': 'format', 'in': 'formData', 'type': 'string', 'enum': sorted(TTS_FORMATS), 'required': False,
+         'description': 'Формат аудио (по умолчанию TTS_FORMAT)'}
+    ],
+    'responses': {
+        200: {'description': 'Поток событий SSE'},
+        400: {'description': 'Ошибка в запросе'},
+        404: {'description': 'Пользователь или чат не найден'}
+    }
+})
+def add_voice_message():
+    fmt = (request.form.get('format') or default_tts_format()).lower()
+    if fmt not in TTS_FORMATS:
+        return jsonify({'status': False, 'message': f'Unsupported format, expected one of {sorted(TTS_FORMATS)}'}), 400
+    req, error = _resolve_message_request()
+    if error:
+        return error
+    events = _answer_events(req)
+
+    def generate():
+        # Синтез идёт в отдельном потоке: пока LLM пишет следующее предложение,
+        # предыдущее уже озвучивается и уходит клиенту
+        voice = VoiceReply(fmt)
+        try:
+            for event, data in events:
+                if event == 'token':
+                    voice.feed(data['content'])
+                elif event == 'done':
+                    voice.finish()
+                    for chunk in voice.drain(wait=True):
+                        yield _sse('audio', chunk)
+                    data = dict(data, voice=voice.timings())
+                yield _sse(event, data)
+                for chunk in voice.drain():
+                    yield _sse('audio', chunk)
+        finally:
+            voice.close()
+            events.close()
+
+    return _sse_response(generate())
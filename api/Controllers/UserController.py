@@ -5,7 +5,12 @@ from Models.Employee import Employee
 from Models.Manager import Manager
 from datetime import datetime
 from utils.jwt_utils import generate_access_token, generate_refresh_token, decode_access_token
-from utils.auth_helpers import authenticate_user, create_new_user, build_auth_response
+from utils.auth_helpers import authenticate_user, busy_error, create_new_user, build_auth_response
+from utils.password_hasher import PasswordHasherBusy
+from utils.user_context import invalidate_user_context
+from utils.list_query import Computed, ListQuery, ListQueryError
+from sqlalchemy import case, func
+from sqlalchemy.orm import configure_mappers, joinedload
 
 import json
 from flask import jsonify, Blueprint
@@ -21,9 +26,98 @@ def str_to_bool(value):
     return False
 
 
+# Роль считается в SQL по внешним join'ам на профили (как User.role: менеджер важнее)
+USER_ROLE = case((Manager.id.isnot(None), 'manager'), (Employee.id.isnot(None), 'employee'))
+
+
+def _user_profiles():
+    """Loader options fetching the profiles behind User.role and User.manager_id with the user."""
+    configure_mappers()  # backref-атрибуты профилей появляются только после конфигурации мапперов
+    return [joinedload(User.manager_profile), joinedload(User.employee_profile)]
+
+
+def _role_info(role, profile_id, manager_id):
+    if role == 'manager':
+        return {'role': 'manager', 'id': profile_id}
+    if role == 'employee':
+        return {'role': 'employee', 'id': profile_id, 'manager_id': manager_id}
+    return None
+
+
+# Один SELECT на страницу (и на пользователя в get_user), без ленивых загрузок профилей
+USER_LIST = ListQuery(
+    User,
+    fields={
+        'id': User.id,
+        'login': User.login,
+        'first_name': User.first_name,
+        'last_name': User.last_name,
+        'password': User.password,
+        'is_admin': User.is_admin,
+        'description': User.description,
+        'role': Computed([USER_ROLE, func.coalesce(Manager.id, Employee.id), Employee.manager_id], _role_info),
+    },
+    filters={'login': User.login, 'is_admin': User.is_admin, 'role': USER_ROLE},
+    outerjoins=[(Manager, Manager.user_id == User.id), (Employee, Employee.user_id == User.id)],
+)
+
+MANAGER_LIST = ListQuery(
+    Manager,
+    fields={
+        'id': Manager.id,
+        'user_id': Manager.user_id,
+        'login': User.login,
+        'first_name': User.first_name,
+        'last_name': User.last_name,
+        'description': User.description,
+    },
+    filters={'user_id': Manager.user_id},
+    joins=[(User, Manager.user_id == User.id)],
+)
+
+EMPLOYEE_LIST = ListQuery(
+    Employee,
+    fields={
+        'id': Employee.id,
+        'user_id': Employee.user_id,
+        'login': User.login,
+        'first_name': User.first_name,
+        'last_name': User.last_name,
+        'description': User.description,
+        'manager_id': Employee.manager_id,
+    },
+    filters={'user_id': Employee.user_id, 'manager_id': Employee.manager_id},
+    joins=[(User, Employee.user_id == User.id)],
+)
+
+
+def _busy_response(e):
+    """503 when bcrypt is overloaded; nothing has been committed yet."""
+    busy = busy_error(e)
+    return jsonify(busy['error']), busy['status_code'], busy['headers']
+
+
+def _list_response(query):
+    """Envelope of one page of a list endpoint, with pagination headers."""
+    try:
+        page = query.page(request.args)
+    except ListQueryError as e:
+        return jsonify({'status': False, 'message': str(e)}), 400
+    output = {
+        'status': bool(page.items),
+        'message': "OK" if page.items else "Empty table",
+        'data': page.items,
+        'next_cursor': page.next_cursor
+    }
+    if page.total is not None:
+        output['total'] = page.total
+    return jsonify(output), 200, page.headers
+
+
 @swag_from({
     'tags': ['Users'],
-    'description': 'Получить список всех пользователей',
+    'description': 'Получить список пользователей постранично',
+    'parameters': USER_LIST.swagger_parameters(),
     'responses': {
         200: {
             'description': 'Список пользователей успешно получен',
@@ -47,28 +141,7 @@ def str_to_bool(value):
     }
 })
 def get_users():
-    users = User.query.all()
-    output = {'status': bool(users), 'message': "OK" if users else "Empty table", 'data': []}
-
-    for user in users:
-        role_info = None
-        if user.role == 'manager':
-            role_info = {'role': 'manager', 'id': user.manager_profile.id}
-        elif user.role == 'employee':
-            role_info = {'role': 'employee', 'id': user.employee_profile.id, 'manager_id': user.manager_id}
-
-        output['data'].append({
-            'id': user.id,
-            'login': user.login,
-            'first_name': user.first_name,
-            'last_name': user.last_name,
-            'password': user.password,
-            'is_admin': user.is_admin,
-            'description': user.description,
-            'role': role_info
-        })
-
-    return jsonify(output)
+    return _list_response(USER_LIST)
 
 
 @swag_from({
@@ -78,30 +151,11 @@ def get_users():
     'responses': {200: {'description': 'Пользователь найден'}, 404: {'description': 'Пользователь не найден'}}
 })
 def get_user(item_id):
-    user = User.query.get(item_id)
+    user = USER_LIST.get(item_id)
     if not user:
         return jsonify({'status': False, 'message': 'User not found'}), 404
 
-    role_info = None
-    if user.role == 'manager':
-        role_info = {'role': 'manager', 'id': user.manager_profile.id}
-    elif user.role == 'employee':
-        role_info = {'role': 'employee', 'id': user.employee_profile.id, 'manager_id': user.manager_id}
-
-    return jsonify({
-        'status': True,
-        'message': 'OK',
-        'data': {
-            'id': user.id,
-            'login': user.login,
-            'first_name': user.first_name,
-            'last_name': user.last_name,
-            'password': user.password,
-            'is_admin': user.is_admin,
-            'description': user.description,
-            'role': role_info
-        }
-    })
+    return jsonify({'status': True, 'message': 'OK', 'data': user})
 
 
 """
@@ -132,7 +186,8 @@ returns {
     'responses': {
         201: {'description': 'Пользователь успешно создан'},
         400: {'description': 'Некорректные данные'},
-        409: {'description': 'Пользователь с таким логином уже существует'}
+        409: {'description': 'Пользователь с таким логином уже существует'},
+        503: {'description': 'Хеширование паролей перегружено, повторить после Retry-After'}
     }
 })
 def add_user():  # Добавить логин и пароль создающего и проверять что он админ 
@@ -151,14 +206,17 @@ def add_user():  # Добавить логин и пароль создающе
     if User.query.filter_by(login=login).first():
         return jsonify({'status': False, 'message': 'User with this login already exists'}), 409
 
-    new_user = User(
-        login=login,
-        first_name=first_name,
-        last_name=last_name,
-        password=password,
-        is_admin=is_admin,
-        description=description
-    )
+    try:
+        new_user = User(
+            login=login,
+            first_name=first_name,
+            last_name=last_name,
+            password=password,
+            is_admin=is_admin,
+            description=description
+        )
+    except PasswordHasherBusy as e:
+        return _busy_response(e)
     db.session.add(new_user)
     db.session.flush()  # flush to get new_user.id for role assignment
 
@@ -199,11 +257,12 @@ def add_user():  # Добавить логин и пароль создающе
     'responses': {
         200: {'description': 'Пользователь обновлен'},
         404: {'description': 'Пользователь не найден'},
-        400: {'description': 'Некорректные данные'}
+        400: {'description': 'Некорректные данные'},
+        503: {'description': 'Хеширование паролей перегружено, повторить после Retry-After'}
     }
 })
 def update_user(item_id):
-    user = User.query.get(item_id)
+    user = db.session.get(User, item_id, options=_user_profiles())
     if not user:
         return jsonify({'status': False, 'message': 'User not found'}), 404
 
@@ -226,7 +285,10 @@ def update_user(item_id):
     if last_name:
         user.last_name = last_name
     if password:
-        user.set_password(password)
+        try:
+            user.set_password(password)
+        except PasswordHasherBusy as e:
+            return _busy_response(e)
     if is_admin is not None:
         user.is_admin = str_to_bool(is_admin)
     if description is not None:
@@ -249,6 +311,7 @@ def update_user(item_id):
             db.session.add(Employee(user_id=user.id, manager_id=emp_manager_id))
 
     db.session.commit()
+    invalidate_user_context(user.id)
     return jsonify({'status': True, 'message': 'User updated successfully'})
 
 
@@ -305,6 +368,16 @@ def update_user(item_id):
                     'message': {'type': 'string'}
                 }
             }
+        },
+        503: {
+            'description': 'Хеширование паролей перегружено, повторить после Retry-After',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'status': {'type': 'boolean'},
+                    'message': {'type': 'string'}
+                }
+            }
         }
     }
 })
@@ -315,7 +388,7 @@ def login():
     result = authenticate_user(login, password)
     
     if 'error' in result and 'status_code' in result:
-        return jsonify(result['error']), result['status_code']
+        return jsonify(result['error']), result['status_code'], result.get('headers', {})
     
     response_data, user = result
     return build_auth_response('Login successful', response_data)
@@ -497,6 +570,16 @@ def refresh_token():
                     'message': {'type': 'string'}
                 }
             }
+        },
+        503: {
+            'description': 'Хеширование паролей перегружено, повторить после Retry-After',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'status': {'type': 'boolean'},
+                    'message': {'type': 'string'}
+                }
+            }
         }
     }
 })
@@ -509,7 +592,7 @@ def register():
     result = create_new_user(login, first_name, last_name, password)
     
     if 'error' in result and 'status_code' in result:
-        return jsonify(result['error']), result['status_code']
+        return jsonify(result['error']), result['status_code'], result.get('headers', {})
     
     response_data, user = result
     return build_auth_response('User registered successfully', response_data)
@@ -518,22 +601,12 @@ def register():
 
 @swag_from({
     'tags': ['Managers'],
-    'description': 'Get all managers',
-    'responses': {200: {'description': 'List of managers'}}
+    'description': 'Get managers page by page',
+    'parameters': MANAGER_LIST.swagger_parameters(),
+    'responses': {200: {'description': 'List of managers'}, 400: {'description': 'Bad list query'}}
 })
 def get_managers():
-    managers = Manager.query.all()
-    data = []
-    for m in managers:
-        data.append({
-            'id': m.id,
-            'user_id': m.user_id,
-            'login': m.user.login,
-            'first_name': m.user.first_name,
-            'last_name': m.user.last_name,
-            'description': m.user.description
-        })
-    return jsonify({'status': True, 'message': 'OK', 'data': data})
+    return _list_response(MANAGER_LIST)
 
 
 @swag_from({
@@ -543,17 +616,9 @@ def get_managers():
     'responses': {200: {'description': 'Manager found'}, 404: {'description': 'Manager not found'}}
 })
 def get_manager(item_id):
-    manager = Manager.query.get(item_id)
-    if not manager:
+    data = MANAGER_LIST.get(item_id)
+    if not data:
         return jsonify({'status': False, 'message': 'Manager not found'}), 404
-    data = {
-        'id': manager.id,
-        'user_id': manager.user_id,
-        'login': manager.user.login,
-        'first_name': manager.user.first_name,
-        'last_name': manager.user.last_name,
-        'description': manager.user.description
-    }
     return jsonify({'status': True, 'message': 'OK', 'data': data})
 
 
@@ -613,23 +678,12 @@ def delete_manager(item_id):
 
 @swag_from({
     'tags': ['Employees'],
-    'description': 'Get all employees',
-    'responses': {200: {'description': 'List of employees'}}
+    'description': 'Get employees page by page',
+    'parameters': EMPLOYEE_LIST.swagger_parameters(),
+    'responses': {200: {'description': 'List of employees'}, 400: {'description': 'Bad list query'}}
 })
 def get_employees():
-    employees = Employee.query.all()
-    data = []
-    for e in employees:
-        data.append({
-            'id': e.id,
-            'user_id': e.user_id,
-            'login': e.user.login,
-            'first_name': e.user.first_name,
-            'last_name': e.user.last_name,
-            'description': e.user.description,
-            'manager_id': e.manager_id
-        })
-    return jsonify({'status': True, 'message': 'OK', 'data': data})
+    return _list_response(EMPLOYEE_LIST)
 
 
 @swag_from({
@@ -639,18 +693,9 @@ def get_employees():
     'responses': {200: {'description': 'Employee found'}, 404: {'description': 'Employee not found'}}
 })
 def get_employee(item_id):
-    employee = Employee.query.get(item_id)
-    if not employee:
+    data = EMPLOYEE_LIST.get(item_id)
+    if not data:
         return jsonify({'status': False, 'message': 'Employee not found'}), 404
-    data = {
-        'id': employee.id,
-        'user_id': employee.user_id,
-        'login': employee.user.login,
-        'first_name': employee.user.first_name,
-        'last_name': employee.user.last_name,
-        'description': employee.user.description,
-        'manager_id': employee.manager_id
-    }
     return jsonify({'status': True, 'message': 'OK', 'data': data})
 
 
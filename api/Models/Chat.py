@@ -5,7 +5,7 @@ class Chat(db.Model):
     name = db.Column(db.String(100), nullable=False)
 
     # FK to User
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
 
     # One chat → many messages
     messages = db.relationship(
@@ -2,6 +2,11 @@ from database import db
 
 class DocCall(db.Model):
     __tablename__ = "doc_call"
+    # One counter row per (user, document); required by the bulk upsert.
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "doc_id", name="uq_doc_call_user_doc"),
+        db.Index("ix_doc_call_doc_id", "doc_id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
@@ -3,6 +3,12 @@ from database import db
 
 class DocPermission(db.Model):
     __tablename__ = "doc_permissions"
+    # issuer_id + doc_id also answers "permitted documents of a user" from the index alone
+    __table_args__ = (
+        db.Index("ix_doc_permissions_issuer_doc", "issuer_id", "doc_id"),
+        db.Index("ix_doc_permissions_recipient_id", "recipient_id"),
+        db.Index("ix_doc_permissions_doc_id", "doc_id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     issuer_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
@@ -11,7 +11,7 @@ class Employee(db.Model):
     user = db.relationship('User', backref=db.backref('employee_profile', uselist=False))
     
     # Link to Manager
-    manager_id = db.Column(db.Integer, db.ForeignKey('managers.id'), nullable=True)
+    manager_id = db.Column(db.Integer, db.ForeignKey('managers.id'), nullable=True, index=True)
     manager = db.relationship('Manager', backref=db.backref('employees', lazy=True))
 
     def __repr__(self):
@@ -2,6 +2,10 @@ from database import db
 
 class LLMMemory(db.Model):
     __tablename__ = "llm_memory"
+    # The unsummarized tail is read as user_id = ? AND id > last_memory_id
+    __table_args__ = (
+        db.Index("ix_llm_memory_user_id_id", "user_id", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from database import db
+
+class LLMMemorySummary(db.Model):
+    """Rolling summary of a user's llm_memory log.
+
+    Snippets with id <= last_memory_id are already folded into `summary`;
+    newer ones form the unsummarized tail.
+    """
+    __tablename__ = "llm_memory_summary"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, unique=True)
+    summary = db.Column(db.Text, nullable=False, default="")
+    last_memory_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user = db.relationship("User", back_populates="memory_summary", lazy=True)
+
+    def __repr__(self):
+        return f"<LLMMemorySummary user={self.user_id} last_memory_id={self.last_memory_id}>"
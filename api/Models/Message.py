@@ -1,6 +1,11 @@
 from database import db
 
 class Message(db.Model):
+    # История чата читается окнами по (time, id) — см. utils/pagination.py
+    __table_args__ = (
+        db.Index('ix_message_chat_time_id', 'chat_id', 'time', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     message = db.Column(db.String(2048), unique=False)
     time = db.Column(db.DateTime, unique=False)
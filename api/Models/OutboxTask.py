@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from database import db
+
+class OutboxTask(db.Model):
+    """Deferred side effect, written in the same transaction as the data it follows.
+
+    status: pending -> running -> done, or back to pending with a later
+    run_after on failure, or failed once max_attempts is reached.
+    """
+    __tablename__ = "outbox_task"
+    __table_args__ = (
+        db.Index("ix_outbox_task_status_run_after", "status", "run_after"),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    # Enqueueing twice with the same key is a no-op
+    idempotency_key = db.Column(db.String(200), unique=True, nullable=True)
+    status = db.Column(db.String(16), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    def __repr__(self):
+        return f"<OutboxTask id={self.id} kind={self.kind} status={self.status}>"
@@ -1,6 +1,6 @@
-import bcrypt
 from database import db
 from Models.Chat import Chat
+from utils.password_hasher import password_hasher
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -14,6 +14,7 @@ class User(db.Model):
     # Relationships
     chats = db.relationship('Chat', backref='user', lazy=True, cascade="all, delete")
     llm_memories = db.relationship('LLMMemory', back_populates='user', lazy=True, cascade="all, delete")
+    memory_summary = db.relationship('LLMMemorySummary', back_populates='user', lazy=True, uselist=False, cascade="all, delete")
 
     # Optional relationships for DocCall and DocPermission
     doc_calls = db.relationship('DocCall', back_populates='user', lazy=True, cascade="all, delete")
@@ -41,11 +42,15 @@ class User(db.Model):
         if password:
             self.set_password(password)
 
+    # bcrypt runs in password_hasher's bounded pool; both raise PasswordHasherBusy under overload
     def set_password(self, password):
-        self.password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.password = password_hasher.hash(password)
 
     def check_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password.encode('utf-8'))
+        return password_hasher.verify(password, self.password)
+
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password)
 
     def __repr__(self):
         return f'<User {self.login}>'
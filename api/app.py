@@ -1,6 +1,8 @@
-from flask import Flask, request, send_file
+import os
+from flask import Flask, Response, request, send_file
 from flask_cors import CORS
 from flasgger import Swagger
+from flask_migrate import Migrate, upgrade
 from database import db
 from Controllers.UserController import *
 from Controllers.DocCallController import doc_call_bp
@@ -10,9 +12,19 @@ from Controllers.MessageController import *
 from Controllers.AudioController import *
 from Controllers.LLMMemoryController import llm_memory_bp
 from Controllers.ChatController import *
+from utils.metrics import render_latest
+from utils.doc_call_buffer import doc_call_buffer
+from utils.task_queue import task_queue
+from utils.stt import get_stt_engine
+from utils.tts import get_tts_engine
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for the entire app
+# Enable CORS for the entire app; pagination and TTS headers must be exposed
+# explicitly, otherwise browsers hide them from scripts
+CORS(app, expose_headers=[
+    'X-Next-Cursor', 'X-Total-Count',
+    'Content-Location', 'X-TTS-Key', 'X-TTS-Sample-Rate'
+])
 
 # Ensure JSON UTF-8 output
 app.config['JSON_AS_ASCII'] = False
@@ -54,8 +66,25 @@ app.config['SWAGGER'] = {
 Swagger(app)
 db.init_app(app)
 
-with app.app_context():
-    db.create_all()
+# Схема базы ведётся миграциями (migrations/), а не db.create_all()
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+migrate = Migrate(app, db, directory=MIGRATIONS_DIR)
+
+if os.getenv("DB_AUTO_MIGRATE", "1") == "1":
+    with app.app_context():
+        upgrade(directory=MIGRATIONS_DIR)
+
+# Счётчики DocCall копятся в памяти и пишутся в БД пачкой в фоне
+doc_call_buffer.start(app)
+# Отложенные побочные эффекты (память пользователя) выполняют воркеры outbox
+task_queue.start(app)
+
+# Модель распознавания речи грузим при старте, а не на первом голосовом сообщении
+if os.getenv("STT_PRELOAD", "0") == "1":
+    get_stt_engine()
+# То же для голоса синтеза (piper грузит ONNX-модель)
+if os.getenv("TTS_PRELOAD", "0") == "1":
+    get_tts_engine()
 
 # -------------------------
 # Register Blueprints with Swagger support
@@ -116,13 +145,25 @@ app.route('/api/auth/register', methods=['POST'])(register)
 # Messages routes
 # -------------------------
 app.route('/api/messages/', methods=['GET'])(get_messages)
+app.route('/api/messages/export', methods=['GET'])(export_messages)
 app.route('/api/messages/<int:item_id>', methods=['GET'])(get_message)
 app.route('/api/messages/', methods=['POST'])(add_message)
+app.route('/api/messages/stream', methods=['POST'])(add_message_stream)
+app.route('/api/messages/voice', methods=['POST'])(add_voice_message)
 
 # -------------------------
 # Audio conversion route
 # -------------------------
 app.route('/api/converttexttoaudio/', methods=['POST'])(convert_text_to_audio)
+app.route('/api/tts/<fmt>/<key>', methods=['GET'])(get_tts_audio)
+
+# -------------------------
+# Prometheus metrics
+# -------------------------
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    payload, content_type = render_latest()
+    return Response(payload, content_type=content_type)
 
 # -------------------------
 # Run the app
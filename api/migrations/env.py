@@ -0,0 +1,63 @@
+import logging
+
+from alembic import context
+from flask import current_app
+from sqlalchemy import text
+
+logger = logging.getLogger("alembic.env")
+
+config = context.config
+
+# Any constant works; it only has to be the same in every API worker.
+MIGRATION_LOCK_ID = 7_304_046
+
+
+def get_engine():
+    return current_app.extensions["migrate"].db.engine
+
+
+config.set_main_option(
+    "sqlalchemy.url",
+    get_engine().url.render_as_string(hide_password=False).replace("%", "%%"),
+)
+target_db = current_app.extensions["migrate"].db
+
+
+def run_migrations_offline():
+    """Emit SQL to stdout instead of running it (flask db upgrade --sql)."""
+    context.configure(url=config.get_main_option("sqlalchemy.url"), target_metadata=target_db.metadata,
+                      literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    def process_revision_directives(context, revision, directives):
+        # `flask db migrate` without model changes should not write an empty file
+        if getattr(config.cmd_opts, "autogenerate", False):
+            script = directives[0]
+            if script.upgrade_ops.is_empty():
+                directives[:] = []
+                logger.info("No changes in schema detected.")
+
+    conf_args = current_app.extensions["migrate"].configure_args
+    conf_args.setdefault("process_revision_directives", process_revision_directives)
+
+    with get_engine().connect() as connection:
+        # Every worker runs upgrade at startup; the first one migrates, the
+        # rest wait here and then find nothing to do.
+        connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        connection.commit()
+        try:
+            context.configure(connection=connection, target_metadata=target_db.metadata, **conf_args)
+            with context.begin_transaction():
+                context.run_migrations()
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+            connection.commit()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,130 @@
+"""baseline: schema as created by db.create_all()
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 00:00:00
+
+Databases that predate migrations already have these tables; each one is
+created only if missing, so upgrading such a database just stamps it.
+Indexes for query patterns are added by 0002.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _create_table(name, *columns, **kwargs):
+    if not sa.inspect(op.get_bind()).has_table(name):
+        op.create_table(name, *columns, **kwargs)
+
+
+def upgrade():
+    _create_table(
+        "user",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("login", sa.String(50), unique=True),
+        sa.Column("first_name", sa.String(50)),
+        sa.Column("last_name", sa.String(50)),
+        sa.Column("password", sa.String(500)),
+        sa.Column("is_admin", sa.Boolean(), nullable=False),
+        sa.Column("description", sa.Text(), nullable=True),
+    )
+    _create_table(
+        "documents",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("name", sa.String(255), nullable=False, unique=True),
+        sa.Column("path", sa.String(1024), nullable=False),
+    )
+    _create_table(
+        "managers",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), unique=True, nullable=False),
+    )
+    _create_table(
+        "employees",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), unique=True, nullable=False),
+        sa.Column("manager_id", sa.Integer(), sa.ForeignKey("managers.id"), nullable=True),
+    )
+    _create_table(
+        "chat",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(100), nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), nullable=False),
+    )
+    _create_table(
+        "message",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("message", sa.String(2048)),
+        sa.Column("time", sa.DateTime()),
+        sa.Column("type", sa.Boolean()),
+        sa.Column("sender", sa.Boolean()),
+        sa.Column("chat_id", sa.Integer(), sa.ForeignKey("chat.id"), nullable=False),
+    )
+    _create_table(
+        "doc_call",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), nullable=False),
+        sa.Column("doc_id", sa.Integer(), sa.ForeignKey("documents.id"), nullable=False),
+        sa.Column("call_count", sa.BigInteger(), nullable=False),
+    )
+    _create_table(
+        "doc_permissions",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("issuer_id", sa.Integer(), sa.ForeignKey("user.id"), nullable=False),
+        sa.Column("recipient_id", sa.Integer(), sa.ForeignKey("user.id"), nullable=False),
+        sa.Column("doc_id", sa.Integer(), sa.ForeignKey("documents.id"), nullable=False),
+        sa.Column("set_on", sa.DateTime(), nullable=False),
+    )
+    _create_table(
+        "llm_memory",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), nullable=False),
+        sa.Column("info", sa.String(5000), nullable=False),
+    )
+    _create_table(
+        "llm_memory_summary",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), nullable=False, unique=True),
+        sa.Column("summary", sa.Text(), nullable=False),
+        sa.Column("last_memory_id", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+    )
+    _create_table(
+        "outbox_task",
+        sa.Column("id", sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column("kind", sa.String(64), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("idempotency_key", sa.String(200), unique=True, nullable=True),
+        sa.Column("status", sa.String(16), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("max_attempts", sa.Integer(), nullable=False),
+        sa.Column("run_after", sa.DateTime(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Index("ix_outbox_task_status_run_after", "status", "run_after"),
+    )
+    _create_table(
+        "refresh_token",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("token", sa.String(500), unique=True, nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), nullable=False),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.Column("is_revoked", sa.Boolean()),
+    )
+
+
+def downgrade():
+    for name in (
+        "refresh_token", "outbox_task", "llm_memory_summary", "llm_memory", "doc_permissions",
+        "doc_call", "message", "chat", "employees", "managers", "documents", "user",
+    ):
+        op.drop_table(name)
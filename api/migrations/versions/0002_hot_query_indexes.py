@@ -0,0 +1,112 @@
+"""indexes for hot query patterns
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 00:00:01
+
+Indexes are built CONCURRENTLY so a live database keeps accepting writes;
+that cannot run inside a transaction, hence the autocommit block. Every
+step checks what exists first: databases created by db.create_all() after
+the models declared some of these already have them.
+
+doc_call needs one row per (user_id, doc_id) for the counter upsert.
+Databases created before that constraint may hold duplicates, which are
+merged (counts summed into the oldest row) before the unique index is built.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# (table, index name, columns)
+INDEXES = [
+    # chat history windows and the last N messages for the LLM
+    ("message", "ix_message_chat_time_id", ["chat_id", "time", "id"]),
+    ("chat", "ix_chat_user_id", ["user_id"]),
+    # permitted documents of a user, answered from the index alone
+    ("doc_permissions", "ix_doc_permissions_issuer_doc", ["issuer_id", "doc_id"]),
+    ("doc_permissions", "ix_doc_permissions_recipient_id", ["recipient_id"]),
+    ("doc_permissions", "ix_doc_permissions_doc_id", ["doc_id"]),
+    ("doc_call", "ix_doc_call_doc_id", ["doc_id"]),
+    # unsummarized memory tail: user_id = ? AND id > ?
+    ("llm_memory", "ix_llm_memory_user_id_id", ["user_id", "id"]),
+    ("refresh_token", "ix_refresh_token_user_id", ["user_id"]),
+    ("employees", "ix_employees_manager_id", ["manager_id"]),
+]
+
+DOC_CALL_UNIQUE = "uq_doc_call_user_doc"
+
+
+def _indexes(table):
+    """Index name -> is valid. A failed CONCURRENTLY build leaves an invalid index behind."""
+    rows = op.get_bind().execute(
+        sa.text(
+            "SELECT c.relname, i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = to_regclass(:table)"
+        ),
+        {"table": table},
+    )
+    return dict(rows.all())
+
+
+def _ensure_index(table, name, columns, **kwargs):
+    valid = _indexes(table).get(name)
+    if valid:
+        return
+    if valid is not None:
+        op.drop_index(name, table_name=table, postgresql_concurrently=True)
+    op.create_index(name, table, columns, postgresql_concurrently=True, **kwargs)
+
+
+def _has_constraint(table, name):
+    inspector = sa.inspect(op.get_bind())
+    return any(c["name"] == name for c in inspector.get_unique_constraints(table))
+
+
+def _merge_duplicate_doc_calls():
+    op.execute(
+        """
+        WITH dup AS (
+            SELECT min(id) AS keep_id, sum(call_count) AS total
+            FROM doc_call
+            GROUP BY user_id, doc_id
+            HAVING count(*) > 1
+        )
+        UPDATE doc_call d SET call_count = dup.total
+        FROM dup WHERE d.id = dup.keep_id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM doc_call d
+        USING doc_call k
+        WHERE d.user_id = k.user_id AND d.doc_id = k.doc_id AND d.id > k.id
+        """
+    )
+
+
+def upgrade():
+    has_doc_call_unique = _has_constraint("doc_call", DOC_CALL_UNIQUE)
+    if not has_doc_call_unique:
+        _merge_duplicate_doc_calls()
+
+    with op.get_context().autocommit_block():
+        for table, name, columns in INDEXES:
+            _ensure_index(table, name, columns)
+        if not has_doc_call_unique:
+            # A row may have been duplicated again since the merge above;
+            # the build then fails and the migration can simply be rerun.
+            _ensure_index("doc_call", DOC_CALL_UNIQUE, ["user_id", "doc_id"], unique=True)
+            # Promote the index to the constraint the model declares (no table scan)
+            op.execute(f"ALTER TABLE doc_call ADD CONSTRAINT {DOC_CALL_UNIQUE} UNIQUE USING INDEX {DOC_CALL_UNIQUE}")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table, name, _ in reversed(INDEXES):
+            if name in _indexes(table):
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,132 @@
+"""
+OpenAI-совместимая заглушка LLM для локальной проверки шлюза (utils/llm_gateway.py).
+
+Отвечает на POST /v1/chat/completions (обычный и stream=true) с настраиваемой
+задержкой, долей медленных ответов и ошибок; GET /stats показывает, сколько
+запросов реально дошло до «провайдера» и сколько выполнялось одновременно.
+
+    python scripts/llm_stub_server.py --port 8089 --latency 1.5 --slow-rate 0.1 --error-rate 0.05
+    LLM_BASE_URL=http://localhost:8089/v1 OPENROUTER_API_KEY=stub python app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_stats = {"requests": 0, "errors": 0, "inflight": 0, "max_inflight": 0}
+_stats_lock = threading.Lock()
+
+
+def _bump(key, delta=1):
+    with _stats_lock:
+        _stats[key] += delta
+        _stats["max_inflight"] = max(_stats["max_inflight"], _stats["inflight"])
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, чтобы пул соединений шлюза переиспользовался
+    args = None
+
+    def log_message(self, fmt, *a):
+        if not self.args.quiet:
+            super().log_message(fmt, *a)
+
+    def _json(self, status, body):
+        raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with _stats_lock:
+                return self._json(200, dict(_stats))
+        self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": "not found"}})
+
+        _bump("requests")
+        _bump("inflight")
+        try:
+            delay = self.args.latency * random.uniform(0.8, 1.2)
+            if random.random() < self.args.slow_rate:
+                delay *= self.args.slow_factor
+            time.sleep(delay)
+            if random.random() < self.args.error_rate:
+                _bump("errors")
+                return self._json(random.choice([429, 500, 503]), {"error": {"message": "stub upstream error"}})
+
+            question = (body.get("messages") or [{}])[-1].get("content", "")
+            answer = f"Ответ заглушки на: {str(question)[-80:]}"
+            if body.get("stream"):
+                self._stream(body.get("model", "stub"), answer)
+            else:
+                self._json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": answer},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+                })
+        finally:
+            _bump("inflight", -1)
+
+    def _stream(self, model, answer):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        def send(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        for word in answer.split(" "):
+            send(json.dumps({
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]
+            }, ensure_ascii=False))
+            time.sleep(self.args.token_delay)
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible LLM stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=1.0, help="средняя задержка ответа, с")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="доля медленных ответов")
+    parser.add_argument("--slow-factor", type=float, default=10.0, help="во сколько раз медленный ответ дольше")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429/5xx")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="пауза между токенами в stream, с")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    StubHandler.args = args
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"LLM stub on http://{args.host}:{args.port}/v1 (GET /stats for counters)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, Optional, Sequence, Set, Tuple
+
+from utils.metrics import ANSWER_CACHE_INVALIDATIONS, ANSWER_CACHE_REQUESTS, ANSWER_CACHE_SIZE
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_SIZE_LIMIT = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Cosine similarity between question embeddings needed to reuse an answer.
+# Keep it high: two policy questions that differ in one detail must not match.
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+BucketKey = Tuple[int, FrozenSet[int], int]  # (user_id, permitted doc ids, index generation)
+
+
+@dataclass(frozen=True)
+class CachedAnswer:
+    """An LLM answer together with the retrieval result it was based on."""
+
+    content: str
+    context: str
+    documents_info: dict = field(default_factory=dict)
+    reasoning_details: dict = field(default_factory=dict)
+    doc_ids: Tuple[int, ...] = ()
+
+
+@dataclass
+class _Entry:
+    key: BucketKey
+    vector: Tuple[float, ...]
+    answer: CachedAnswer
+    created: float
+
+
+def _normalize(vector: Sequence[float]) -> Tuple[float, ...]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return tuple(x / norm for x in vector)
+
+
+def _dot(a: Sequence[float], b: Sequence[float]) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+class SemanticAnswerCache:
+    """LRU of LLM answers looked up by question-embedding similarity.
+
+    Entries are bucketed by the asking user, the set of documents they may
+    see and the rag_service index generation. The prompt carries the
+    user's profile description and long-term memory, so an answer is
+    personal and is only reused for the same user, with the same
+    permissions, while the index it was retrieved from is current. A
+    lookup scans one bucket and returns the most similar fresh entry
+    above the threshold.
+    """
+
+    def __init__(
+        self,
+        max_size: int = ANSWER_CACHE_SIZE_LIMIT,
+        ttl: float = ANSWER_CACHE_TTL,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[BucketKey, Set[int]] = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(
+        self,
+        vector: Sequence[float],
+        user_id: int,
+        permitted_doc_ids: Iterable[int],
+        generation: int,
+    ) -> Optional[CachedAnswer]:
+        key = (int(user_id), frozenset(permitted_doc_ids), generation)
+        query = _normalize(vector)
+        now = time.monotonic()
+        best: Optional[_Entry] = None
+        best_id, best_score = None, self.threshold
+        with self._lock:
+            self._advance_generation(generation)
+            for entry_id in list(self._buckets.get(key, ())):
+                entry = self._entries[entry_id]
+                if now - entry.created >= self.ttl:
+                    self._remove(entry_id)
+                    continue
+                score = _dot(query, entry.vector)
+                if score >= best_score:
+                    best, best_id, best_score = entry, entry_id, score
+            if best is not None:
+                self._entries.move_to_end(best_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+            ANSWER_CACHE_SIZE.set(len(self._entries))
+        ANSWER_CACHE_REQUESTS.labels(result="hit" if best is not None else "miss").inc()
+        return best.answer if best is not None else None
+
+    def put(
+        self,
+        vector: Sequence[float],
+        user_id: int,
+        permitted_doc_ids: Iterable[int],
+        generation: int,
+        answer: CachedAnswer,
+    ) -> None:
+        key = (int(user_id), frozenset(permitted_doc_ids), generation)
+        entry = _Entry(key=key, vector=_normalize(vector), answer=answer, created=time.monotonic())
+        with self._lock:
+            self._advance_generation(generation)
+            if generation < self._generation:
+                return  # answered from an index that has since been rebuilt
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+            ANSWER_CACHE_SIZE.set(len(self._entries))
+
+    def _advance_generation(self, generation: int) -> None:
+        # A newer generation means the index was rebuilt; older answers can
+        # never be looked up again, so drop them right away.
+        if generation <= self._generation:
+            return
+        self._generation = generation
+        for key in [k for k in self._buckets if k[2] < generation]:
+            for entry_id in list(self._buckets[key]):
+                self._remove(entry_id)
+        ANSWER_CACHE_INVALIDATIONS.inc()
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        bucket = self._buckets.get(entry.key)
+        if bucket is not None:
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[entry.key]
+
+    def invalidate_user(self, *user_ids: int) -> None:
+        """Drop the answers of users whose profile, memory or permissions changed."""
+        users = {int(u) for u in user_ids if u is not None}
+        with self._lock:
+            for key in [k for k in self._buckets if k[0] in users]:
+                for entry_id in list(self._buckets[key]):
+                    self._remove(entry_id)
+            ANSWER_CACHE_SIZE.set(len(self._entries))
+        ANSWER_CACHE_INVALIDATIONS.inc()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            ANSWER_CACHE_SIZE.set(0)
+        ANSWER_CACHE_INVALIDATIONS.inc()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "buckets": len(self._buckets),
+                "generation": self._generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+answer_cache = SemanticAnswerCache()
+
+
+__all__ = [
+    "ANSWER_CACHE_ENABLED",
+    "CachedAnswer",
+    "SemanticAnswerCache",
+    "answer_cache",
+]
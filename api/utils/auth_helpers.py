@@ -1,16 +1,55 @@
+import time
 from flask import jsonify
 from Models.User import User, db
 from Models.RefreshToken import RefreshToken
 from datetime import datetime
 from utils.jwt_utils import generate_access_token, generate_refresh_token
+from utils.metrics import LOGIN_DURATION, PASSWORD_REHASHES
+from utils.password_hasher import PasswordHasherBusy
+
+LOGIN_OUTCOMES = {400: 'bad_request', 401: 'invalid', 503: 'busy'}
+
+
+def busy_error(e):
+    """Error result for a request refused because password hashing is overloaded."""
+    return {
+        'error': {'status': False, 'message': 'Authentication is busy, retry later'},
+        'status_code': 503,
+        'headers': {'Retry-After': str(e.retry_after)},
+    }
+
 
 def authenticate_user(login, password):
+    started = time.perf_counter()
+    result = _authenticate_user(login, password)
+    outcome = LOGIN_OUTCOMES.get(result['status_code'], 'error') if isinstance(result, dict) else 'ok'
+    LOGIN_DURATION.labels(result=outcome).observe(time.perf_counter() - started)
+    return result
+
+
+def _rehash_if_needed(user, password):
+    """Re-hash at the current BCRYPT_ROUNDS; saved with the login's commit."""
+    if not user.password_needs_rehash():
+        return
+    try:
+        user.set_password(password)
+        PASSWORD_REHASHES.inc()
+    except PasswordHasherBusy:
+        pass  # the login itself succeeded; the hash is upgraded on a later one
+
+
+def _authenticate_user(login, password):
     if not login or not password:
         return {'error': {'status': False, 'message': 'Missing login or password'}, 'status_code': 400}
     
     user = User.query.filter_by(login=login).first()
-    if not user or not user.check_password(password):
+    try:
+        valid = user is not None and user.check_password(password)
+    except PasswordHasherBusy as e:
+        return busy_error(e)
+    if not valid:
         return {'error': {'status': False, 'message': 'Invalid credentials'}, 'status_code': 401}
+    _rehash_if_needed(user, password)
     
     access_token = generate_access_token(user.id)
     refresh_token_str = generate_refresh_token()
@@ -40,7 +79,10 @@ def create_new_user(login, first_name, last_name, password):
     if existing_user:
         return {'error': {'status': False, 'message': 'User with this login already exists'}, 'status_code': 409}
     
-    new_user = User(login=login, first_name=first_name, last_name=last_name, password=password)
+    try:
+        new_user = User(login=login, first_name=first_name, last_name=last_name, password=password)
+    except PasswordHasherBusy as e:
+        return busy_error(e)
     db.session.add(new_user)
     db.session.commit()
     
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert
+
+from database import db
+from Models.DocCall import DocCall
+from Models.Document import Document
+from Models.User import User
+from utils.metrics import DOC_CALL_BUFFER_PENDING, DOC_CALL_FLUSHES
+
+logger = logging.getLogger(__name__)
+
+DOC_CALL_FLUSH_INTERVAL = float(os.getenv("DOC_CALL_FLUSH_INTERVAL", "5"))
+
+Key = Tuple[int, int]
+
+
+def upsert_doc_calls(deltas: Dict[Key, int]):
+    """Atomically add `deltas` to doc_call.call_count in one statement.
+
+    Relies on the (user_id, doc_id) unique constraint: missing rows are
+    inserted, existing ones get ``call_count = call_count + excluded``, so
+    concurrent writers can't lose updates. Returns the upserted rows as
+    ``(user_id, doc_id, call_count)``. The caller commits.
+    """
+    if not deltas:
+        return []
+    stmt = insert(DocCall).values([
+        {"user_id": user_id, "doc_id": doc_id, "call_count": delta}
+        for (user_id, doc_id), delta in deltas.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DocCall.user_id, DocCall.doc_id],
+        set_={"call_count": DocCall.call_count + stmt.excluded.call_count},
+    ).returning(DocCall.user_id, DocCall.doc_id, DocCall.call_count)
+    return db.session.execute(stmt).all()
+
+
+def existing_pairs(deltas: Dict[Key, int]) -> Dict[Key, int]:
+    """`deltas` without pairs whose user or document no longer exists.
+
+    doc_id comes from the Qdrant payload, which can outlive its Document
+    row; such a pair would fail the foreign key of the whole batched upsert.
+    """
+    user_ids = {user_id for user_id, _ in deltas}
+    doc_ids = {doc_id for _, doc_id in deltas}
+    users = set(db.session.scalars(db.select(User.id).where(User.id.in_(user_ids))))
+    docs = set(db.session.scalars(db.select(Document.id).where(Document.id.in_(doc_ids))))
+    return {key: delta for key, delta in deltas.items() if key[0] in users and key[1] in docs}
+
+
+class DocCallBuffer:
+    """Aggregates (user_id, doc_id) -> delta in memory and flushes in bulk.
+
+    Recording a call is a dict update under a lock, so document usage
+    accounting costs nothing on the request path. A background thread
+    flushes periodically and once more at interpreter shutdown.
+    """
+
+    def __init__(self, interval: float = DOC_CALL_FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending: Counter = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._app = None
+
+    def add(self, user_id: int, doc_ids: Iterable[int]) -> None:
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id is None:
+                    continue
+                self._pending[(int(user_id), int(doc_id))] += 1
+            DOC_CALL_BUFFER_PENDING.set(len(self._pending))
+
+    def _drain(self) -> Dict[Key, int]:
+        with self._lock:
+            pending, self._pending = dict(self._pending), Counter()
+            DOC_CALL_BUFFER_PENDING.set(0)
+        return pending
+
+    def _restore(self, pending: Dict[Key, int]) -> None:
+        with self._lock:
+            self._pending.update(pending)
+            DOC_CALL_BUFFER_PENDING.set(len(self._pending))
+
+    def flush(self) -> int:
+        """Write buffered deltas with a single upsert; returns rows written."""
+        with self._flush_lock:
+            pending = self._drain()
+            if not pending:
+                return 0
+            try:
+                if self._app is not None:
+                    with self._app.app_context():
+                        self._write(pending)
+                else:
+                    self._write(pending)
+            except Exception:
+                logger.exception("DocCall flush failed, %d rows kept for retry", len(pending))
+                DOC_CALL_FLUSHES.labels(result="error").inc()
+                self._restore(pending)
+                return 0
+            DOC_CALL_FLUSHES.labels(result="ok").inc()
+            return len(pending)
+
+    @staticmethod
+    def _write(pending: Dict[Key, int]) -> None:
+        # A pair deleted between this check and the upsert fails this flush
+        # once; the retry drops it, so it cannot block the buffer for good.
+        try:
+            valid = existing_pairs(pending)
+            if len(valid) < len(pending):
+                logger.warning("Dropping %d DocCall deltas for deleted users or documents: %s",
+                               len(pending) - len(valid), sorted(set(pending) - set(valid)))
+            upsert_doc_calls(valid)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def start(self, app) -> None:
+        """Start the periodic flusher for `app`; safe to call more than once."""
+        self._app = app
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="doc-call-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+
+doc_call_buffer = DocCallBuffer()
+
+
+__all__ = [
+    "DocCallBuffer",
+    "doc_call_buffer",
+    "existing_pairs",
+    "upsert_doc_calls",
+]
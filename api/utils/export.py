@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import date, datetime
+from typing import Any, Iterable, Iterator, Sequence
+
+from database import db
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+FORMATS = {
+    "ndjson": {"mimetype": "application/x-ndjson", "extension": ".ndjson"},
+    "csv": {"mimetype": "text/csv", "extension": ".csv"},
+}
+
+
+def _value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def stream_rows(stmt, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Sequence]:
+    """Run `stmt` on a server-side cursor and yield it in batches of rows.
+
+    Rows are plain tuples from a dedicated connection, not ORM objects in
+    the request session, so nothing accumulates in an identity map and
+    memory stays at one batch regardless of the result size.
+    """
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(stmt)
+        for batch in result.partitions():
+            yield batch
+
+
+def ndjson_chunks(batches: Iterable[Sequence], fields: Sequence[str]) -> Iterator[str]:
+    """One JSON object per line; one chunk per batch."""
+    for batch in batches:
+        yield "".join(
+            json.dumps({f: _value(v) for f, v in zip(fields, row)}, ensure_ascii=False) + "\n"
+            for row in batch
+        )
+
+
+def csv_chunks(batches: Iterable[Sequence], fields: Sequence[str]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for batch in batches:
+        writer.writerows([_value(v) for v in row] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():  # header of an empty export
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = EXPORT_GZIP_LEVEL) -> Iterator[bytes]:
+    """Compress a byte stream incrementally into one gzip member.
+
+    Each input chunk (one batch) is sync-flushed, so the client receives
+    data as batches are read instead of whenever zlib's buffer fills.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_stream(stmt, fields: Sequence[str], fmt: str = "ndjson", gzip: bool = False,
+                  batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """Encoded export of `stmt` (ndjson or csv, optionally gzipped), batch by batch."""
+    batches = stream_rows(stmt, batch_size)
+    text_chunks = ndjson_chunks(batches, fields) if fmt == "ndjson" else csv_chunks(batches, fields)
+    chunks = (chunk.encode("utf-8") for chunk in text_chunks)
+    return gzip_chunks(chunks) if gzip else chunks
+
+
+__all__ = [
+    "FORMATS",
+    "csv_chunks",
+    "export_stream",
+    "gzip_chunks",
+    "ndjson_chunks",
+    "stream_rows",
+]
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence
+
+from sqlalchemy import func
+
+from database import db
+from utils.pagination import CursorError, parse_limit
+
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "100"))
+LIST_MAX_PAGE_SIZE = int(os.getenv("LIST_MAX_PAGE_SIZE", "500"))
+
+# Query parameters consumed by the layer itself; any other one must be a filter.
+RESERVED_PARAMS = ("limit", "after", "fields", "count")
+
+_TRUE = ("true", "1", "yes")
+_FALSE = ("false", "0", "no")
+
+_SWAGGER_TYPES = {int: "integer", bool: "boolean", float: "number"}
+
+
+class ListQueryError(CursorError):
+    """Unknown filter or field, or a filter value of the wrong type."""
+
+
+class Computed:
+    """An output field built in Python from one or more selected columns."""
+
+    def __init__(self, columns: Sequence[Any], build: Callable[..., Any]):
+        self.columns = list(columns)
+        self.build = build
+
+
+@dataclass
+class Page:
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.next_cursor is not None:
+            headers["X-Next-Cursor"] = self.next_cursor
+        if self.total is not None:
+            headers["X-Total-Count"] = str(self.total)
+        return headers
+
+
+def _flag(value: Optional[str]) -> bool:
+    return value is not None and value.lower() in _TRUE
+
+
+def _python_type(column) -> Optional[type]:
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def _coerce(name: str, column, raw: str) -> Any:
+    python_type = _python_type(column)
+    try:
+        if python_type is bool:
+            if raw.lower() in _TRUE:
+                return True
+            if raw.lower() in _FALSE:
+                return False
+            raise ValueError(raw)
+        if python_type is datetime:
+            return datetime.fromisoformat(raw)
+        return python_type(raw) if python_type else raw
+    except ValueError:
+        raise ListQueryError(f"invalid value for {name}: {raw!r}")
+
+
+class ListQuery:
+    """One paginated list endpoint over `model`.
+
+    Pages are keyset windows on the primary key (``id > after``, ascending),
+    so a page costs the same however deep the client has paged, and its
+    size is capped by LIST_MAX_PAGE_SIZE. Only the columns behind the
+    requested ``fields`` are put into the SELECT, only whitelisted
+    ``filters`` (equality, or IN when repeated) are accepted, and the total
+    is counted only when the client asks with ``count=true``.
+
+    `fields` maps output names to columns (of the model or of `joins` /
+    `outerjoins`, given as ``(target, onclause)``) or to :class:`Computed`.
+    """
+
+    def __init__(self, model, fields: Mapping[str, Any], filters: Optional[Mapping[str, Any]] = None,
+                 default_fields: Optional[Sequence[str]] = None, joins: Sequence[tuple] = (),
+                 outerjoins: Sequence[tuple] = ()):
+        self.model = model
+        self.key = model.id
+        self.fields = dict(fields)
+        self.filters = dict(filters or {})
+        self.default_fields = list(default_fields or self.fields)
+        self.joins = list(joins)
+        self.outerjoins = list(outerjoins)
+
+    def _query(self, columns: Sequence[Any], conditions: Sequence[Any]):
+        query = db.session.query(*columns).select_from(self.model)
+        for target, onclause in self.joins:
+            query = query.join(target, onclause)
+        for target, onclause in self.outerjoins:
+            query = query.outerjoin(target, onclause)
+        return query.filter(*conditions)
+
+    def _selected(self, value: Optional[str]) -> List[str]:
+        if not value:
+            return self.default_fields
+        names = list(dict.fromkeys(n.strip() for n in value.split(",") if n.strip()))
+        unknown = [n for n in names if n not in self.fields]
+        if unknown:
+            raise ListQueryError(f"unknown fields: {', '.join(unknown)}")
+        return names
+
+    def _conditions(self, args) -> List[Any]:
+        conditions = []
+        for name in args:
+            if name in RESERVED_PARAMS:
+                continue
+            column = self.filters.get(name)
+            if column is None:
+                raise ListQueryError(f"unknown filter: {name}")
+            values = [_coerce(name, column, raw) for raw in args.getlist(name)]
+            conditions.append(column == values[0] if len(values) == 1 else column.in_(values))
+        return conditions
+
+    def _after(self, value: Optional[str]) -> Optional[int]:
+        if value in (None, ""):
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ListQueryError(f"invalid cursor: {value!r}")
+
+    def _layout(self, names: Sequence[str]):
+        """SELECT columns for `names` (primary key first) and where each field sits in a row."""
+        columns = [self.key]
+        layout = []  # (name, first column position, column count, builder)
+        for name in names:
+            spec = self.fields[name]
+            if isinstance(spec, Computed):
+                layout.append((name, len(columns), len(spec.columns), spec.build))
+                columns.extend(spec.columns)
+            else:
+                layout.append((name, len(columns), 1, None))
+                columns.append(spec)
+        return columns, layout
+
+    @staticmethod
+    def _item(row, layout) -> Dict[str, Any]:
+        return {
+            name: build(*row[start:start + count]) if build else row[start]
+            for name, start, count, build in layout
+        }
+
+    def get(self, key) -> Optional[Dict[str, Any]]:
+        """The item with primary key `key` (default fields), or None; a single SELECT."""
+        columns, layout = self._layout(self.default_fields)
+        row = self._query(columns, [self.key == key]).first()
+        return self._item(row, layout) if row is not None else None
+
+    def page(self, args) -> Page:
+        """Run the list query described by request `args` (a MultiDict).
+
+        Raises :class:`ListQueryError` on bad input.
+        """
+        try:
+            limit = parse_limit(args.get("limit"), LIST_PAGE_SIZE, LIST_MAX_PAGE_SIZE)
+        except CursorError as e:
+            raise ListQueryError(str(e)) from e
+        after = self._after(args.get("after"))
+        columns, layout = self._layout(self._selected(args.get("fields")))
+        conditions = self._conditions(args)
+
+        query = self._query(columns, conditions)
+        if after is not None:
+            query = query.filter(self.key > after)
+        rows = query.order_by(self.key).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        items = [self._item(row, layout) for row in rows]
+
+        total = None
+        if _flag(args.get("count")):
+            total = self._query([func.count(self.key)], conditions).scalar()
+        return Page(items, str(rows[-1][0]) if has_more else None, total)
+
+    def swagger_parameters(self) -> List[Dict[str, Any]]:
+        """Query parameters of this list for a ``@swag_from`` spec."""
+        parameters = [
+            {'name': 'limit', 'in': 'query', 'type': 'integer', 'required': False,
+             'description': f'Размер страницы (по умолчанию {LIST_PAGE_SIZE}, максимум {LIST_MAX_PAGE_SIZE})'},
+            {'name': 'after', 'in': 'query', 'type': 'integer', 'required': False,
+             'description': 'Курсор: значение заголовка X-Next-Cursor предыдущей страницы'},
+            {'name': 'fields', 'in': 'query', 'type': 'string', 'required': False,
+             'description': 'Поля ответа через запятую: ' + ', '.join(self.fields)},
+            {'name': 'count', 'in': 'query', 'type': 'boolean', 'required': False,
+             'description': 'Посчитать общее число записей (заголовок X-Total-Count)'},
+        ]
+        for name, column in self.filters.items():
+            parameters.append({
+                'name': name, 'in': 'query', 'required': False,
+                'type': _SWAGGER_TYPES.get(_python_type(column), 'string'),
+                'description': 'Фильтр по значению; повторите параметр для нескольких значений',
+            })
+        return parameters
+
+
+__all__ = [
+    "Computed",
+    "ListQuery",
+    "ListQueryError",
+    "Page",
+]
@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import httpx
+import openai
+from openai import OpenAI
+
+from utils.metrics import (
+    LLM_HEDGES,
+    LLM_INFLIGHT,
+    LLM_QUEUE_WAIT,
+    LLM_REQUEST_DURATION,
+    LLM_REQUESTS,
+    LLM_RETRIES,
+)
+
+# Upstream calls allowed at once per worker process; the rest wait in FIFO order.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# Send a second identical request when the first one has not answered after
+# this many seconds and use whichever finishes first. Off (0) by default:
+# every hedge is a second paid completion, and reasoning answers routinely
+# take longer than any fixed delay. If enabled, set it above the observed
+# p95 of api_llm_request_seconds.
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class LLMGatewayBusy(RuntimeError):
+    """Raised when no upstream slot frees up within LLM_QUEUE_TIMEOUT."""
+
+
+class FairSemaphore:
+    """Counting semaphore that hands out slots strictly in arrival order.
+
+    threading.Semaphore lets a newly arriving thread overtake ones that are
+    already waiting; under sustained load that starves unlucky requests
+    and inflates tail latency. Here a released slot goes to the oldest
+    waiter.
+    """
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: "deque[threading.Event]" = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None, blocking: bool = True) -> bool:
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return True
+            if not blocking:
+                return False
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        if waiter.wait(timeout):
+            return True
+        with self._lock:
+            if waiter.is_set():
+                return True  # handed a slot right as we timed out
+            self._waiters.remove(waiter)
+            return False
+
+    def release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()  # the slot moves to the waiter
+            else:
+                self._value += 1
+
+    def queued(self) -> int:
+        with self._lock:
+            return len(self._waiters)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution."""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]):
+        """Return ``(result, shared)``; `shared` is True for followers."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+def _backoff(attempt: int) -> float:
+    # "full jitter": uniform in [0, min(cap, base * 2^attempt)]
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def request_key(model: str, messages: List[Dict[str, Any]], **params) -> str:
+    """Stable hash of everything that determines the completion."""
+    raw = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMGateway:
+    """Single entry point for chat completions from a worker process.
+
+    Identical in-flight prompts are answered by one upstream call, the
+    number of concurrent upstream calls is capped by a FIFO semaphore, the
+    OpenAI client shares one pooled httpx connection pool, transient errors
+    are retried with full-jitter backoff, and a slow call is hedged with a
+    duplicate request when a slot is free.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: Optional[str],
+        model: str,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        hedge_after: float = LLM_HEDGE_AFTER,
+    ):
+        self.model = model
+        self.hedge_after = hedge_after
+        self._http = httpx.Client(
+            limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE),
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+        # retries are ours, so the SDK must not add its own on top
+        self.client = OpenAI(base_url=base_url, api_key=api_key, http_client=self._http, max_retries=0)
+        self._slots = FairSemaphore(max_concurrency)
+        self._flights = SingleFlight()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="llm")
+        self._inflight = 0
+        self._inflight_lock = threading.Lock()
+
+    # ---- slots ----
+    def _acquire(self, blocking: bool = True) -> bool:
+        started = time.perf_counter()
+        acquired = self._slots.acquire(timeout=LLM_QUEUE_TIMEOUT, blocking=blocking)
+        if blocking:
+            LLM_QUEUE_WAIT.observe(time.perf_counter() - started)
+            if not acquired:
+                raise LLMGatewayBusy(f"no LLM slot within {LLM_QUEUE_TIMEOUT:.0f}s")
+        if acquired:
+            self._track_inflight(1)
+        return acquired
+
+    def _release(self) -> None:
+        self._track_inflight(-1)
+        self._slots.release()
+
+    def _track_inflight(self, delta: int) -> None:
+        with self._inflight_lock:
+            self._inflight += delta
+            LLM_INFLIGHT.set(self._inflight)
+
+    # ---- completions ----
+    def complete(self, messages: List[Dict[str, Any]], **params):
+        """Chat completion (a ChatCompletion object), shared between identical concurrent calls."""
+        key = request_key(self.model, messages, **params)
+        result, shared = self._flights.do(key, lambda: self._complete_with_retry(messages, params))
+        if shared:
+            LLM_REQUESTS.labels(result="coalesced").inc()
+        return result
+
+    def _complete_with_retry(self, messages, params):
+        attempt = 0
+        while True:
+            try:
+                response = self._complete_hedged(messages, params)
+                LLM_REQUESTS.labels(result="ok").inc()
+                return response
+            except RETRYABLE_ERRORS:
+                if attempt >= LLM_MAX_RETRIES:
+                    LLM_REQUESTS.labels(result="error").inc()
+                    raise
+                LLM_RETRIES.inc()
+                time.sleep(_backoff(attempt))
+                attempt += 1
+            except Exception:
+                LLM_REQUESTS.labels(result="error").inc()
+                raise
+
+    def _complete_hedged(self, messages, params):
+        self._acquire()
+        primary = self._executor.submit(self._call_upstream, messages, params)
+        if self.hedge_after <= 0:
+            return primary.result()
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done or not self._acquire(blocking=False):
+            # finished in time, or no spare slot: hedging would only queue
+            return primary.result()
+        LLM_HEDGES.labels(result="launched").inc()
+        hedge = self._executor.submit(self._call_upstream, messages, params)
+        return self._first_success([primary, hedge], hedge)
+
+    @staticmethod
+    def _first_success(futures: List[Future], hedge: Future):
+        pending = set(futures)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        LLM_HEDGES.labels(result="won").inc()
+                    # the loser keeps running and frees its slot when done
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _call_upstream(self, messages, params):
+        """One upstream request; the caller has already taken a slot for it."""
+        started = time.perf_counter()
+        try:
+            return self.client.chat.completions.create(model=self.model, messages=messages, **params)
+        finally:
+            LLM_REQUEST_DURATION.observe(time.perf_counter() - started)
+            self._release()
+
+    def stream(self, messages: List[Dict[str, Any]], **params) -> Iterator[str]:
+        """Yield content deltas. Holds a slot until the stream ends.
+
+        Streams are not coalesced or hedged: every caller consumes its own
+        token stream. Only opening the stream is retried; once tokens have
+        been sent to the client a retry would duplicate them.
+        """
+        self._acquire()
+        stream = None
+        try:
+            stream = self._open_stream(messages, params)
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = getattr(chunk.choices[0].delta, "content", None)
+                if content:
+                    yield content
+        finally:
+            # Also reached when the consumer closes the generator (client gone):
+            # close the upstream response instead of leaving it to drain.
+            if stream is not None:
+                stream.close()
+            self._release()
+
+    def _open_stream(self, messages, params):
+        attempt = 0
+        while True:
+            try:
+                return self.client.chat.completions.create(
+                    model=self.model, messages=messages, stream=True, **params
+                )
+            except RETRYABLE_ERRORS:
+                if attempt >= LLM_MAX_RETRIES:
+                    raise
+                LLM_RETRIES.inc()
+                time.sleep(_backoff(attempt))
+                attempt += 1
+
+    def stats(self) -> dict:
+        return {"inflight": self._inflight, "queued": self._slots.queued()}
+
+
+__all__ = [
+    "FairSemaphore",
+    "LLMGateway",
+    "LLMGatewayBusy",
+    "SingleFlight",
+    "request_key",
+]
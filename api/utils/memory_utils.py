@@ -1,18 +1,38 @@
 from __future__ import annotations
 
+import logging
+import os
 import re
-from typing import List
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
 
 from database import db
 from Models.LLMMemory import LLMMemory
+from Models.LLMMemorySummary import LLMMemorySummary
+from utils import rag_client
+from utils.rag_client import RagServiceError
+from utils.task_queue import enqueue, on_commit, task
+from utils.user_context import invalidate_user_context
+
+logger = logging.getLogger(__name__)
 
-# The LLMMemory.info column is limited to 5000 characters.
-# We keep a comfortable reserve to avoid hitting that limit on commit.
+# Upper bound for the memory context handed to the LLM.
 MAX_MEMORY_CHARS = 4000
 # When we need to shrink the stored context we aim for this size.
 SUMMARY_TARGET_CHARS = 2500
 # Each interaction snippet that we append to the memory shouldn't be huge on its own.
 SNIPPET_MAX_CHARS = 600
+# Memory is an append-only log of snippets plus a rolling summary. Snippets
+# newer than the summary form a tail; once the tail grows past this size it
+# is folded into the summary. Summary + tail stays within MAX_MEMORY_CHARS.
+MEMORY_TAIL_MAX_CHARS = MAX_MEMORY_CHARS - SUMMARY_TARGET_CHARS
+# Snippets are also embedded into a per-user vector index in rag_service;
+# prompts get the ones closest to the question instead of the whole memory.
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "8"))
+# Snippets less similar to the question than this are left out.
+MEMORY_MIN_SCORE = float(os.getenv("MEMORY_MIN_SCORE", "0.3"))
 
 
 def _clean_text(value: str) -> str:
@@ -28,49 +48,66 @@ def _combine_infos(memories: List[LLMMemory]) -> str:
     return "\n".join(parts).strip()
 
 
-def summarize_text(text: str, target_chars: int = SUMMARY_TARGET_CHARS) -> str:
+def summarize_text(text: str, target_chars: int = SUMMARY_TARGET_CHARS, keep_latest: bool = False) -> str:
     """A lightweight extractive summarizer based on sentence truncation.
 
     We avoid calling external LLMs so the API keeps working offline.
-    The function keeps as many leading sentences as possible and falls back to
-    a hard cut if there are no sentence boundaries.
+    The function keeps as many leading sentences as possible (or trailing
+    ones with `keep_latest`, so newer facts win) and falls back to a hard cut
+    if there are no sentence boundaries. Runs in linear time.
     """
     if len(text) <= target_chars:
         return text
 
-    sentences = re.split(r"(?<=[.!?])\s+", text)
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", text)]
+    if keep_latest:
+        sentences.reverse()
     summary_parts = []
+    length = 0
     for sentence in sentences:
-        sentence = sentence.strip()
         if not sentence:
             continue
-        tentative = (" ".join(summary_parts + [sentence])).strip()
-        if len(tentative) > target_chars:
+        added = len(sentence) + (1 if summary_parts else 0)  # joining space
+        if length + added > target_chars:
             break
         summary_parts.append(sentence)
+        length += added
 
     if not summary_parts:
-        return text[:target_chars].rstrip()
+        return text[-target_chars:].lstrip() if keep_latest else text[:target_chars].rstrip()
 
-    summary = " ".join(summary_parts).strip()
-    if len(summary) > target_chars:
-        summary = summary[:target_chars].rstrip()
-    return summary
+    if keep_latest:
+        summary_parts.reverse()
+    return " ".join(summary_parts)
 
 
-def get_user_memory_context(user_id: int, max_chars: int = MAX_MEMORY_CHARS) -> str:
-    """Return a compact long-term memory context for the user."""
-    memories = (
-        LLMMemory.query.filter_by(user_id=user_id)
+def _memory_tail(user_id: int, after_id: int) -> List[LLMMemory]:
+    return (
+        LLMMemory.query.filter(LLMMemory.user_id == user_id, LLMMemory.id > after_id)
         .order_by(LLMMemory.id.asc())
         .all()
     )
-    if not memories:
-        return ""
 
-    combined = _combine_infos(memories)
+
+def _tail_size(user_id: int, after_id: int) -> Tuple[int, int]:
+    """(rows, characters) of the unsummarized tail, computed in the database."""
+    count, chars = (
+        db.session.query(func.count(LLMMemory.id), func.coalesce(func.sum(func.length(LLMMemory.info)), 0))
+        .filter(LLMMemory.user_id == user_id, LLMMemory.id > after_id)
+        .one()
+    )
+    return int(count), int(chars)
+
+
+def get_user_memory_context(user_id: int, max_chars: int = MAX_MEMORY_CHARS) -> str:
+    """Return a compact long-term memory context for the user: summary + recent tail."""
+    summary = LLMMemorySummary.query.filter_by(user_id=user_id).first()
+    last_id = summary.last_memory_id if summary else 0
+    head = summary.summary.strip() if summary and summary.summary else ""
+
+    combined = "\n".join(part for part in [head, _combine_infos(_memory_tail(user_id, last_id))] if part)
     if len(combined) > max_chars:
-        combined = summarize_text(combined, target_chars=max_chars)
+        combined = summarize_text(combined, target_chars=max_chars, keep_latest=True)
     return combined
 
 
@@ -92,8 +129,114 @@ def build_memory_snippet(user_message: str, assistant_message: str) -> str:
     return snippet
 
 
+def _locked_summary(user_id: int) -> LLMMemorySummary:
+    """Get (creating if needed) the user's summary row, locked until commit.
+
+    The lock serializes concurrent compactions for the same user.
+    """
+    db.session.execute(
+        insert(LLMMemorySummary)
+        .values(user_id=user_id, summary="", last_memory_id=0)
+        .on_conflict_do_nothing(index_elements=[LLMMemorySummary.user_id])
+    )
+    return (
+        LLMMemorySummary.query.filter_by(user_id=user_id)
+        .with_for_update()
+        .populate_existing()
+        .one()
+    )
+
+
+def roll_user_memory_summary(user_id: int) -> bool:
+    """Fold the unsummarized tail into the rolling summary.
+
+    Only the previous summary and the tail are read, so the cost does not
+    grow with the length of the log. Returns True if anything was folded.
+    Flushes only: the caller commits, which also releases the row lock.
+    """
+    summary = _locked_summary(user_id)
+    tail = _memory_tail(user_id, summary.last_memory_id)
+    if not tail:
+        return False
+    payload = "\n".join(part for part in [summary.summary, _combine_infos(tail)] if part)
+    summary.summary = summarize_text(payload, target_chars=SUMMARY_TARGET_CHARS, keep_latest=True)
+    summary.last_memory_id = tail[-1].id
+    db.session.flush()
+    return True
+
+
+def compact_user_memory(user_id: int) -> bool:
+    """Roll the summary if the tail has crossed MEMORY_TAIL_MAX_CHARS; the caller commits."""
+    summary = LLMMemorySummary.query.filter_by(user_id=user_id).first()
+    _, tail_chars = _tail_size(user_id, summary.last_memory_id if summary else 0)
+    if tail_chars <= MEMORY_TAIL_MAX_CHARS:
+        return False
+    return roll_user_memory_summary(user_id)
+
+
+def rebuild_user_memory_summary(user_id: int) -> None:
+    """Recompute the summary from the whole log (after log rows were edited or deleted)."""
+    summary = _locked_summary(user_id)
+    summary.summary = ""
+    summary.last_memory_id = 0
+    db.session.flush()
+    roll_user_memory_summary(user_id)
+    db.session.commit()
+    invalidate_user_context(user_id)
+
+
+def index_memory_snippets(user_id: int, memories: Iterable[LLMMemory]) -> bool:
+    """Embed snippets into the user's vector index; False if rag_service failed.
+
+    A snippet that fails to index is still in the log and the summary, so
+    only relevance retrieval misses it.
+    """
+    try:
+        rag_client.memory_upsert(user_id, [(m.id, m.info) for m in memories])
+        return True
+    except RagServiceError as exc:
+        logger.warning("memory indexing failed for user %s: %s", user_id, exc)
+        return False
+
+
+def unindex_memory_snippets(user_id: int, memory_ids: Optional[Iterable[int]] = None) -> bool:
+    try:
+        rag_client.memory_delete(user_id, memory_ids)
+        return True
+    except RagServiceError as exc:
+        logger.warning("memory unindexing failed for user %s: %s", user_id, exc)
+        return False
+
+
+def retrieve_user_memories(
+    user_id: int,
+    query: str,
+    query_vector=None,
+    top_k: int = MEMORY_TOP_K,
+) -> Optional[List[str]]:
+    """Memory snippets relevant to `query`, most similar first.
+
+    Returns None when the index can't answer (service down, or nothing
+    indexed for this user yet); callers then fall back to the summary from
+    get_user_memory_context.
+    """
+    try:
+        hits = rag_client.memory_search(user_id, query, top_k=top_k, query_vector=query_vector)
+    except RagServiceError as exc:
+        logger.warning("memory search failed for user %s: %s", user_id, exc)
+        return None
+    if not hits:
+        return None
+    return [h["text"] for h in hits if h.get("text") and (h.get("score") or 0) >= MEMORY_MIN_SCORE]
+
+
 def update_user_memory(user_id: int, new_info: str) -> None:
-    """Append a new piece of information to the user's long-term memory."""
+    """Append a new piece of information to the user's long-term memory.
+
+    The common path is one INSERT into the log plus an aggregate read of
+    the tail size; the summary is rewritten only when the tail crosses
+    MEMORY_TAIL_MAX_CHARS.
+    """
     if not new_info:
         return
 
@@ -101,37 +244,65 @@ def update_user_memory(user_id: int, new_info: str) -> None:
     if not new_info:
         return
 
-    memories = (
-        LLMMemory.query.filter_by(user_id=user_id)
-        .order_by(LLMMemory.id.asc())
-        .all()
+    memory = LLMMemory(user_id=user_id, info=new_info[:MAX_MEMORY_CHARS])
+    db.session.add(memory)
+    db.session.commit()
+    index_memory_snippets(user_id, [memory])
+    compact_user_memory(user_id)
+    db.session.commit()
+    invalidate_user_context(user_id)
+
+def enqueue_memory_update(user_id: int, user_message: str, assistant_message: str, message_id: int) -> None:
+    """Defer the memory update for one exchange to the outbox.
+
+    Call inside the transaction that saves the messages; `message_id` (the
+    AI message) makes the task idempotent.
+    """
+    enqueue(
+        "memory.append",
+        {"user_id": int(user_id), "user_message": user_message, "assistant_message": assistant_message},
+        idempotency_key=f"memory:{message_id}",
     )
 
-    if not memories:
-        memory = LLMMemory(user_id=user_id, info=new_info[:MAX_MEMORY_CHARS])
-        db.session.add(memory)
-        db.session.commit()
+
+@task("memory.append")
+def _append_memory_task(user_id: int, user_message: str, assistant_message: str) -> None:
+    info = _clean_text(build_memory_snippet(user_message, assistant_message))
+    if not info:
         return
+    memory = LLMMemory(user_id=user_id, info=info[:MAX_MEMORY_CHARS])
+    db.session.add(memory)
+    db.session.flush()
+    # Indexing and compaction commit together with the snippet and retry on their own
+    enqueue("memory.index", {"user_id": user_id, "memory_id": memory.id}, idempotency_key=f"memory-index:{memory.id}")
+    enqueue("memory.compact", {"user_id": user_id}, idempotency_key=f"memory-compact:{memory.id}")
+    on_commit(invalidate_user_context, user_id)
 
-    primary = memories[0]
-    extra_texts = [m.info for m in memories[1:] if m.info]
 
-    # We keep a single compact record to avoid unlimited growth of rows.
-    for redundant in memories[1:]:
-        db.session.delete(redundant)
+@task("memory.index")
+def _index_memory_task(user_id: int, memory_id: int) -> None:
+    memory = LLMMemory.query.get(memory_id)
+    if memory is None:
+        return  # deleted meanwhile
+    rag_client.memory_upsert(user_id, [(memory.id, memory.info)])  # raises -> retried
 
-    combined = _combine_infos([primary])
-    payload = "\n".join(part for part in [combined, *extra_texts, new_info] if part).strip()
 
-    if len(payload) > MAX_MEMORY_CHARS:
-        payload = summarize_text(payload, target_chars=MAX_MEMORY_CHARS)
+@task("memory.compact")
+def _compact_memory_task(user_id: int) -> None:
+    if compact_user_memory(user_id):
+        on_commit(invalidate_user_context, user_id)
 
-    primary.info = payload
-    db.session.commit()
 
 __all__ = [
     "build_memory_snippet",
+    "compact_user_memory",
+    "enqueue_memory_update",
     "get_user_memory_context",
+    "index_memory_snippets",
+    "rebuild_user_memory_summary",
+    "retrieve_user_memories",
+    "roll_user_memory_summary",
     "summarize_text",
+    "unindex_memory_snippets",
     "update_user_memory",
 ]
\ No newline at end of file
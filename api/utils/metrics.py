@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Per-user request context cache (profile, permissions, long-term memory).
+USER_CONTEXT_CACHE_REQUESTS = Counter(
+    "api_user_context_cache_requests_total",
+    "User context cache lookups",
+    ["result"],  # hit / miss
+)
+USER_CONTEXT_CACHE_INVALIDATIONS = Counter(
+    "api_user_context_cache_invalidations_total",
+    "User context cache invalidations",
+)
+USER_CONTEXT_CACHE_SIZE = Gauge(
+    "api_user_context_cache_entries",
+    "Entries currently held in the user context cache",
+)
+
+# Write-behind DocCall counters.
+DOC_CALL_BUFFER_PENDING = Gauge(
+    "api_doc_call_buffer_pending",
+    "(user_id, doc_id) pairs waiting to be flushed",
+)
+DOC_CALL_FLUSHES = Counter(
+    "api_doc_call_flushes_total",
+    "DocCall buffer flushes",
+    ["result"],  # ok / error
+)
+
+# Concurrent pre-LLM stages of add_message.
+PRE_LLM_STAGE_DURATION = Histogram(
+    "api_pre_llm_stage_seconds",
+    "Duration of a single pre-LLM stage",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+PRE_LLM_CRITICAL_PATH = Histogram(
+    "api_pre_llm_critical_path_seconds",
+    "Wall-clock time of all pre-LLM stages together",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+# Semantic answer cache.
+ANSWER_CACHE_REQUESTS = Counter(
+    "api_answer_cache_requests_total",
+    "Semantic answer cache lookups",
+    ["result"],  # hit / miss
+)
+ANSWER_CACHE_INVALIDATIONS = Counter(
+    "api_answer_cache_invalidations_total",
+    "Semantic answer cache invalidations (index rebuilds and document changes)",
+)
+ANSWER_CACHE_SIZE = Gauge(
+    "api_answer_cache_entries",
+    "Answers currently held in the semantic answer cache",
+)
+
+# LLM gateway.
+LLM_REQUESTS = Counter(
+    "api_llm_requests_total",
+    "LLM completions by outcome",
+    ["result"],  # ok / error / coalesced
+)
+LLM_RETRIES = Counter(
+    "api_llm_retries_total",
+    "Upstream LLM calls retried after a transient error",
+)
+LLM_HEDGES = Counter(
+    "api_llm_hedges_total",
+    "Hedged LLM requests",
+    ["result"],  # launched / won
+)
+LLM_INFLIGHT = Gauge(
+    "api_llm_inflight",
+    "Upstream LLM calls currently running",
+)
+LLM_QUEUE_WAIT = Histogram(
+    "api_llm_queue_wait_seconds",
+    "Time spent waiting for an upstream LLM slot",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+LLM_REQUEST_DURATION = Histogram(
+    "api_llm_request_seconds",
+    "Duration of a single upstream LLM call",
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120),
+)
+
+# Prompt assembly.
+PROMPT_TOKENS = Histogram(
+    "api_prompt_tokens",
+    "Prompt tokens per section after budgeting",
+    ["section"],  # context / memory / history / total
+    buckets=(0, 50, 100, 250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000),
+)
+
+# Outbox task queue.
+OUTBOX_TASKS = Counter(
+    "api_outbox_tasks_total",
+    "Outbox task executions",
+    ["kind", "result"],  # ok / retry / failed
+)
+OUTBOX_LAG = Histogram(
+    "api_outbox_lag_seconds",
+    "Time from a task becoming due to a worker picking it up",
+    ["kind"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+OUTBOX_PENDING = Gauge(
+    "api_outbox_pending",
+    "Outbox tasks waiting to run",
+)
+OUTBOX_OLDEST_PENDING = Gauge(
+    "api_outbox_oldest_pending_seconds",
+    "Age of the oldest pending outbox task",
+)
+
+# Speech-to-text.
+STT_SECONDS = Histogram(
+    "api_stt_seconds",
+    "Decode + transcription time of one voice message",
+    ["engine"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+STT_AUDIO_SECONDS = Histogram(
+    "api_stt_audio_seconds",
+    "Duration of transcribed voice messages",
+    ["engine"],
+    buckets=(1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+STT_RTF = Histogram(
+    "api_stt_real_time_factor",
+    "Processing time per second of audio",
+    ["engine"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 4),
+)
+STT_SEGMENT_SECONDS = Histogram(
+    "api_stt_segment_seconds",
+    "Transcription time of one VAD segment of a voice message",
+    ["engine"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15),
+)
+
+# Text-to-speech.
+TTS_CACHE_REQUESTS = Counter(
+    "api_tts_cache_requests_total",
+    "Text-to-speech cache lookups",
+    ["result"],  # memory / disk / miss / shared
+)
+TTS_CACHE_BYTES = Gauge(
+    "api_tts_cache_bytes",
+    "Size of the on-disk text-to-speech cache",
+)
+TTS_SYNTH_SECONDS = Histogram(
+    "api_tts_synthesis_seconds",
+    "Time to synthesize and encode one text-to-speech request",
+    ["engine"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30),
+)
+TTS_AUDIO_SECONDS = Histogram(
+    "api_tts_audio_seconds",
+    "Duration of synthesized speech",
+    ["engine"],
+    buckets=(1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+TTS_RTF = Histogram(
+    "api_tts_real_time_factor",
+    "Synthesis time per second of produced audio",
+    ["engine"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2),
+)
+
+# Voice replies (LLM stream -> sentence TTS).
+VOICE_REPLY_FIRST_AUDIO = Histogram(
+    "api_voice_reply_first_audio_seconds",
+    "Time from the start of a voice reply stream to its first audio chunk",
+    buckets=(0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 8, 15),
+)
+
+
+# Password hashing and login.
+PASSWORD_HASH_SECONDS = Histogram(
+    "api_password_hash_seconds",
+    "Time spent in bcrypt per operation",
+    ["op"],  # hash / verify
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2, 4),
+)
+PASSWORD_HASH_QUEUE_WAIT = Histogram(
+    "api_password_hash_queue_wait_seconds",
+    "Time a password hash waited for a hashing thread",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5),
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "api_password_hash_rejected_total",
+    "Password hashes refused or abandoned under load",
+    ["reason"],  # queue_full / timeout
+)
+PASSWORD_REHASHES = Counter(
+    "api_password_rehashes_total",
+    "Password hashes upgraded to the current bcrypt cost on login",
+)
+LOGIN_DURATION = Histogram(
+    "api_login_seconds",
+    "Login request duration by outcome",
+    ["result"],  # ok / invalid / busy / bad_request
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 1, 2, 5, 10),
+)
+
+def render_latest():
+    """Return the Prometheus exposition payload and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+__all__ = [
+    "ANSWER_CACHE_INVALIDATIONS",
+    "ANSWER_CACHE_REQUESTS",
+    "ANSWER_CACHE_SIZE",
+    "DOC_CALL_BUFFER_PENDING",
+    "DOC_CALL_FLUSHES",
+    "LLM_HEDGES",
+    "LLM_INFLIGHT",
+    "LLM_QUEUE_WAIT",
+    "LLM_REQUESTS",
+    "LLM_REQUEST_DURATION",
+    "LLM_RETRIES",
+    "LOGIN_DURATION",
+    "OUTBOX_LAG",
+    "OUTBOX_OLDEST_PENDING",
+    "OUTBOX_PENDING",
+    "OUTBOX_TASKS",
+    "PASSWORD_HASH_QUEUE_WAIT",
+    "PASSWORD_HASH_REJECTED",
+    "PASSWORD_HASH_SECONDS",
+    "PASSWORD_REHASHES",
+    "PRE_LLM_CRITICAL_PATH",
+    "PRE_LLM_STAGE_DURATION",
+    "PROMPT_TOKENS",
+    "STT_AUDIO_SECONDS",
+    "STT_RTF",
+    "STT_SECONDS",
+    "STT_SEGMENT_SECONDS",
+    "TTS_AUDIO_SECONDS",
+    "TTS_CACHE_BYTES",
+    "TTS_CACHE_REQUESTS",
+    "TTS_RTF",
+    "TTS_SYNTH_SECONDS",
+    "USER_CONTEXT_CACHE_INVALIDATIONS",
+    "USER_CONTEXT_CACHE_REQUESTS",
+    "USER_CONTEXT_CACHE_SIZE",
+    "VOICE_REPLY_FIRST_AUDIO",
+    "render_latest",
+]
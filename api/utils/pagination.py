@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+from datetime import datetime
+from typing import Optional, Tuple
+
+from flask import Response, request
+from sqlalchemy import tuple_
+
+Cursor = Tuple[datetime, int]
+
+
+class CursorError(ValueError):
+    """The client sent a malformed cursor or limit."""
+
+
+def encode_cursor(time: datetime, row_id: int) -> str:
+    """Opaque cursor for the position of one row in (time, id) order."""
+    raw = f"{time.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        time, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(time), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise CursorError(f"invalid cursor: {cursor!r}") from e
+
+
+def parse_limit(value: Optional[str], default: int, maximum: int) -> int:
+    if value in (None, ""):
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise CursorError(f"invalid limit: {value!r}")
+    if limit < 1:
+        raise CursorError("limit must be positive")
+    return min(limit, maximum)
+
+
+def keyset_window(query, time_col, id_col, limit: int, before: Optional[Cursor] = None,
+                  after: Optional[Cursor] = None):
+    """One window of `query` in (time, id) order, without OFFSET.
+
+    Without `after` the window is the newest `limit` rows older than
+    `before` (newest first); with `after` it is the oldest `limit` rows
+    newer than it (oldest first). Both are a range scan on an index over
+    (..., time, id), so the cost does not depend on how many rows precede
+    the window. Returns ``(rows, has_more)``.
+    """
+    key = tuple_(time_col, id_col)
+    if after is not None:
+        query = query.filter(key > tuple_(*after)).order_by(time_col.asc(), id_col.asc())
+    else:
+        if before is not None:
+            query = query.filter(key < tuple_(*before))
+        query = query.order_by(time_col.desc(), id_col.desc())
+    rows = query.limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+
+def make_etag(*parts) -> str:
+    return hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def not_modified(etag: str) -> Optional[Response]:
+    """A 304 response when the client already holds `etag`, else None."""
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+__all__ = [
+    "CursorError",
+    "decode_cursor",
+    "encode_cursor",
+    "keyset_window",
+    "make_etag",
+    "not_modified",
+    "parse_limit",
+]
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Optional
+
+import bcrypt
+
+from utils.metrics import PASSWORD_HASH_QUEUE_WAIT, PASSWORD_HASH_REJECTED, PASSWORD_HASH_SECONDS
+
+# bcrypt cost factor (log2 of the key expansion rounds) for new hashes.
+# Existing hashes keep working at their own cost and are upgraded on login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads hashing at once per worker process: the CPU authentication may take.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hashes running or queued at once; beyond that a login is refused immediately.
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "8"))
+# Longest a request waits for its hash (queue + hashing) before giving up.
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "5"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "1"))
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Raised when the hashing queue is full or a hash misses PASSWORD_HASH_TIMEOUT."""
+
+    retry_after = PASSWORD_HASH_RETRY_AFTER
+
+
+def hash_rounds(hashed: Optional[str]) -> Optional[int]:
+    """Cost factor of a bcrypt hash ("$2b$12$..."), None if it is not one."""
+    parts = (hashed or "").split("$")
+    if len(parts) == 4 and parts[2].isdigit():
+        return int(parts[2])
+    return None
+
+
+class PasswordHasher:
+    """bcrypt off the request threads, with bounded concurrency and queue.
+
+    At most `workers` hashes run at a time, so a login burst takes that
+    much CPU and no more; at most `max_pending` are admitted (running or
+    queued), the rest fail fast with PasswordHasherBusy instead of tying
+    up Flask workers that chat requests need. A caller waits at most
+    `timeout`; a hash it gave up on keeps its slot until it really ends,
+    so the bound holds even for abandoned work.
+    """
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, workers: int = PASSWORD_HASH_WORKERS,
+                 max_pending: int = PASSWORD_HASH_MAX_PENDING, timeout: float = PASSWORD_HASH_TIMEOUT):
+        self.rounds = rounds
+        self.timeout = timeout
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    def _run(self, op: str, fn: Callable[..., Any], *args) -> Any:
+        if not self._pending.acquire(blocking=False):
+            PASSWORD_HASH_REJECTED.labels(reason="queue_full").inc()
+            raise PasswordHasherBusy("password hashing queue is full")
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            PASSWORD_HASH_QUEUE_WAIT.observe(started - submitted)
+            try:
+                return fn(*args)
+            finally:
+                PASSWORD_HASH_SECONDS.labels(op=op).observe(time.perf_counter() - started)
+
+        try:
+            future = self._executor.submit(task)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()  # dropped if still queued; a running hash finishes in its slot
+            PASSWORD_HASH_REJECTED.labels(reason="timeout").inc()
+            raise PasswordHasherBusy(f"password hash not done within {self.timeout:g}s")
+
+    def hash(self, password: str) -> str:
+        salt = bcrypt.gensalt(self.rounds)
+        return self._run("hash", bcrypt.hashpw, password.encode("utf-8"), salt).decode("utf-8")
+
+    def verify(self, password: str, hashed: Optional[str]) -> bool:
+        if hash_rounds(hashed) is None:
+            return False
+        return self._run("verify", bcrypt.checkpw, password.encode("utf-8"), hashed.encode("utf-8"))
+
+    def needs_rehash(self, hashed: Optional[str]) -> bool:
+        return hash_rounds(hashed) != self.rounds
+
+
+password_hasher = PasswordHasher()
+
+
+__all__ = [
+    "BCRYPT_ROUNDS",
+    "PasswordHasher",
+    "PasswordHasherBusy",
+    "hash_rounds",
+    "password_hasher",
+]
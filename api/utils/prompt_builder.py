@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a character-based estimate
+    tiktoken = None
+
+from utils.metrics import PROMPT_TOKENS
+
+# Token budgets. The question itself is never trimmed; whatever it and the
+# fixed instructions leave of PROMPT_MAX_TOKENS is shared by the sections.
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "3000"))
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "1500"))
+PROMPT_MEMORY_TOKENS = int(os.getenv("PROMPT_MEMORY_TOKENS", "400"))
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", "800"))
+PROMPT_DESCRIPTION_TOKENS = int(os.getenv("PROMPT_DESCRIPTION_TOKENS", "150"))
+# The provider's own tokenizer is not available locally; a BPE encoding of
+# a similar vocabulary is close enough for budgeting.
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "cl100k_base")
+# Used without tiktoken. Cyrillic text averages roughly 3 characters per token.
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3"))
+# A partially included chunk shorter than this is not worth sending.
+MIN_CHUNK_TOKENS = 40
+# Chat formats add a few tokens of framing to every message.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SYSTEM_PROMPT = (
+    "Ты - документный помощник, который развернуто и грамотно отвечает на вопросы с "
+    "использованием информации из предоставленного документа. Твоя задача помогать в "
+    "рабочих задачах, вот основная информация про меня: {description}."
+)
+USER_PROMPT = (
+    "Контекст из документов: {context}. Долгосрочная память о пользователе: {memory}. "
+    "Вопрос: {question}"
+)
+NO_MEMORY = "Нет сохранённых заметок о пользователе"
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(PROMPT_TOKENIZER)
+    except Exception:  # unknown name or BPE file not downloadable offline
+        return None
+
+
+def tokenizer_name() -> str:
+    return PROMPT_TOKENIZER if _encoding() is not None else "estimate"
+
+
+def count_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    enc = _encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` to at most `max_tokens`, preferring a word boundary."""
+    if max_tokens <= 0:
+        return ""
+    enc = _encoding()
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        if len(ids) <= max_tokens:
+            return text
+        cut = enc.decode(ids[:max_tokens])
+    else:
+        limit = int(max_tokens * PROMPT_CHARS_PER_TOKEN)
+        if len(text) <= limit:
+            return text
+        cut = text[:limit]
+    space = cut.rfind(" ")
+    if space > len(cut) // 2:
+        cut = cut[:space]
+    return cut.rstrip() + "…"
+
+
+def _terms(text: str) -> set:
+    # A 5-character prefix is a crude stemmer that copes with Russian endings.
+    return {word.lower()[:5] for word in _WORD_RE.findall(text) if len(word) > 2}
+
+
+def _relevance(question_terms: set, text: str) -> float:
+    terms = _terms(text)
+    if not terms or not question_terms:
+        return 0.0
+    return len(terms & question_terms) / math.sqrt(len(terms))
+
+
+def select_context(docs: Sequence[Dict[str, Any]], budget: int):
+    """Take chunks in rerank order until the budget is spent.
+
+    The chunk that crosses the budget is truncated if enough room is left,
+    later (less relevant) chunks are dropped. Returns ``(docs, text, tokens)``.
+    """
+    selected, parts, used = [], [], 0
+    for doc in docs:
+        text = (doc.get("text") or "").strip()
+        if not text:
+            continue
+        tokens = count_tokens(text)
+        remaining = budget - used
+        if tokens > remaining:
+            if remaining >= MIN_CHUNK_TOKENS:
+                text = truncate_to_tokens(text, remaining)
+                selected.append(doc)
+                parts.append(text)
+                used += count_tokens(text)
+            break
+        selected.append(doc)
+        parts.append(text)
+        used += tokens
+    return selected, "\n\n".join(parts), used
+
+
+def _rank_sentences(text: str, question: str, budget: int, skip: Sequence[str] = ()):
+    sentences = [s.strip() for s in _SENTENCE_RE.split(text or "") if s and s.strip()]
+    # sentences already present in the retrieved snippets are not repeated
+    sentences = [s for s in sentences if not any(s in other for other in skip)]
+    if not sentences:
+        return "", 0, 0
+    question_terms = _terms(question)
+    total = len(sentences)
+    ranked = sorted(
+        range(total),
+        key=lambda i: (_relevance(question_terms, sentences[i]), i),
+        reverse=True,
+    )
+    keep, used = set(), 0
+    for i in ranked:
+        tokens = count_tokens(sentences[i]) + 1
+        if used + tokens > budget:
+            continue
+        keep.add(i)
+        used += tokens
+    text = " ".join(sentences[i] for i in sorted(keep))
+    return text, count_tokens(text), total - len(keep)
+
+
+def select_memory(memory, question: str, budget: int, summary: str = ""):
+    """Keep the memory sentences most relevant to the question.
+
+    `memory` is either text, ranked here by word overlap with the question
+    (ties go to newer sentences; kept ones stay in their original order),
+    or a list of snippets already ranked by the caller, taken in order.
+    With a list, budget the snippets leave is filled from `summary` (ranked
+    like text), so memory that was never indexed still reaches the prompt.
+    """
+    if not isinstance(memory, (list, tuple)):
+        return _rank_sentences(memory, question, budget)
+    kept, used = [], 0
+    for snippet in memory:
+        tokens = count_tokens(snippet) + 1
+        if used + tokens > budget:
+            continue
+        kept.append(snippet)
+        used += tokens
+    rest, rest_tokens, rest_dropped = _rank_sentences(summary, question, budget - used, skip=kept)
+    text = " ".join(kept + ([rest] if rest else []))
+    return text, count_tokens(text), len(memory) - len(kept) + rest_dropped
+
+
+def select_history(history: Sequence[Dict[str, Any]], budget: int):
+    """Most recent messages first; older ones are dropped once the budget is spent."""
+    usable = [m for m in history or [] if isinstance(m.get("content"), str) and m.get("content")]
+    kept: List[Dict[str, str]] = []
+    used = 0
+    for message in reversed(usable):
+        tokens = count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if used + tokens > budget:
+            if not kept and budget - used > MIN_CHUNK_TOKENS:
+                # the latest turn alone is too long: keep its beginning
+                content = truncate_to_tokens(message["content"], budget - used - MESSAGE_OVERHEAD_TOKENS)
+                kept.append({"role": message["role"], "content": content})
+                used += count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+            break
+        kept.append({"role": message["role"], "content": message["content"]})
+        used += tokens
+    kept.reverse()
+    return kept, used, len(usable) - len(kept)
+
+
+@dataclass
+class PromptBuild:
+    messages: List[Dict[str, str]]
+    context: str
+    docs: List[Dict[str, Any]]
+    usage: Dict[str, Any] = field(default_factory=dict)
+
+
+def build_prompt(
+    question: str,
+    docs: Sequence[Dict[str, Any]] = (),
+    memory=None,
+    history: Optional[Sequence[Dict[str, Any]]] = None,
+    description: Optional[str] = None,
+    max_tokens: int = PROMPT_MAX_TOKENS,
+    memory_summary: Optional[str] = None,
+) -> PromptBuild:
+    """Assemble chat messages for the LLM within a token budget.
+
+    Each section gets its own budget; if the question leaves less room than
+    the budgets add up to, they are scaled down proportionally. Budget left
+    unused by memory and history goes to the document context. `memory` is
+    text or a list of pre-ranked snippets, topped up from `memory_summary`
+    (see select_memory).
+    """
+    description_text = truncate_to_tokens(str(description), PROMPT_DESCRIPTION_TOKENS) if description else ""
+    fixed = (
+        count_tokens(SYSTEM_PROMPT.format(description=description_text))
+        + count_tokens(USER_PROMPT.format(context="", memory="", question=question))
+        + 2 * MESSAGE_OVERHEAD_TOKENS
+    )
+    budgets = {
+        "context": PROMPT_CONTEXT_TOKENS,
+        "memory": PROMPT_MEMORY_TOKENS,
+        "history": PROMPT_HISTORY_TOKENS,
+    }
+    available = max(max_tokens - fixed, 0)
+    requested = sum(budgets.values())
+    if requested > available:
+        scale = available / requested if requested else 0
+        budgets = {name: int(value * scale) for name, value in budgets.items()}
+
+    memory_text, memory_tokens, memory_dropped = select_memory(
+        memory or "", question, budgets["memory"], summary=memory_summary or "")
+    memory_source = "retrieved" if isinstance(memory, (list, tuple)) else "summary"
+    history_kept, history_tokens, history_dropped = select_history(history or [], budgets["history"])
+    context_budget = budgets["context"] + (budgets["memory"] - memory_tokens) + (budgets["history"] - history_tokens)
+    used_docs, context, context_tokens = select_context(docs, context_budget)
+
+    messages = [{"role": "system", "content": SYSTEM_PROMPT.format(description=description_text)}]
+    messages.extend(history_kept)
+    messages.append({
+        "role": "user",
+        "content": USER_PROMPT.format(context=context, memory=memory_text or NO_MEMORY, question=question),
+    })
+
+    usage = {
+        "tokenizer": tokenizer_name(),
+        "budget": max_tokens,
+        "context": context_tokens,
+        "memory": memory_tokens,
+        "history": history_tokens,
+        "memory_source": memory_source,
+        "fixed": fixed,
+        "total": sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages),
+        "dropped": {
+            "docs": len([d for d in docs if (d.get("text") or "").strip()]) - len(used_docs),
+            "memory_items": memory_dropped,
+            "history_messages": history_dropped,
+        },
+    }
+    for section in ("context", "memory", "history", "total"):
+        PROMPT_TOKENS.labels(section=section).observe(usage[section])
+    return PromptBuild(messages=messages, context=context, docs=list(used_docs), usage=usage)
+
+
+__all__ = [
+    "PromptBuild",
+    "build_prompt",
+    "count_tokens",
+    "select_context",
+    "select_history",
+    "select_memory",
+    "truncate_to_tokens",
+]
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from sqlalchemy import event
+
+from database import db
+
+
+class QueryLog:
+    """Statements executed inside a :func:`count_queries` block."""
+
+    def __init__(self) -> None:
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries(engine=None) -> Iterator[QueryLog]:
+    """Record the SQL statements this thread runs on `engine` (default ``db.engine``).
+
+    Statements from other threads (background workers, other requests)
+    are ignored, so the count is that of the code inside the block.
+    """
+    engine = engine if engine is not None else db.engine
+    thread = threading.get_ident()
+    log = QueryLog()
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread:
+            log.statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _record)
+    try:
+        yield log
+    finally:
+        event.remove(engine, "before_cursor_execute", _record)
+
+
+@contextmanager
+def assert_max_queries(limit: int, engine=None) -> Iterator[QueryLog]:
+    """Fail, listing the SQL, when the block runs more than `limit` statements.
+
+    Meant for tests of read paths that must not grow with the result size::
+
+        with app.app_context(), assert_max_queries(1):
+            client.get("/api/users/?limit=500")
+    """
+    with count_queries(engine) as log:
+        yield log
+    if log.count > limit:
+        statements = "\n".join(f"  {i}. {s}" for i, s in enumerate(log.statements, 1))
+        raise AssertionError(f"expected at most {limit} queries, ran {log.count}:\n{statements}")
+
+
+__all__ = [
+    "QueryLog",
+    "assert_max_queries",
+    "count_queries",
+]
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Retrieval and reranking run in rag_service, so API workers don't load torch models.
+RAG_SERVICE_URL = os.getenv("RAG_SERVICE_URL", "http://rag_service:8000").rstrip("/")
+RAG_CONNECT_TIMEOUT = float(os.getenv("RAG_CONNECT_TIMEOUT", "0.5"))
+RAG_READ_TIMEOUT = float(os.getenv("RAG_READ_TIMEOUT", "5"))
+RAG_POOL_SIZE = int(os.getenv("RAG_POOL_SIZE", "16"))
+# After a failure we stop calling the service for a short while instead of
+# making every chat request wait for the same timeout.
+RAG_COOLDOWN_SECONDS = float(os.getenv("RAG_COOLDOWN_SECONDS", "10"))
+
+
+class RagServiceError(RuntimeError):
+    """Raised when rag_service is unreachable or returns an error.
+
+    `reachable` is True when the service answered with an HTTP error, so a
+    cheaper endpoint may still work.
+    """
+
+    def __init__(self, message: str, reachable: bool = False):
+        super().__init__(message)
+        self.reachable = reachable
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=RAG_POOL_SIZE,
+        pool_maxsize=RAG_POOL_SIZE,
+        max_retries=Retry(total=1, connect=1, read=0, backoff_factor=0.1, allowed_methods=None),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_session = _build_session()
+_state_lock = threading.Lock()
+_unavailable_until = 0.0
+
+
+def _mark_unavailable() -> None:
+    global _unavailable_until
+    with _state_lock:
+        _unavailable_until = time.monotonic() + RAG_COOLDOWN_SECONDS
+
+
+def _post(path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    if time.monotonic() < _unavailable_until:
+        raise RagServiceError("rag_service is cooling down after a recent failure")
+    try:
+        resp = _session.post(
+            f"{RAG_SERVICE_URL}{path}",
+            json=payload,
+            timeout=(RAG_CONNECT_TIMEOUT, RAG_READ_TIMEOUT),
+        )
+        resp.raise_for_status()
+        return resp.json()
+    except (requests.HTTPError, ValueError) as exc:
+        raise RagServiceError(f"rag_service {path} failed: {exc}", reachable=True) from exc
+    except requests.RequestException as exc:
+        _mark_unavailable()
+        raise RagServiceError(f"rag_service {path} failed: {exc}") from exc
+
+
+def _to_doc(item: Dict[str, Any]) -> Dict[str, Any]:
+    payload = item.get("payload") or {}
+    return {
+        "text": payload.get("text", ""),
+        "doc_id": payload.get("doc_id", item.get("id")),
+        "score": item["rerank_score"] if item.get("rerank_score") is not None else item.get("score"),
+    }
+
+
+def retrieve(
+    query: str,
+    candidates: int = 10,
+    top_k: int = 3,
+    rerank: bool = True,
+    doc_ids: Optional[Iterable[int]] = None,
+    query_vector: Optional[Sequence[float]] = None,
+    rerank_depth: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Search `candidates` chunks and return the `top_k` best after reranking.
+
+    Only the first `rerank_depth` candidates are reranked (all when None);
+    the rest follow in vector order.
+
+    When `doc_ids` is given the search is restricted to those documents by a
+    Qdrant payload filter, so candidates and rerank budget are spent only on
+    documents the caller may use. `query_vector` (from :func:`embed`) saves
+    the service a second encode. Each item is ``{"text", "doc_id", "score"}``.
+    If reranking fails on the service side we fall back to plain vector
+    search. Raises RagServiceError.
+    """
+    doc_id_list = sorted(doc_ids) if doc_ids is not None else None
+    if doc_id_list is not None and not doc_id_list:
+        return []
+    try:
+        data = _post(
+            "/retrieve",
+            {
+                "question": query,
+                "candidates": candidates,
+                "top_k": top_k,
+                "rerank": rerank,
+                "rerank_depth": rerank_depth,
+                "doc_ids": doc_id_list,
+                "query_vector": list(query_vector) if query_vector is not None else None,
+            },
+        )
+    except RagServiceError as exc:
+        if not exc.reachable:
+            raise
+        data = _post("/search", {"question": query, "top_k": top_k, "doc_ids": doc_id_list})
+    return [_to_doc(item) for item in data.get("results", [])]
+
+
+def embed(query: str) -> Tuple[List[float], int]:
+    """Return the query embedding and the current index generation.
+
+    The generation changes whenever rag_service rewrites its index, so
+    anything derived from search results can use it as a cache key.
+    Raises RagServiceError.
+    """
+    data = _post("/embed", {"question": query})
+    return data["vector"], int(data["index_generation"])
+
+
+def rerank(query: str, documents: List[str], top_k: int = 3) -> List[str]:
+    """Return the `top_k` most relevant documents. Raises RagServiceError."""
+    data = _post("/rerank", {"question": query, "documents": documents, "top_k": top_k})
+    return [item["text"] for item in data.get("results", [])]
+
+
+def memory_upsert(user_id: int, items: Iterable[Tuple[int, str]]) -> int:
+    """Index ``(memory_id, text)`` snippets for `user_id`. Raises RagServiceError."""
+    payload = [{"id": int(memory_id), "text": text} for memory_id, text in items if text]
+    if not payload:
+        return 0
+    data = _post("/memory/upsert", {"user_id": int(user_id), "items": payload})
+    return int(data.get("upserted", 0))
+
+
+def memory_search(
+    user_id: int,
+    query: str,
+    top_k: int = 8,
+    query_vector: Optional[Sequence[float]] = None,
+) -> List[Dict[str, Any]]:
+    """The user's memory snippets most similar to `query`, best first.
+
+    Each item is ``{"id", "score", "text"}``. Raises RagServiceError.
+    """
+    data = _post(
+        "/memory/search",
+        {
+            "user_id": int(user_id),
+            "question": query,
+            "top_k": top_k,
+            "query_vector": list(query_vector) if query_vector is not None else None,
+        },
+    )
+    return list(data.get("results", []))
+
+
+def memory_delete(user_id: int, ids: Optional[Iterable[int]] = None) -> None:
+    """Drop indexed snippets (all of the user's when `ids` is None). Raises RagServiceError."""
+    _post("/memory/delete", {"user_id": int(user_id), "ids": sorted(ids) if ids is not None else None})
+
+
+def service_available() -> bool:
+    return time.monotonic() >= _unavailable_until
+
+
+__all__ = [
+    "RagServiceError",
+    "embed",
+    "memory_delete",
+    "memory_search",
+    "memory_upsert",
+    "rerank",
+    "retrieve",
+    "service_available",
+]
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable
+
+from utils.metrics import PRE_LLM_CRITICAL_PATH, PRE_LLM_STAGE_DURATION
+
+PRE_LLM_WORKERS = int(os.getenv("PRE_LLM_WORKERS", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=PRE_LLM_WORKERS, thread_name_prefix="pre-llm")
+
+
+class StagePlan:
+    """Runs independent request stages concurrently and joins them.
+
+    Every stage runs on a shared thread pool inside its own app context,
+    so it gets its own DB session; stages must return plain data, not ORM
+    instances. A stage listed with ``after=`` is submitted only once its
+    dependencies have finished and receives their results as extra
+    positional arguments, so no pool thread ever blocks waiting on another.
+    """
+
+    def __init__(self, app, executor: ThreadPoolExecutor = _executor):
+        self._app = app
+        self._executor = executor
+        self._futures: Dict[str, Future] = {}
+        self._durations: Dict[str, float] = {}
+        self._started = time.perf_counter()
+        self.critical_path = 0.0
+
+    def add(self, name: str, fn: Callable[..., Any], *args, after: Iterable[str] = ()) -> Future:
+        future: Future = Future()
+        self._futures[name] = future
+        deps = [self._futures[dep] for dep in after]
+
+        def launch():
+            failed = next((d for d in deps if d.exception() is not None), None)
+            if failed is not None:
+                future.set_exception(failed.exception())
+                return
+            dep_results = [d.result() for d in deps]
+            try:
+                self._executor.submit(self._run, name, fn, (*args, *dep_results), future)
+            except BaseException as exc:  # pool shut down: fail the stage instead of leaving join() waiting
+                future.set_exception(exc)
+
+        if not deps:
+            launch()
+            return future
+
+        remaining = [len(deps)]
+        lock = threading.Lock()
+
+        def on_dep_done(_):
+            with lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                launch()
+
+        for dep in deps:
+            dep.add_done_callback(on_dep_done)
+        return future
+
+    def _run(self, name: str, fn: Callable[..., Any], args: tuple, future: Future) -> None:
+        start = time.perf_counter()
+        result, error = None, None
+        try:
+            with self._app.app_context():
+                result = fn(*args)
+        except BaseException as exc:
+            error = exc
+        # record the duration before resolving, so join() always sees it
+        elapsed = time.perf_counter() - start
+        self._durations[name] = elapsed
+        PRE_LLM_STAGE_DURATION.labels(stage=name).observe(elapsed)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def join(self) -> Dict[str, Any]:
+        """Wait for every stage; re-raises the first stage error."""
+        results = {}
+        try:
+            for name, future in self._futures.items():
+                results[name] = future.result()
+        finally:
+            self.critical_path = time.perf_counter() - self._started
+            PRE_LLM_CRITICAL_PATH.observe(self.critical_path)
+        return results
+
+    def timings_ms(self) -> Dict[str, float]:
+        """Per-stage durations plus wall-clock (critical path) and their sum."""
+        timings = {name: round(value * 1000, 1) for name, value in self._durations.items()}
+        timings["sum_of_stages"] = round(sum(self._durations.values()) * 1000, 1)
+        timings["critical_path"] = round(self.critical_path * 1000, 1)
+        return timings
+
+
+__all__ = ["StagePlan"]
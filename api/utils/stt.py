@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Type
+
+import speech_recognition as sr
+
+from utils.metrics import STT_AUDIO_SECONDS, STT_RTF, STT_SECONDS
+
+# Engines: faster-whisper (local CPU, default), vosk (local CPU, smallest),
+# google (web API, needs internet).
+STT_ENGINE = os.getenv("STT_ENGINE", "faster-whisper").strip().lower()
+STT_LANGUAGE = os.getenv("STT_LANGUAGE", "ru")
+# faster-whisper: tiny / base / small / medium / large-v3 or a local model dir.
+STT_MODEL_SIZE = os.getenv("STT_MODEL_SIZE", "small")
+# int8 keeps the model quantized in memory; float32 is slower on CPU.
+STT_COMPUTE_TYPE = os.getenv("STT_COMPUTE_TYPE", "int8")
+STT_CPU_THREADS = int(os.getenv("STT_CPU_THREADS", "4"))
+# Parallel transcribe() calls the model accepts; match VOICE_WORKERS.
+STT_NUM_WORKERS = int(os.getenv("STT_NUM_WORKERS", os.getenv("VOICE_WORKERS", "2")))
+STT_BEAM_SIZE = int(os.getenv("STT_BEAM_SIZE", "1"))
+# vosk: path to an unpacked model, e.g. vosk-model-small-ru-0.22
+STT_VOSK_MODEL_PATH = os.getenv("STT_VOSK_MODEL_PATH", "models/vosk-model-small-ru-0.22")
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2  # 16-bit PCM
+
+
+@dataclass
+class Transcript:
+    text: str
+    engine: str
+    audio_seconds: float
+    decode_seconds: float
+    transcribe_seconds: float
+    segments: List[dict] = field(default_factory=list)  # per-segment timings, see voice_pipeline
+
+    @property
+    def rtf(self) -> float:
+        """Real-time factor: processing time per second of audio (<1 is faster than real time)."""
+        if not self.audio_seconds:
+            return 0.0
+        return (self.decode_seconds + self.transcribe_seconds) / self.audio_seconds
+
+    def timings(self) -> dict:
+        data = asdict(self)
+        data.pop("text")
+        data["rtf"] = round(self.rtf, 3)
+        for key in ("audio_seconds", "decode_seconds", "transcribe_seconds"):
+            data[key] = round(data[key], 3)
+        return data
+
+
+class STTEngine:
+    """Speech-to-text backend. Gets 16 kHz mono 16-bit PCM, returns text."""
+
+    name = "base"
+
+    def transcribe(self, pcm: bytes) -> str:
+        raise NotImplementedError
+
+
+class FasterWhisperEngine(STTEngine):
+    name = "faster-whisper"
+
+    def __init__(self):
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(
+            STT_MODEL_SIZE,
+            device="cpu",
+            compute_type=STT_COMPUTE_TYPE,
+            cpu_threads=STT_CPU_THREADS,
+            num_workers=STT_NUM_WORKERS,
+        )
+
+    def transcribe(self, pcm: bytes) -> str:
+        import numpy as np
+
+        audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        segments, _ = self.model.transcribe(
+            audio,
+            language=STT_LANGUAGE,
+            beam_size=STT_BEAM_SIZE,
+            vad_filter=True,  # skip silence instead of decoding it
+        )
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+class VoskEngine(STTEngine):
+    name = "vosk"
+
+    def __init__(self):
+        from vosk import Model, SetLogLevel
+
+        SetLogLevel(-1)
+        self.model = Model(STT_VOSK_MODEL_PATH)
+
+    def transcribe(self, pcm: bytes) -> str:
+        from vosk import KaldiRecognizer
+
+        # The model is shared; a recognizer holds per-stream state.
+        recognizer = KaldiRecognizer(self.model, SAMPLE_RATE)
+        recognizer.AcceptWaveform(pcm)
+        return json.loads(recognizer.FinalResult()).get("text", "").strip()
+
+
+class GoogleEngine(STTEngine):
+    name = "google"
+
+    def __init__(self):
+        self.recognizer = sr.Recognizer()
+
+    def transcribe(self, pcm: bytes) -> str:
+        audio = sr.AudioData(pcm, SAMPLE_RATE, SAMPLE_WIDTH)
+        language = STT_LANGUAGE if "-" in STT_LANGUAGE else f"{STT_LANGUAGE}-{STT_LANGUAGE.upper()}"
+        return self.recognizer.recognize_google(audio, language=language)
+
+
+ENGINES: Dict[str, Type[STTEngine]] = {
+    FasterWhisperEngine.name: FasterWhisperEngine,
+    VoskEngine.name: VoskEngine,
+    GoogleEngine.name: GoogleEngine,
+}
+
+_engine: Optional[STTEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_stt_engine() -> STTEngine:
+    """The configured engine, loaded once per worker process."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                try:
+                    engine_cls = ENGINES[STT_ENGINE]
+                except KeyError:
+                    raise ValueError(f"unknown STT_ENGINE {STT_ENGINE!r}, expected one of {sorted(ENGINES)}")
+                _engine = engine_cls()
+    return _engine
+
+
+def decode_audio(audio) -> bytes:
+    """Read a WAV/AIFF/FLAC file (path or file object) as 16 kHz mono 16-bit PCM."""
+    with sr.AudioFile(audio) as source:
+        data = sr.Recognizer().record(source)
+    return data.get_raw_data(convert_rate=SAMPLE_RATE, convert_width=SAMPLE_WIDTH)
+
+
+def pcm_seconds(pcm: bytes) -> float:
+    return len(pcm) / (SAMPLE_RATE * SAMPLE_WIDTH)
+
+
+def observe_transcript(transcript: Transcript) -> None:
+    engine = transcript.engine
+    STT_SECONDS.labels(engine=engine).observe(transcript.decode_seconds + transcript.transcribe_seconds)
+    STT_AUDIO_SECONDS.labels(engine=engine).observe(transcript.audio_seconds)
+    if transcript.audio_seconds:
+        STT_RTF.labels(engine=engine).observe(transcript.rtf)
+
+
+def transcribe_audio(audio) -> Transcript:
+    """Decode and transcribe one voice message, recording latency and RTF."""
+    engine = get_stt_engine()
+    started = time.perf_counter()
+    pcm = decode_audio(audio)
+    decoded = time.perf_counter()
+    text = engine.transcribe(pcm)
+    finished = time.perf_counter()
+
+    transcript = Transcript(
+        text=text,
+        engine=engine.name,
+        audio_seconds=pcm_seconds(pcm),
+        decode_seconds=decoded - started,
+        transcribe_seconds=finished - decoded,
+    )
+    observe_transcript(transcript)
+    return transcript
+
+
+__all__ = [
+    "ENGINES",
+    "STTEngine",
+    "Transcript",
+    "decode_audio",
+    "get_stt_engine",
+    "observe_transcript",
+    "pcm_seconds",
+    "transcribe_audio",
+]
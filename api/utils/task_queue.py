@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, delete, event, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from database import db
+from Models.OutboxTask import OutboxTask
+from utils.metrics import OUTBOX_LAG, OUTBOX_OLDEST_PENDING, OUTBOX_PENDING, OUTBOX_TASKS
+
+logger = logging.getLogger(__name__)
+
+TASK_WORKERS = int(os.getenv("TASK_WORKERS", "2"))
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", "1"))
+TASK_BATCH_SIZE = int(os.getenv("TASK_BATCH_SIZE", "10"))
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "5"))
+TASK_RETRY_BASE_DELAY = float(os.getenv("TASK_RETRY_BASE_DELAY", "2"))
+TASK_RETRY_MAX_DELAY = float(os.getenv("TASK_RETRY_MAX_DELAY", "300"))
+# A task still "running" after this long belonged to a worker that died.
+TASK_LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", "300"))
+TASK_STATS_INTERVAL = float(os.getenv("TASK_STATS_INTERVAL", "10"))
+# Finished (done/failed) tasks are kept this long, then deleted. Their
+# idempotency keys are forgotten with them, so keep it above any retry window.
+TASK_RETENTION_HOURS = float(os.getenv("TASK_RETENTION_HOURS", "168"))
+TASK_CLEANUP_INTERVAL = float(os.getenv("TASK_CLEANUP_INTERVAL", "600"))
+TASK_CLEANUP_BATCH = int(os.getenv("TASK_CLEANUP_BATCH", "1000"))
+
+_handlers: Dict[str, Callable[..., Any]] = {}
+_SESSION_FLAG = "outbox_enqueued"
+_ON_COMMIT = "outbox_on_commit"
+
+
+def task(kind: str):
+    """Register `fn(**payload)` as the handler for `kind`.
+
+    Handlers run in an app context and may be retried, so they must be
+    safe to run more than once for the same payload. They must not commit:
+    their writes are flushed and committed by the worker together with the
+    task's "done" status, so a crash in between can't apply them twice.
+    Work that must follow the commit goes through :func:`on_commit`.
+    """
+    def decorator(fn):
+        _handlers[kind] = fn
+        return fn
+    return decorator
+
+
+def enqueue(
+    kind: str,
+    payload: Optional[Dict[str, Any]] = None,
+    idempotency_key: Optional[str] = None,
+    delay: float = 0,
+    max_attempts: int = TASK_MAX_ATTEMPTS,
+) -> None:
+    """Add a task to the current transaction; it becomes visible on commit.
+
+    A task with an `idempotency_key` that already exists is silently
+    skipped, so retried requests don't duplicate side effects.
+    """
+    now = datetime.utcnow()
+    stmt = insert(OutboxTask).values(
+        kind=kind,
+        payload=payload or {},
+        idempotency_key=idempotency_key,
+        status="pending",
+        attempts=0,
+        max_attempts=max_attempts,
+        run_after=now + timedelta(seconds=delay),
+        created_at=now,
+    )
+    if idempotency_key is not None:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[OutboxTask.idempotency_key])
+    db.session.execute(stmt)
+    db.session.info[_SESSION_FLAG] = True
+
+
+def on_commit(callback: Callable[..., Any], *args) -> None:
+    """Run `callback(*args)` after the current transaction commits (dropped on rollback)."""
+    db.session.info.setdefault(_ON_COMMIT, []).append((callback, args))
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(TASK_RETRY_MAX_DELAY, TASK_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+class TaskQueue:
+    """Worker threads draining the outbox table.
+
+    Workers claim batches with ``FOR UPDATE SKIP LOCKED``, so any number of
+    threads and processes can share the table without handing out a task
+    twice. Failures are retried with jittered exponential backoff until
+    max_attempts, after which the task is parked as failed. Finished tasks
+    are deleted after TASK_RETENTION_HOURS.
+    """
+
+    def __init__(self, workers: int = TASK_WORKERS, poll_interval: float = TASK_POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._app = None
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._last_stats = 0.0
+        self._last_cleanup = 0.0
+        self._stats_lock = threading.Lock()
+
+    def start(self, app) -> None:
+        """Start the workers for `app`; safe to call more than once."""
+        self._app = app
+        if self._threads or self.workers <= 0:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            processed = 0
+            try:
+                with self._app.app_context():
+                    processed = self.run_once()
+                    self._maybe_update_stats()
+                    self._maybe_cleanup()
+            except Exception:
+                logger.exception("outbox worker iteration failed")
+            if processed:
+                continue  # there may be more work right away
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def run_once(self, limit: int = TASK_BATCH_SIZE) -> int:
+        """Claim and run up to `limit` due tasks; returns how many ran."""
+        claimed = self._claim(limit)
+        for task_row in claimed:
+            self._execute(task_row)
+        return len(claimed)
+
+    @staticmethod
+    def _claim(limit: int):
+        now = datetime.utcnow()
+        due = or_(
+            and_(OutboxTask.status == "pending", OutboxTask.run_after <= now),
+            and_(OutboxTask.status == "running", OutboxTask.started_at < now - timedelta(seconds=TASK_LEASE_SECONDS)),
+        )
+        ids = (
+            select(OutboxTask.id)
+            .where(due)
+            .order_by(OutboxTask.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(OutboxTask)
+            .where(OutboxTask.id.in_(ids))
+            .values(status="running", started_at=now, attempts=OutboxTask.attempts + 1)
+            .returning(
+                OutboxTask.id, OutboxTask.kind, OutboxTask.payload,
+                OutboxTask.attempts, OutboxTask.max_attempts, OutboxTask.run_after,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            rows = db.session.execute(stmt).all()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for row in rows:
+            OUTBOX_LAG.labels(kind=row.kind).observe(max((now - row.run_after).total_seconds(), 0))
+        return rows
+
+    def _execute(self, row) -> None:
+        handler = _handlers.get(row.kind)
+        try:
+            if handler is None:
+                raise LookupError(f"no handler registered for task kind {row.kind!r}")
+            handler(**(row.payload or {}))
+            # the handler's writes and the "done" mark commit atomically
+            db.session.execute(
+                update(OutboxTask)
+                .where(OutboxTask.id == row.id)
+                .values(status="done", finished_at=datetime.utcnow(), last_error=None)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            self._fail(row, exc)
+            return
+        OUTBOX_TASKS.labels(kind=row.kind, result="ok").inc()
+
+    @staticmethod
+    def _fail(row, exc: Exception) -> None:
+        final = row.attempts >= row.max_attempts
+        values = {"last_error": f"{type(exc).__name__}: {exc}"[:2000]}
+        if final:
+            values.update(status="failed", finished_at=datetime.utcnow())
+            logger.error("outbox task %s (%s) failed for good: %s", row.id, row.kind, exc)
+        else:
+            values.update(status="pending", run_after=datetime.utcnow() + timedelta(seconds=_backoff(row.attempts)))
+            logger.warning("outbox task %s (%s) attempt %s failed: %s", row.id, row.kind, row.attempts, exc)
+        db.session.execute(
+            update(OutboxTask)
+            .where(OutboxTask.id == row.id)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        OUTBOX_TASKS.labels(kind=row.kind, result="failed" if final else "retry").inc()
+
+    def _maybe_update_stats(self) -> None:
+        now = datetime.utcnow().timestamp()
+        with self._stats_lock:
+            if now - self._last_stats < TASK_STATS_INTERVAL:
+                return
+            self._last_stats = now
+        pending, oldest = (
+            db.session.query(func.count(OutboxTask.id), func.min(OutboxTask.created_at))
+            .filter(OutboxTask.status == "pending")
+            .one()
+        )
+        OUTBOX_PENDING.set(pending)
+        OUTBOX_OLDEST_PENDING.set((datetime.utcnow() - oldest).total_seconds() if oldest else 0)
+
+    def _maybe_cleanup(self) -> None:
+        now = datetime.utcnow().timestamp()
+        with self._stats_lock:
+            if now - self._last_cleanup < TASK_CLEANUP_INTERVAL:
+                return
+            self._last_cleanup = now
+        deleted = self.cleanup()
+        if deleted:
+            logger.info("outbox cleanup removed %s finished tasks", deleted)
+
+    @staticmethod
+    def cleanup(retention_hours: float = TASK_RETENTION_HOURS, batch: int = TASK_CLEANUP_BATCH) -> int:
+        """Delete done/failed tasks finished more than `retention_hours` ago.
+
+        Deletes in batches of `batch` rows so no transaction holds many
+        locks; returns how many rows were removed.
+        """
+        cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+        total = 0
+        while True:
+            ids = (
+                select(OutboxTask.id)
+                .where(OutboxTask.status.in_(("done", "failed")), OutboxTask.finished_at < cutoff)
+                .limit(batch)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            try:
+                deleted = db.session.execute(
+                    delete(OutboxTask)
+                    .where(OutboxTask.id.in_(ids))
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            total += deleted
+            if deleted < batch:
+                return total
+
+
+task_queue = TaskQueue()
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_workers(session) -> None:
+    # Tasks enqueued in this transaction are now visible: don't wait for the poll.
+    if session.info.pop(_SESSION_FLAG, False):
+        task_queue.wake()
+    for callback, args in session.info.pop(_ON_COMMIT, []):
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception("on_commit callback %r failed", callback)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_enqueued(session) -> None:
+    session.info.pop(_SESSION_FLAG, None)
+    session.info.pop(_ON_COMMIT, None)
+
+
+__all__ = [
+    "TaskQueue",
+    "enqueue",
+    "on_commit",
+    "task",
+    "task_queue",
+]
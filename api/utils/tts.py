@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import io
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import wave
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Type
+
+from utils.metrics import TTS_AUDIO_SECONDS, TTS_RTF, TTS_SYNTH_SECONDS
+
+# Engines: piper (local CPU neural voice, default), espeak (local CPU,
+# formant voice, smallest), gtts (Google web API, needs internet).
+TTS_ENGINE = os.getenv("TTS_ENGINE", "piper").strip().lower()
+TTS_LANGUAGE = os.getenv("TTS_LANGUAGE", "ru")
+# piper: path to a voice model, the .onnx.json config must lie next to it.
+TTS_PIPER_MODEL = os.getenv("TTS_PIPER_MODEL", "models/ru_RU-irina-medium.onnx")
+TTS_PIPER_SPEAKER = os.getenv("TTS_PIPER_SPEAKER")  # multi-speaker models only
+TTS_ESPEAK_BINARY = os.getenv("TTS_ESPEAK_BINARY", "espeak-ng")
+TTS_ESPEAK_VOICE = os.getenv("TTS_ESPEAK_VOICE", "ru")
+TTS_ESPEAK_RATE = int(os.getenv("TTS_ESPEAK_RATE", "160"))  # words per minute
+# wav and raw are produced in-process; mp3 and ogg are encoded with ffmpeg.
+TTS_FORMAT = os.getenv("TTS_FORMAT", "wav").strip().lower()
+TTS_FFMPEG_BINARY = os.getenv("TTS_FFMPEG_BINARY", "ffmpeg")
+TTS_SENTENCE_PAUSE_MS = int(os.getenv("TTS_SENTENCE_PAUSE_MS", "150"))
+TTS_MAX_SENTENCE_CHARS = int(os.getenv("TTS_MAX_SENTENCE_CHARS", "400"))
+
+SAMPLE_WIDTH = 2  # 16-bit PCM
+
+FORMATS: Dict[str, Dict[str, str]] = {
+    "wav": {"mimetype": "audio/wav", "extension": ".wav"},
+    "raw": {"mimetype": "audio/L16", "extension": ".pcm"},  # s16le mono, rate in X-TTS-Sample-Rate
+    "mp3": {"mimetype": "audio/mpeg", "extension": ".mp3"},
+    "ogg": {"mimetype": "audio/ogg", "extension": ".ogg"},  # opus
+}
+_FFMPEG_CODECS = {"mp3": ["-f", "mp3", "-c:a", "libmp3lame", "-q:a", "4"], "ogg": ["-f", "ogg", "-c:a", "libopus", "-b:a", "32k"]}
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+_SPLIT_RE = re.compile(r"(?<=[,;:])\s+|\s+")
+
+
+@dataclass
+class Speech:
+    data: bytes
+    format: str
+    engine: str
+    sample_rate: int
+    audio_seconds: float
+    synth_seconds: float
+    encode_seconds: float
+
+    @property
+    def mimetype(self) -> str:
+        return FORMATS[self.format]["mimetype"]
+
+    @property
+    def extension(self) -> str:
+        return FORMATS[self.format]["extension"]
+
+    @property
+    def rtf(self) -> float:
+        """Real-time factor: processing time per second of audio (<1 is faster than real time)."""
+        if not self.audio_seconds:
+            return 0.0
+        return (self.synth_seconds + self.encode_seconds) / self.audio_seconds
+
+    def timings(self) -> dict:
+        return {
+            "engine": self.engine,
+            "audio_seconds": round(self.audio_seconds, 3),
+            "synth_seconds": round(self.synth_seconds, 3),
+            "encode_seconds": round(self.encode_seconds, 3),
+            "rtf": round(self.rtf, 3),
+        }
+
+
+class TTSEngine:
+    """Text-to-speech backend. Gets one sentence, returns mono 16-bit PCM at `sample_rate`."""
+
+    name = "base"
+    sample_rate = 22050
+
+    def synthesize(self, text: str) -> bytes:
+        raise NotImplementedError
+
+
+class PiperEngine(TTSEngine):
+    name = "piper"
+
+    def __init__(self):
+        from piper.voice import PiperVoice
+
+        self.voice = PiperVoice.load(TTS_PIPER_MODEL)
+        self.sample_rate = self.voice.config.sample_rate
+        self.speaker_id = int(TTS_PIPER_SPEAKER) if TTS_PIPER_SPEAKER else None
+
+    def synthesize(self, text: str) -> bytes:
+        if hasattr(self.voice, "synthesize_stream_raw"):  # piper-tts < 1.3
+            return b"".join(self.voice.synthesize_stream_raw(text, speaker_id=self.speaker_id))
+        from piper import SynthesisConfig
+
+        config = SynthesisConfig(speaker_id=self.speaker_id)
+        return b"".join(chunk.audio_int16_bytes for chunk in self.voice.synthesize(text, syn_config=config))
+
+
+class EspeakEngine(TTSEngine):
+    name = "espeak"
+
+    def __init__(self):
+        if shutil.which(TTS_ESPEAK_BINARY) is None:
+            raise RuntimeError(f"{TTS_ESPEAK_BINARY} not found in PATH")
+
+    def synthesize(self, text: str) -> bytes:
+        result = subprocess.run(
+            [TTS_ESPEAK_BINARY, "-v", TTS_ESPEAK_VOICE, "-s", str(TTS_ESPEAK_RATE), "--stdout"],
+            input=text.encode("utf-8"),
+            capture_output=True,
+            check=True,
+        )
+        with wave.open(io.BytesIO(result.stdout)) as wav:
+            self.sample_rate = wav.getframerate()
+            return wav.readframes(wav.getnframes())
+
+
+class GTTSEngine(TTSEngine):
+    """Google TTS. Returns mp3 for the whole text, so it is not split into sentences."""
+
+    name = "gtts"
+    native_format = "mp3"
+
+    def synthesize_native(self, text: str) -> bytes:
+        from gtts import gTTS
+
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=TTS_LANGUAGE).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+ENGINES: Dict[str, Type[TTSEngine]] = {
+    PiperEngine.name: PiperEngine,
+    EspeakEngine.name: EspeakEngine,
+    GTTSEngine.name: GTTSEngine,
+}
+
+_engine: Optional[TTSEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_tts_engine() -> TTSEngine:
+    """The configured engine, loaded once per worker process."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                try:
+                    engine_cls = ENGINES[TTS_ENGINE]
+                except KeyError:
+                    raise ValueError(f"unknown TTS_ENGINE {TTS_ENGINE!r}, expected one of {sorted(ENGINES)}")
+                _engine = engine_cls()
+    return _engine
+
+
+def voice_id() -> str:
+    """Identifies what the configured engine sounds like, without loading it."""
+    voice = {
+        PiperEngine.name: f"{os.path.basename(TTS_PIPER_MODEL)}:{TTS_PIPER_SPEAKER or ''}",
+        EspeakEngine.name: f"{TTS_ESPEAK_VOICE}:{TTS_ESPEAK_RATE}",
+        GTTSEngine.name: TTS_LANGUAGE,
+    }.get(TTS_ENGINE, "")
+    return f"{TTS_ENGINE}:{voice}"
+
+
+def split_sentences(text: str, max_chars: int = TTS_MAX_SENTENCE_CHARS) -> List[str]:
+    """Sentences of `text`; overly long ones are cut at the last comma or space that fits."""
+    sentences = []
+    for sentence in _SENTENCE_RE.split(text or ""):
+        sentence = sentence.strip()
+        while len(sentence) > max_chars:
+            breaks = [m.start() for m in _SPLIT_RE.finditer(sentence, 0, max_chars + 1)]
+            cut = breaks[-1] if breaks and breaks[-1] > 0 else max_chars
+            sentences.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+def iter_sentence_pcm(text: str, engine: Optional[TTSEngine] = None) -> Iterator[tuple]:
+    """Yield ``(sentence, pcm, seconds_spent)`` one sentence at a time."""
+    engine = engine or get_tts_engine()
+    for sentence in split_sentences(text):
+        started = time.perf_counter()
+        pcm = engine.synthesize(sentence)
+        yield sentence, pcm, time.perf_counter() - started
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def _ffmpeg(args: List[str], data: bytes, output: str) -> bytes:
+    result = subprocess.run(
+        [TTS_FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", *args, "-i", "pipe:0", *_FFMPEG_CODECS[output], "pipe:1"],
+        input=data,
+        capture_output=True,
+        check=True,
+    )
+    return result.stdout
+
+
+def encode_pcm(pcm: bytes, sample_rate: int, fmt: str) -> bytes:
+    """Encode mono 16-bit PCM into one of FORMATS."""
+    if fmt == "raw":
+        return pcm
+    if fmt == "wav":
+        return pcm_to_wav(pcm, sample_rate)
+    return _ffmpeg(["-f", "s16le", "-ar", str(sample_rate), "-ac", "1"], pcm, fmt)
+
+
+def pcm_seconds(pcm: bytes, sample_rate: int) -> float:
+    return len(pcm) / (sample_rate * SAMPLE_WIDTH)
+
+
+def synthesize_speech(text: str, fmt: str = TTS_FORMAT) -> Speech:
+    """Synthesize `text` sentence by sentence and encode it as `fmt`, recording RTF."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown TTS format {fmt!r}, expected one of {sorted(FORMATS)}")
+    engine = get_tts_engine()
+    native = getattr(engine, "native_format", None)
+
+    if native is not None:
+        if fmt != native:
+            raise ValueError(f"TTS engine {engine.name!r} only produces {native}")
+        started = time.perf_counter()
+        data = engine.synthesize_native(text)
+        speech = Speech(data, fmt, engine.name, 0, 0.0, time.perf_counter() - started, 0.0)
+    else:
+        parts, synth_seconds = [], 0.0
+        for _, pcm, spent in iter_sentence_pcm(text, engine):
+            parts.append(pcm)
+            synth_seconds += spent
+        # the sample rate of some engines is only known after the first sentence
+        pause = b"\0" * (engine.sample_rate * TTS_SENTENCE_PAUSE_MS // 1000 * SAMPLE_WIDTH)
+        pcm = pause.join(parts)
+        started = time.perf_counter()
+        data = encode_pcm(pcm, engine.sample_rate, fmt)
+        speech = Speech(
+            data, fmt, engine.name, engine.sample_rate,
+            pcm_seconds(pcm, engine.sample_rate), synth_seconds, time.perf_counter() - started,
+        )
+
+    TTS_SYNTH_SECONDS.labels(engine=engine.name).observe(speech.synth_seconds + speech.encode_seconds)
+    if speech.audio_seconds:
+        TTS_AUDIO_SECONDS.labels(engine=engine.name).observe(speech.audio_seconds)
+        TTS_RTF.labels(engine=engine.name).observe(speech.rtf)
+    return speech
+
+
+def default_format() -> str:
+    """TTS_FORMAT, or the engine's own format for engines that cannot produce others."""
+    return getattr(ENGINES.get(TTS_ENGINE), "native_format", None) or TTS_FORMAT
+
+
+__all__ = [
+    "ENGINES",
+    "FORMATS",
+    "Speech",
+    "TTSEngine",
+    "default_format",
+    "encode_pcm",
+    "get_tts_engine",
+    "iter_sentence_pcm",
+    "pcm_to_wav",
+    "split_sentences",
+    "synthesize_speech",
+    "voice_id",
+]
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from utils.llm_gateway import SingleFlight
+from utils.metrics import TTS_CACHE_BYTES, TTS_CACHE_REQUESTS
+from utils.tts import FORMATS, Speech, synthesize_speech, voice_id
+
+logger = logging.getLogger(__name__)
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tts_cache"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Hot phrases (greetings, standard answers) are also kept in process memory.
+TTS_MEMORY_CACHE_MAX_BYTES = int(os.getenv("TTS_MEMORY_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# Audio for a given key never changes, so clients may keep it for long.
+TTS_CACHE_MAX_AGE = int(os.getenv("TTS_CACHE_MAX_AGE", "86400"))
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+@dataclass(frozen=True)
+class SpeechAudio:
+    key: str
+    format: str
+    data: bytes
+    cache: str = "miss"  # memory / disk / miss / shared
+    speech: Optional[Speech] = None  # synthesis timings, only on a miss
+
+    @property
+    def mimetype(self) -> str:
+        return FORMATS[self.format]["mimetype"]
+
+    @property
+    def extension(self) -> str:
+        return FORMATS[self.format]["extension"]
+
+
+def normalize_text(text: str) -> str:
+    return _SPACE_RE.sub(" ", text or "").strip()
+
+
+def cache_key(text: str, voice: str, fmt: str) -> str:
+    """Content address of the audio: the same text, voice and format always map to the same key."""
+    raw = f"{voice}\0{fmt}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+class _MemoryLRU:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+
+class _DiskLRU:
+    """Files named by key in one directory, evicted by last access once over `max_bytes`.
+
+    Access time is kept in the file mtime, so the order survives restarts
+    and is shared by every worker process using the directory.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, extension: str):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.extension)
+
+    def _load(self) -> None:
+        # caller holds the lock
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.extension):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, name[: -len(self.extension)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self._bytes += size
+        self._loaded = True
+        TTS_CACHE_BYTES.set(self._bytes)
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        with self._lock:
+            self._load()
+            if key not in self._sizes and not os.path.exists(path):
+                return None
+            try:
+                os.utime(path)
+            except FileNotFoundError:  # evicted by another process
+                self._forget(key)
+                return None
+            if key not in self._sizes:  # written by another process
+                self._sizes[key] = os.path.getsize(path)
+                self._bytes += self._sizes[key]
+            self._sizes.move_to_end(key)
+        return path
+
+    def put(self, key: str, data: bytes) -> str:
+        path = self._path(key)
+        with self._lock:
+            self._load()
+            # write-then-rename: readers never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._forget(key)
+            self._sizes[key] = len(data)
+            self._bytes += len(data)
+            self._evict(keep=key)
+            TTS_CACHE_BYTES.set(self._bytes)
+        return path
+
+    def _forget(self, key: str) -> None:
+        size = self._sizes.pop(key, None)
+        if size is not None:
+            self._bytes -= size
+
+    def _evict(self, keep: str) -> None:
+        while self._bytes > self.max_bytes and len(self._sizes) > 1:
+            key = next(iter(self._sizes))
+            if key == keep:
+                break
+            self._forget(key)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+
+class TTSCache:
+    """Content-addressed cache of synthesized speech.
+
+    Lookups go memory -> disk -> synthesis; disk hits are promoted to
+    memory. Concurrent requests for the same phrase share one synthesis.
+    Audio is addressed by its key, so it can also be served by key alone
+    (see lookup) on a cacheable GET.
+    """
+
+    def __init__(
+        self,
+        synthesize: Callable[[str, str], Speech] = synthesize_speech,
+        directory: str = TTS_CACHE_DIR,
+        max_bytes: int = TTS_CACHE_MAX_BYTES,
+        memory_max_bytes: int = TTS_MEMORY_CACHE_MAX_BYTES,
+    ):
+        self.synthesize = synthesize
+        self.memory = _MemoryLRU(memory_max_bytes)
+        self.disk = _DiskLRU(directory, max_bytes, ".tts")
+        self._flight = SingleFlight()
+
+    def lookup(self, key: str, fmt: str) -> Optional[SpeechAudio]:
+        """Already synthesized audio for `key` (memory, then disk), or None."""
+        data = self.memory.get(key)
+        if data is not None:
+            TTS_CACHE_REQUESTS.labels(result="memory").inc()
+            return SpeechAudio(key, fmt, data, cache="memory")
+
+        path = self.disk.get(key)
+        if path is not None:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:  # evicted by another process meanwhile
+                data = None
+            if data is not None:
+                TTS_CACHE_REQUESTS.labels(result="disk").inc()
+                self.memory.put(key, data)
+                return SpeechAudio(key, fmt, data, cache="disk")
+        return None
+
+    def get(self, text: str, fmt: str) -> SpeechAudio:
+        text = normalize_text(text)
+        key = cache_key(text, voice_id(), fmt)
+
+        audio = self.lookup(key, fmt)
+        if audio is not None:
+            return audio
+
+        speech, shared = self._flight.do(key, lambda: self._synthesize(key, text, fmt))
+        TTS_CACHE_REQUESTS.labels(result="shared" if shared else "miss").inc()
+        return SpeechAudio(key, fmt, speech.data, cache="shared" if shared else "miss", speech=speech)
+
+    def _synthesize(self, key: str, text: str, fmt: str) -> Speech:
+        speech = self.synthesize(text, fmt)
+        self.memory.put(key, speech.data)
+        try:
+            self.disk.put(key, speech.data)
+        except OSError:
+            # a full or read-only disk must not fail the request
+            logger.exception("failed to store TTS audio %s on disk", key)
+        return speech
+
+
+tts_cache = TTSCache()
+
+
+__all__ = [
+    "SpeechAudio",
+    "TTSCache",
+    "cache_key",
+    "normalize_text",
+    "tts_cache",
+]
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, FrozenSet, Optional
+
+from utils.answer_cache import answer_cache
+from utils.metrics import (
+    USER_CONTEXT_CACHE_INVALIDATIONS,
+    USER_CONTEXT_CACHE_REQUESTS,
+    USER_CONTEXT_CACHE_SIZE,
+)
+
+USER_CONTEXT_CACHE_SIZE_LIMIT = int(os.getenv("USER_CONTEXT_CACHE_SIZE", "1024"))
+# The cache lives in one worker process, invalidation hooks only reach that
+# process. The TTL bounds how stale another worker's copy can get.
+USER_CONTEXT_CACHE_TTL = float(os.getenv("USER_CONTEXT_CACHE_TTL", "300"))
+
+
+@dataclass(frozen=True)
+class UserContext:
+    """Everything add_message needs about a user before calling the LLM.
+
+    Holds plain values only, never ORM instances, so it is safe to share
+    between requests and threads.
+    """
+
+    user_id: int
+    description: Optional[str]
+    long_term_memory: str
+    permitted_doc_ids: FrozenSet[int]
+
+
+class UserContextCache:
+    """Size-bounded LRU of UserContext keyed by user id."""
+
+    def __init__(self, max_size: int = USER_CONTEXT_CACHE_SIZE_LIMIT, ttl: float = USER_CONTEXT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple[float, UserContext]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation. A load that started before an
+        # invalidation must not put its (possibly stale) result back.
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[UserContext]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                USER_CONTEXT_CACHE_REQUESTS.labels(result="hit").inc()
+                return entry[1]
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+        USER_CONTEXT_CACHE_REQUESTS.labels(result="miss").inc()
+        return None
+
+    def get_or_load(self, user_id: int, loader: Callable[[int], Optional[UserContext]]) -> Optional[UserContext]:
+        cached = self.get(user_id)
+        if cached is not None:
+            return cached
+        epoch = self._epoch
+        context = loader(user_id)
+        if context is not None:
+            self._put(context, epoch)
+        return context
+
+    def _put(self, context: UserContext, epoch: int) -> None:
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            self._entries[context.user_id] = (time.monotonic(), context)
+            self._entries.move_to_end(context.user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            USER_CONTEXT_CACHE_SIZE.set(len(self._entries))
+
+    def invalidate(self, *user_ids) -> None:
+        with self._lock:
+            self._epoch += 1
+            for user_id in user_ids:
+                try:
+                    self._entries.pop(int(user_id), None)
+                except (TypeError, ValueError):
+                    continue
+            USER_CONTEXT_CACHE_SIZE.set(len(self._entries))
+        USER_CONTEXT_CACHE_INVALIDATIONS.inc()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            USER_CONTEXT_CACHE_SIZE.set(0)
+        USER_CONTEXT_CACHE_INVALIDATIONS.inc()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+user_context_cache = UserContextCache()
+
+
+def invalidate_user_context(*user_ids) -> None:
+    """Drop cached contexts; call after committing changes that affect them.
+
+    Cached answers of these users were built from the old context (profile
+    description, memory, permissions) and are dropped too.
+    """
+    user_context_cache.invalidate(*user_ids)
+    answer_cache.invalidate_user(*user_ids)
+
+
+__all__ = [
+    "UserContext",
+    "UserContextCache",
+    "invalidate_user_context",
+    "user_context_cache",
+]
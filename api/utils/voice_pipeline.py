@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+import speech_recognition as sr
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    import audioop  # deprecated in 3.12, provided by audioop-lts on 3.13+
+
+try:
+    import webrtcvad
+except ImportError:  # optional: fall back to an energy threshold
+    webrtcvad = None
+
+from utils.metrics import STT_SEGMENT_SECONDS
+from utils.stt import SAMPLE_RATE, SAMPLE_WIDTH, Transcript, get_stt_engine, observe_transcript, pcm_seconds
+
+VOICE_WORKERS = int(os.getenv("VOICE_WORKERS", "2"))
+# Segments decoded but not yet transcribed; bounds memory for long uploads.
+VOICE_MAX_PENDING_SEGMENTS = int(os.getenv("VOICE_MAX_PENDING_SEGMENTS", str(VOICE_WORKERS * 2)))
+VOICE_VAD_AGGRESSIVENESS = int(os.getenv("VOICE_VAD_AGGRESSIVENESS", "2"))  # webrtcvad 0..3
+VOICE_ENERGY_THRESHOLD = int(os.getenv("VOICE_ENERGY_THRESHOLD", "400"))  # RMS, energy VAD only
+VOICE_MIN_SILENCE_MS = int(os.getenv("VOICE_MIN_SILENCE_MS", "500"))
+VOICE_PAD_MS = int(os.getenv("VOICE_PAD_MS", "200"))
+VOICE_MIN_SPEECH_MS = int(os.getenv("VOICE_MIN_SPEECH_MS", "250"))
+# Whisper works on 30 s windows; longer segments are cut even mid-speech.
+VOICE_MAX_SEGMENT_SECONDS = float(os.getenv("VOICE_MAX_SEGMENT_SECONDS", "25"))
+
+FRAME_MS = 30  # webrtcvad accepts 10/20/30 ms frames
+FRAME_BYTES = SAMPLE_RATE * SAMPLE_WIDTH * FRAME_MS // 1000
+
+_executor = ThreadPoolExecutor(max_workers=VOICE_WORKERS, thread_name_prefix="stt")
+
+
+@dataclass
+class Segment:
+    index: int
+    start: float  # seconds from the beginning of the upload
+    pcm: bytes
+
+    @property
+    def end(self) -> float:
+        return self.start + pcm_seconds(self.pcm)
+
+
+def iter_frames(audio) -> Iterator[bytes]:
+    """Decode an upload block by block into 30 ms frames of 16 kHz mono PCM.
+
+    Only one source block and one partial frame are held at a time, so
+    memory does not grow with the length of the recording.
+    """
+    with sr.AudioFile(audio) as source:
+        rate, width = source.SAMPLE_RATE, source.SAMPLE_WIDTH
+        state = None
+        pending = b""
+        while True:
+            block = source.stream.read(source.CHUNK)  # mono, little-endian
+            if not block:
+                break
+            if width != SAMPLE_WIDTH:
+                block = audioop.lin2lin(block, width, SAMPLE_WIDTH)
+            if rate != SAMPLE_RATE:
+                block, state = audioop.ratecv(block, SAMPLE_WIDTH, 1, rate, SAMPLE_RATE, state)
+            pending += block
+            cut = len(pending) - len(pending) % FRAME_BYTES
+            for offset in range(0, cut, FRAME_BYTES):
+                yield pending[offset:offset + FRAME_BYTES]
+            pending = pending[cut:]
+        if pending:
+            yield pending.ljust(FRAME_BYTES, b"\0")
+
+
+class _Vad:
+    def __init__(self):
+        self._vad = webrtcvad.Vad(VOICE_VAD_AGGRESSIVENESS) if webrtcvad is not None else None
+        self.name = "webrtcvad" if self._vad is not None else "energy"
+
+    def is_speech(self, frame: bytes) -> bool:
+        if self._vad is not None:
+            return self._vad.is_speech(frame, SAMPLE_RATE)
+        return audioop.rms(frame, SAMPLE_WIDTH) >= VOICE_ENERGY_THRESHOLD
+
+
+def iter_segments(frames: Iterator[bytes]) -> Iterator[Segment]:
+    """Group frames into speech segments separated by silence.
+
+    A segment closes after VOICE_MIN_SILENCE_MS of silence or when it
+    reaches VOICE_MAX_SEGMENT_SECONDS; VOICE_PAD_MS of audio is kept on
+    both sides so words are not clipped. Bursts shorter than
+    VOICE_MIN_SPEECH_MS are treated as noise.
+    """
+    vad = _Vad()
+    pad_frames = max(VOICE_PAD_MS // FRAME_MS, 0)
+    silence_frames = max(VOICE_MIN_SILENCE_MS // FRAME_MS, 1)
+    min_speech_frames = max(VOICE_MIN_SPEECH_MS // FRAME_MS, 1)
+    max_frames = int(VOICE_MAX_SEGMENT_SECONDS * 1000 // FRAME_MS)
+
+    preroll: List[bytes] = []
+    current: List[bytes] = []
+    start_frame = 0
+    voiced = 0
+    trailing_silence = 0
+    index = 0
+
+    def close():
+        nonlocal current, voiced, trailing_silence, index
+        segment = None
+        if voiced >= min_speech_frames:
+            keep = len(current) - max(trailing_silence - pad_frames, 0)
+            segment = Segment(index=index, start=start_frame * FRAME_MS / 1000, pcm=b"".join(current[:keep]))
+            index += 1
+        current, voiced, trailing_silence = [], 0, 0
+        return segment
+
+    for position, frame in enumerate(frames):
+        speech = vad.is_speech(frame)
+        if not current:
+            if not speech:
+                preroll.append(frame)
+                del preroll[:-pad_frames or len(preroll)]
+                continue
+            start_frame = position - len(preroll)
+            current, preroll = preroll + [frame], []
+            voiced, trailing_silence = 1, 0
+            continue
+        current.append(frame)
+        if speech:
+            voiced += 1
+            trailing_silence = 0
+        else:
+            trailing_silence += 1
+        if trailing_silence >= silence_frames or len(current) >= max_frames:
+            segment = close()
+            if segment is not None:
+                yield segment
+    if current:
+        segment = close()
+        if segment is not None:
+            yield segment
+
+
+def transcribe_voice_message(audio) -> Transcript:
+    """Transcribe an upload segment by segment on a worker pool.
+
+    Segments are submitted as soon as the decoder closes them, so
+    transcription overlaps decoding; at most VOICE_MAX_PENDING_SEGMENTS are
+    waiting at any time. The text is stitched back in segment order and
+    per-segment timings are attached to the transcript.
+    """
+    engine = get_stt_engine()
+    slots = threading.BoundedSemaphore(VOICE_MAX_PENDING_SEGMENTS)
+    started = time.perf_counter()
+    decode_seconds = 0.0
+    futures: List[Future] = []
+
+    def run(segment: Segment, queued_at: float):
+        try:
+            begin = time.perf_counter()
+            text = engine.transcribe(segment.pcm)
+            elapsed = time.perf_counter() - begin
+            STT_SEGMENT_SECONDS.labels(engine=engine.name).observe(elapsed)
+            return text, {
+                "index": segment.index,
+                "start": round(segment.start, 2),
+                "end": round(segment.end, 2),
+                "queue_seconds": round(begin - queued_at, 3),
+                "transcribe_seconds": round(elapsed, 3),
+            }
+        finally:
+            slots.release()
+
+    frame_count = 0
+
+    def counted(frames):
+        nonlocal frame_count
+        for frame in frames:
+            frame_count += 1
+            yield frame
+
+    segments = iter_segments(counted(iter_frames(audio)))
+    while True:
+        before = time.perf_counter()
+        segment: Optional[Segment] = next(segments, None)
+        decode_seconds += time.perf_counter() - before
+        if segment is None:
+            break
+        slots.acquire()  # back-pressure: wait while too many segments are queued
+        futures.append(_executor.submit(run, segment, time.perf_counter()))
+    audio_seconds = frame_count * FRAME_MS / 1000
+
+    parts, timings = [], []
+    for future in futures:
+        text, timing = future.result()
+        if text:
+            parts.append(text.strip())
+        timings.append(timing)
+    wall = time.perf_counter() - started
+
+    transcript = Transcript(
+        text=" ".join(parts).strip(),
+        engine=engine.name,
+        audio_seconds=audio_seconds,
+        decode_seconds=decode_seconds,
+        transcribe_seconds=max(wall - decode_seconds, 0.0),
+        segments=timings,
+    )
+    observe_transcript(transcript)
+    return transcript
+
+
+__all__ = [
+    "Segment",
+    "iter_frames",
+    "iter_segments",
+    "transcribe_voice_message",
+]
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import base64
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from utils.metrics import VOICE_REPLY_FIRST_AUDIO
+from utils.tts import TTS_MAX_SENTENCE_CHARS
+from utils.tts_cache import SpeechAudio, tts_cache
+
+logger = logging.getLogger(__name__)
+
+# Shorter fragments ("1.", "Да.") are joined with the next sentence: a
+# synthesis call per fragment costs more than it saves in latency.
+VOICE_REPLY_MIN_CHARS = int(os.getenv("VOICE_REPLY_MIN_CHARS", "20"))
+# Sentences synthesized at once across all voice replies of this worker.
+VOICE_REPLY_TTS_CONCURRENCY = int(os.getenv("VOICE_REPLY_TTS_CONCURRENCY", "2"))
+
+_BOUNDARY_RE = re.compile(r"[.!?…]+[\"»)\]]*\s+|\n+")
+_MARKDOWN_RE = re.compile(r"[*_`#>|]+|^\s*(?:[-•]|\d+[.)])\s+", re.MULTILINE)
+_LINK_RE = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+
+_tts_slots = threading.BoundedSemaphore(VOICE_REPLY_TTS_CONCURRENCY)
+
+
+def speakable(text: str) -> str:
+    """Drop markdown the LLM tends to produce; it would be read out literally."""
+    text = _LINK_RE.sub(r"\1", text)
+    return " ".join(_MARKDOWN_RE.sub(" ", text).split())
+
+
+class SentenceChunker:
+    """Cuts a token stream into sentences as soon as each one is complete.
+
+    A sentence is complete once its closing punctuation is followed by
+    whitespace, so "3.5" and an unfinished "т." wait for the next token.
+    Text that grows past `max_chars` without a boundary is cut at a space.
+    """
+
+    def __init__(self, min_chars: int = VOICE_REPLY_MIN_CHARS, max_chars: int = TTS_MAX_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, delta: str) -> List[str]:
+        self._buffer += delta
+        sentences, start = [], 0
+        for match in _BOUNDARY_RE.finditer(self._buffer):
+            if len(self._buffer[start:match.end()].strip()) < self.min_chars:
+                continue
+            sentences.append(self._buffer[start:match.end()].strip())
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        while len(self._buffer) > self.max_chars:
+            cut = self._buffer.rfind(" ", 0, self.max_chars)
+            cut = cut if cut > 0 else self.max_chars
+            sentences.append(self._buffer[:cut].strip())
+            self._buffer = self._buffer[cut:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+
+class VoiceReply:
+    """Synthesizes an answer sentence by sentence while it is being generated.
+
+    `feed()` takes LLM deltas; each completed sentence goes to a worker
+    thread that synthesizes it (through the TTS cache, so stock phrases are
+    reused) while generation continues. `drain()` returns the audio chunks
+    ready so far, in sentence order.
+    """
+
+    def __init__(self, fmt: str, synthesize: Callable[[str, str], SpeechAudio] = tts_cache.get):
+        self.fmt = fmt
+        self.synthesize = synthesize
+        self._chunker = SentenceChunker()
+        self._sentences: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._ready: "queue.Queue[Optional[Dict]]" = queue.Queue()
+        self._cancelled = threading.Event()
+        self._finished = False
+        self._drained = False
+        self._count = 0
+        self.started = time.perf_counter()
+        self.first_sentence_ms: Optional[float] = None
+        self.first_audio_ms: Optional[float] = None
+        self.synth_ms = 0.0
+        self.audio_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name="voice-reply", daemon=True)
+        self._thread.start()
+
+    def feed(self, delta: str) -> None:
+        for sentence in self._chunker.feed(delta):
+            self._submit(sentence)
+
+    def finish(self) -> None:
+        """The answer is complete: synthesize what is left and stop the worker."""
+        if self._finished:
+            return
+        for sentence in self._chunker.flush():
+            self._submit(sentence)
+        self._finished = True
+        self._sentences.put(None)
+
+    def close(self) -> None:
+        """Client went away: skip sentences not synthesized yet."""
+        self._cancelled.set()
+        if not self._finished:
+            self._finished = True
+            self._sentences.put(None)
+
+    def drain(self, wait: bool = False) -> Iterator[Dict]:
+        """Audio chunks ready so far; with `wait`, everything up to the end (after finish())."""
+        while not self._drained:
+            try:
+                chunk = self._ready.get(block=wait)
+            except queue.Empty:
+                return
+            if chunk is None:
+                self._drained = True
+                return
+            if self.first_audio_ms is None and "data" in chunk:
+                self.first_audio_ms = (time.perf_counter() - self.started) * 1000
+                VOICE_REPLY_FIRST_AUDIO.observe(self.first_audio_ms / 1000)
+            yield chunk
+
+    def timings(self) -> Dict:
+        return {
+            "sentences": self._count,
+            "first_sentence_ms": _round(self.first_sentence_ms),
+            "first_audio_ms": _round(self.first_audio_ms),
+            "synth_ms": _round(self.synth_ms),
+            "audio_seconds": round(self.audio_seconds, 3),
+        }
+
+    def _submit(self, sentence: str) -> None:
+        text = speakable(sentence)
+        if not text:
+            return
+        if self.first_sentence_ms is None:
+            self.first_sentence_ms = (time.perf_counter() - self.started) * 1000
+        self._sentences.put(text)
+
+    def _run(self) -> None:
+        while True:
+            text = self._sentences.get()
+            if text is None:
+                break
+            if self._cancelled.is_set():
+                continue
+            index = self._count
+            self._count += 1
+            started = time.perf_counter()
+            try:
+                with _tts_slots:
+                    audio = self.synthesize(text, self.fmt)
+            except Exception as e:
+                logger.exception("voice reply: failed to synthesize sentence %s", index)
+                self._ready.put({"index": index, "text": text, "error": str(e)})
+                continue
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.synth_ms += elapsed_ms
+            chunk = {
+                "index": index,
+                "text": text,
+                "format": audio.format,
+                "mimetype": audio.mimetype,
+                "cache": audio.cache,
+                "synth_ms": round(elapsed_ms, 1),
+                "data": base64.b64encode(audio.data).decode("ascii"),
+            }
+            if audio.speech is not None:
+                chunk["audio_seconds"] = round(audio.speech.audio_seconds, 3)
+                chunk["rtf"] = round(audio.speech.rtf, 3)
+                self.audio_seconds += audio.speech.audio_seconds
+            self._ready.put(chunk)
+        self._ready.put(None)
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
+
+
+__all__ = [
+    "SentenceChunker",
+    "VoiceReply",
+    "speakable",
+]
@@ -1,16 +1,18 @@
-import { ChatMessageParams } from "@/entities/chat/model.ts"
+import { ChatData, ChatHistoryResponse, ChatMessageParams } from "@/entities/chat/model.ts"
 import { api } from "@/shared/api"
 
 export const sendMessage = async ({
   message,
   code,
   type,
+  chatId,
   // todo: заменить на пользователя
   userId = 1,
 }: {
   message: string | Blob
   code: string
   type: "0" | "1"
+  chatId?: number | null
   userId?: number
 }): Promise<ChatMessageParams> => {
   try {
@@ -19,6 +21,7 @@ export const sendMessage = async ({
     data.append("message", message)
     data.append("type", type)
     data.append("code", code)
+    if (chatId) data.append("chat_id", String(chatId))
 
     const res = await api.post<ChatMessageParams>("/api/messages/", data, {
       headers: {
@@ -33,3 +36,14 @@ export const sendMessage = async ({
     }
   }
 }
+
+// Окно истории чата: последние сообщения, с before — окно старше курсора
+export const fetchChatHistory = async (
+  chatId: number,
+  before?: string | null
+): Promise<{ messages: ChatData[]; olderCursor: string | null }> => {
+  const res = await api.get<ChatHistoryResponse>(`/api/chats/${chatId}/history`, {
+    params: before ? { before } : undefined,
+  })
+  return { messages: res.data.messages, olderCursor: res.data.next_cursor }
+}
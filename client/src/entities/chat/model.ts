@@ -2,6 +2,7 @@ export interface ChatMessageParams {
   message: string
   redir: boolean | string
   values?: string | Record<string, string>
+  chat_id?: number
 }
 
 export interface ChatData {
@@ -19,4 +20,16 @@ export interface ChatResponse {
   data: ChatData[]
   message: string
   status: boolean
+  // курсор следующей страницы (параметр after), null на последней
+  next_cursor?: string | null
+}
+
+export interface ChatHistoryResponse {
+  status: boolean
+  chat_id: number
+  chat_name: string
+  has_more: boolean
+  // курсор более старого окна (параметр before), null если старше ничего нет
+  next_cursor: string | null
+  messages: ChatData[]
 }
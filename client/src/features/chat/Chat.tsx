@@ -1,8 +1,8 @@
 import SendIcon from "@mui/icons-material/Send"
+import { Button } from "@mui/material"
 import { ChangeEvent, FC, useEffect, useState } from "react"
-import { ChatResponse, sendMessage } from "@/entities/chat"
+import { fetchChatHistory, sendMessage } from "@/entities/chat"
 import { useChatContext } from "@/features/chat/Context.tsx"
-import { api } from "@/shared/api"
 import { isCodeString } from "@/shared/lib/guards.ts"
 import { MessageField } from "./MessageField"
 import { useStyles } from "./styles"
@@ -10,9 +10,11 @@ import { VoiceToggle } from "./voiceToggle"
 
 export const Chat: FC = () => {
   const classes = useStyles()
-  const { isVoice, setChatMessages, chatMessages, code, setCode } = useChatContext()
+  const { isVoice, setChatMessages, chatMessages, code, setCode, chatId, setChatId } =
+    useChatContext()
 
   const [message, setMessage] = useState("")
+  const [olderCursor, setOlderCursor] = useState<string | null>(null)
 
   const onChange = ({ target }: ChangeEvent<HTMLInputElement>) => setMessage(target.value)
 
@@ -38,7 +40,8 @@ export const Chat: FC = () => {
     data.append("type", isVoice ? "1" : "0")
     data.append("code", code)
 
-    const res = await sendMessage({ code, type: isVoice ? "1" : "0", message })
+    const res = await sendMessage({ code, type: isVoice ? "1" : "0", message, chatId })
+    if (res.chat_id && res.chat_id !== chatId) setChatId(res.chat_id)
 
     setChatMessages(prevState => [
       ...prevState,
@@ -58,15 +61,34 @@ export const Chat: FC = () => {
   }
 
   useEffect(() => {
-    api
-      .get<ChatResponse>("/api/messages")
-      .then(res => setChatMessages(res.data.data))
-      .catch(() => setChatMessages([]))
+    if (!chatId) return
+    fetchChatHistory(chatId)
+      .then(history => {
+        setChatMessages(history.messages)
+        setOlderCursor(history.olderCursor)
+      })
+      .catch(() => {
+        // чат удалён — начинаем новый
+        setChatId(null)
+        setChatMessages([])
+      })
   }, [])
 
+  const onLoadOlder = async () => {
+    if (!chatId || !olderCursor) return
+    const history = await fetchChatHistory(chatId, olderCursor)
+    setChatMessages(prevState => [...history.messages, ...prevState])
+    setOlderCursor(history.olderCursor)
+  }
+
   return (
     <div className={classes.chat}>
       <VoiceToggle />
+      {olderCursor && (
+        <Button size="small" onClick={onLoadOlder}>
+          Показать предыдущие сообщения
+        </Button>
+      )}
       <MessageField messages={chatMessages} />
       <div className={classes.textBar}>
         <form className={classes.messageInput}>
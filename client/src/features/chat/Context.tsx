@@ -17,8 +17,12 @@ interface ContextParams {
   setChatMessages: Dispatch<SetStateAction<ChatData[]>>
   code: string
   setCode: Dispatch<SetStateAction<string>>
+  chatId: number | null
+  setChatId: (chatId: number | null) => void
 }
 
+const CHAT_ID_KEY = "chatId"
+
 const ChatContext = createContext<ContextParams | null>(null)
 
 interface Props {
@@ -29,6 +33,17 @@ export const ChatContextProvider = ({ children }: Props) => {
   const [isVoice, setIsVoice] = useState(false)
   const [chatMessages, setChatMessages] = useState<ChatData[]>([])
   const [code, setCode] = useState("000")
+  // открытый чат переживает перезагрузку страницы
+  const [chatId, setChatIdState] = useState<number | null>(() => {
+    const stored = localStorage.getItem(CHAT_ID_KEY)
+    return stored ? Number(stored) : null
+  })
+
+  const setChatId = (id: number | null) => {
+    if (id) localStorage.setItem(CHAT_ID_KEY, String(id))
+    else localStorage.removeItem(CHAT_ID_KEY)
+    setChatIdState(id)
+  }
 
   const toggleVoice = () => setIsVoice(prevState => !prevState)
 
@@ -39,6 +54,8 @@ export const ChatContextProvider = ({ children }: Props) => {
     setChatMessages,
     code,
     setCode,
+    chatId,
+    setChatId,
   }
 
   return <ChatContext.Provider value={value}>{children}</ChatContext.Provider>
@@ -19,10 +19,10 @@ export const BotsMessage: FC<BotsMessageProps> = ({
   const classes = useStyles()
   const actions = Object.entries(targetedActions)
 
-  const { setChatMessages, isVoice, setCode } = useChatContext()
+  const { setChatMessages, isVoice, setCode, chatId } = useChatContext()
 
   const onClick = async (code: string) => {
-    const res = await sendMessage({ code, type: isVoice ? "1" : "0", message: "" })
+    const res = await sendMessage({ code, type: isVoice ? "1" : "0", message: "", chatId })
 
     setChatMessages(prevState => [
       ...prevState,
@@ -6,7 +6,7 @@ import { useChatContext } from "@/features/chat"
 import { useStyles } from "./styles.ts"
 
 export const VoiceRecording = () => {
-  const { toggleVoice, code } = useChatContext()
+  const { toggleVoice, code, chatId } = useChatContext()
   const classes = useStyles()
 
   const voice = useRef<Blob[]>([])
@@ -38,6 +38,7 @@ export const VoiceRecording = () => {
           type: "1",
           message: file,
           code,
+          chatId,
         })
         onStop()
       })
@@ -0,0 +1,241 @@
+"""
+Бенчмарк качества и латентности поиска по размеченному набору запросов.
+
+Файл разметки — JSONL (или JSON-список), одна запись на запрос:
+    {"query": "Политика по командировкам", "relevant_doc_ids": [3],
+     "relevant_chunks": [{"doc_id": 3, "chunk": 0}]}
+Если у записи есть "relevant_chunks", релевантность считается по чанкам,
+иначе — по doc_id.
+
+Прогоняются два пути:
+  * service — QdrantRAG.search, как в /search rag_service;
+  * api     — путь /retrieve, которым пользуются query_rag_context и
+              rerank_local во Flask API (эмбеддинг → Qdrant на N кандидатов →
+              CrossEncoder по первым depth, остальные — в порядке Qdrant);
+              реранк делает тот же rerank_hits, что и QdrantRAG.retrieve,
+              а depth — это rerank_depth запроса /retrieve (RAG_RERANK_DEPTH в API).
+
+Для каждой конфигурации (кандидаты × глубина реранка × настройки индекса)
+считаются recall@k, MRR и p50/p95/p99 латентности по стадиям.
+
+Пример:
+    python benchmark.py --ground-truth queries.jsonl \\
+        --candidates 5,10,20 --rerank-depth 3,5,10 --hnsw-ef 32,128 --exact \\
+        --k 1,3,5 --min-recall 0.8 --recall-k 3 --output bench.json
+"""
+import argparse
+import itertools
+import json
+import math
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+from qdrant_client.http.models import SearchParams
+
+from main import QdrantRAG, Reranker, rerank_hits
+
+
+# -------------------- GROUND TRUTH --------------------
+def load_ground_truth(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read().strip()
+    if raw.startswith("["):
+        items = json.loads(raw)
+    else:
+        items = [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+    queries = []
+    for item in items:
+        query = (item.get("query") or "").strip()
+        if not query:
+            continue
+        chunks = {(c["doc_id"], c["chunk"]) for c in item.get("relevant_chunks", [])}
+        doc_ids = set(item.get("relevant_doc_ids", [])) | {doc_id for doc_id, _ in chunks}
+        if not doc_ids:
+            print(f"⚠ Query without relevance labels skipped: {query}")
+            continue
+        queries.append({"query": query, "doc_ids": doc_ids, "chunks": chunks})
+    return queries
+
+
+def hit_key(payload: Dict[str, Any], use_chunks: bool):
+    if use_chunks:
+        return payload.get("doc_id"), payload.get("chunk")
+    return payload.get("doc_id")
+
+
+# -------------------- METRICS --------------------
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile, values in milliseconds."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def ranking_metrics(ranked_keys: List[Any], relevant: set, ks: List[int]) -> Dict[str, float]:
+    metrics = {}
+    for k in ks:
+        found = {key for key in ranked_keys[:k] if key in relevant}
+        metrics[f"recall@{k}"] = len(found) / len(relevant)
+    rr = 0.0
+    for pos, key in enumerate(ranked_keys, start=1):
+        if key in relevant:
+            rr = 1.0 / pos
+            break
+    metrics["mrr"] = rr
+    return metrics
+
+
+def summarize(per_query: List[Dict[str, float]], timings: Dict[str, List[float]]) -> Dict[str, Any]:
+    quality = {}
+    if per_query:
+        for name in per_query[0]:
+            quality[name] = sum(m[name] for m in per_query) / len(per_query)
+    latency = {
+        stage: {
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+        }
+        for stage, values in timings.items()
+    }
+    return {"quality": quality, "latency_ms": latency}
+
+
+# -------------------- PIPELINES --------------------
+def run_config(rag: QdrantRAG, reranker: Optional[Reranker], queries: List[Dict[str, Any]],
+               candidates: int, depth: int, search_params: Optional[SearchParams],
+               ks: List[int], repeats: int) -> Dict[str, Any]:
+    service_quality, api_quality = [], []
+    service_t: Dict[str, List[float]] = {"encode": [], "qdrant": [], "total": []}
+    api_t: Dict[str, List[float]] = {"encode": [], "qdrant": [], "rerank": [], "total": []}
+
+    for item in queries:
+        use_chunks = bool(item["chunks"])
+        relevant = item["chunks"] if use_chunks else item["doc_ids"]
+
+        for _ in range(repeats):
+            # --- service path: QdrantRAG.search ---
+            t0 = time.perf_counter()
+            q_emb = rag.embed_query(item["query"])
+            t1 = time.perf_counter()
+            hits = rag.search_vector(q_emb, top_k=candidates, search_params=search_params)
+            t2 = time.perf_counter()
+            service_t["encode"].append((t1 - t0) * 1000)
+            service_t["qdrant"].append((t2 - t1) * 1000)
+            service_t["total"].append((t2 - t0) * 1000)
+
+            # --- api path: /retrieve (поиск + CrossEncoder) ---
+            # эмбеддинг и поиск те же, что и выше; меряем только реранк сверху
+            t3 = time.perf_counter()
+            ranked = rerank_hits(reranker, item["query"], hits, depth)
+            t4 = time.perf_counter()
+            api_t["encode"].append((t1 - t0) * 1000)
+            api_t["qdrant"].append((t2 - t1) * 1000)
+            api_t["rerank"].append((t4 - t3) * 1000)
+            api_t["total"].append((t2 - t0 + t4 - t3) * 1000)
+
+        service_keys = [hit_key(h.payload or {}, use_chunks) for h in hits]
+        api_keys = [hit_key(h.payload or {}, use_chunks) for h, _ in ranked]
+        service_quality.append(ranking_metrics(service_keys, relevant, ks))
+        api_quality.append(ranking_metrics(api_keys, relevant, ks))
+
+    return {
+        "service": summarize(service_quality, service_t),
+        "api": summarize(api_quality, api_t),
+    }
+
+
+def describe_params(params: Optional[SearchParams]) -> Dict[str, Any]:
+    if params is None:
+        return {"hnsw_ef": None, "exact": False}
+    return {"hnsw_ef": params.hnsw_ef, "exact": bool(params.exact)}
+
+
+def pick_cheapest(results: List[Dict[str, Any]], path: str, metric: str,
+                  min_value: float) -> Optional[Dict[str, Any]]:
+    passing = [r for r in results if r[path]["quality"].get(metric, 0.0) >= min_value]
+    if not passing:
+        return None
+    return min(passing, key=lambda r: r[path]["latency_ms"]["total"]["p95"])
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval recall/latency benchmark")
+    parser.add_argument("--ground-truth", required=True, help="JSONL/JSON файл с разметкой")
+    parser.add_argument("--candidates", default="10", help="Кол-во кандидатов из Qdrant, через запятую")
+    parser.add_argument("--rerank-depth", default="10", help="Сколько кандидатов реранкать, через запятую")
+    parser.add_argument("--hnsw-ef", default="", help="Значения hnsw_ef для поиска, через запятую")
+    parser.add_argument("--exact", action="store_true", help="Добавить точный (brute-force) поиск в sweep")
+    parser.add_argument("--k", default="1,3,5", help="k для recall@k")
+    parser.add_argument("--repeats", type=int, default=1, help="Повторов на запрос для латентности")
+    parser.add_argument("--no-rerank", action="store_true", help="Не загружать CrossEncoder")
+    parser.add_argument("--min-recall", type=float, default=None, help="Порог качества для выбора конфигурации")
+    parser.add_argument("--recall-k", type=int, default=3, help="k для порога --min-recall")
+    parser.add_argument("--output", default=None, help="Куда сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    queries = load_ground_truth(args.ground_truth)
+    if not queries:
+        raise SystemExit("Ground truth file has no labelled queries")
+    ks = parse_int_list(args.k)
+
+    rag = QdrantRAG()
+    reranker = None if args.no_rerank else Reranker()
+
+    param_grid: List[Optional[SearchParams]] = [None]
+    param_grid += [SearchParams(hnsw_ef=ef) for ef in parse_int_list(args.hnsw_ef)]
+    if args.exact:
+        param_grid.append(SearchParams(exact=True))
+
+    # прогрев моделей и соединения, чтобы не портить p99
+    warm_emb = rag.embed_query(queries[0]["query"])
+    rag.search_vector(warm_emb, top_k=1)
+    if reranker:
+        reranker.rerank(queries[0]["query"], ["warmup"])
+
+    results = []
+    grid: List[Tuple[int, int, Optional[SearchParams]]] = list(itertools.product(
+        parse_int_list(args.candidates), parse_int_list(args.rerank_depth), param_grid
+    ))
+    for candidates, depth, params in grid:
+        if depth > candidates:
+            continue
+        res = run_config(rag, reranker, queries, candidates, depth, params, ks, args.repeats)
+        res["config"] = {"candidates": candidates, "rerank_depth": depth, **describe_params(params)}
+        results.append(res)
+
+        api = res["api"]
+        print(
+            f"cand={candidates:<3} depth={depth:<3} {describe_params(params)} | "
+            + " ".join(f"{m}={v:.3f}" for m, v in api["quality"].items())
+            + " | "
+            + " ".join(f"{s}.p95={v['p95']:.1f}ms" for s, v in api["latency_ms"].items())
+        )
+
+    if args.min_recall is not None:
+        metric = f"recall@{args.recall_k}"
+        if metric not in results[0]["api"]["quality"]:
+            raise SystemExit(f"{metric} is not computed, add {args.recall_k} to --k")
+        for path in ("service", "api"):
+            best = pick_cheapest(results, path, metric, args.min_recall)
+            if best:
+                print(f"✅ {path}: cheapest config with {metric} >= {args.min_recall}: {best['config']} "
+                      f"(p95 {best[path]['latency_ms']['total']['p95']:.1f}ms)")
+            else:
+                print(f"⚠ {path}: no config reaches {metric} >= {args.min_recall}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"queries": len(queries), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,22 @@
 import os
 import re
 import tempfile
+import threading
+import time
 from typing import List, Dict, Any, Optional, Set
 
 import requests
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from pydantic import BaseModel
 from tqdm import tqdm
 
-from sentence_transformers import SentenceTransformer
+from sentence_transformers import SentenceTransformer, CrossEncoder
 
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import VectorParams, Distance, PointStruct
+from qdrant_client.http.models import (
+    VectorParams, Distance, PointStruct, SearchParams,
+    Filter, FieldCondition, MatchAny, MatchValue, PayloadSchemaType, FilterSelector
+)
 
 # Document parsing libs
 from bs4 import BeautifulSoup
@@ -25,6 +30,11 @@ from PIL import Image
 import nltk
 from nltk.tokenize import sent_tokenize
 
+from metrics import (
+    MODEL_LOAD_SECONDS, OCR_PAGE_LATENCY, PARSE_LATENCY, EMBEDDED_CHUNKS,
+    record_error, track_stage, render_latest
+)
+
 nltk.download("punkt")
 nltk.download("punkt_tab")
 
@@ -32,13 +42,18 @@ nltk.download("punkt_tab")
 QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
 API_BASE_URL = os.getenv("DOCUMENTS_API_URL", "http://web:5000/api/documents")
+DOCUMENTS_PAGE_SIZE = int(os.getenv("DOCUMENTS_PAGE_SIZE", "200"))  # API отдаёт список постранично
 EMBED_MODEL = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+RERANK_MODEL = os.getenv("RERANK_MODEL_NAME", "BAAI/bge-reranker-base")
+PRELOAD_MODELS = os.getenv("RAG_PRELOAD_MODELS", "1") == "1"
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "documents_rag")
+MEMORY_COLLECTION_NAME = os.getenv("MEMORY_COLLECTION_NAME", "user_memory")
 PDF_POPPLER_PATH = os.getenv("PDF_POPPLER_PATH", None)  # optional path for poppler (pdf2image)
 OCR_LANGS = os.getenv("OCR_LANGS", "ru")  # e.g. "ru", "en", "multilingual"
 
 # OCR init (PaddleOCR)
-ocr = PaddleOCR(use_angle_cls=True, lang=OCR_LANGS)
+with track_stage("model_load", MODEL_LOAD_SECONDS, model="paddleocr"):
+    ocr = PaddleOCR(use_angle_cls=True, lang=OCR_LANGS)
 
 # -------------------- TEXT PREPROCESSING --------------------
 def clean_text(text: str) -> str:
@@ -77,7 +92,8 @@ def read_docx(path: str) -> str:
     return "\n".join(paragraphs)
 
 def ocr_image_path(path: str) -> str:
-    res = ocr.ocr(path, cls=True)
+    with track_stage("ocr", OCR_PAGE_LATENCY):
+        res = ocr.ocr(path, cls=True)
     lines = []
     # PaddleOCR returns list of results for each detected line/box
     for page in res:
@@ -95,6 +111,7 @@ def read_pdf(path: str) -> str:
                 if page_text:
                     text_pages.append(page_text)
     except Exception as e:
+        record_error("parse")
         print("pdfplumber error:", e)
 
     extracted = "\n".join(text_pages).strip()
@@ -103,7 +120,8 @@ def read_pdf(path: str) -> str:
 
     # If no text extracted, convert pages to images and OCR them
     try:
-        images = convert_from_path(path, dpi=200, poppler_path=PDF_POPPLER_PATH)
+        with track_stage("pdf_render"):
+            images = convert_from_path(path, dpi=200, poppler_path=PDF_POPPLER_PATH)
     except Exception as e:
         print("pdf->image conversion error:", e)
         images = []
@@ -124,6 +142,11 @@ def read_pdf(path: str) -> str:
 
 def read_file_auto(path: str) -> str:
     ext = (path.split(".")[-1] or "").lower()
+    file_type = ext if ext in TEXT_EXTS | HTML_EXTS | DOCX_EXTS | PDF_EXTS | IMAGE_EXTS else "other"
+    with track_stage("parse", PARSE_LATENCY, file_type=file_type):
+        return _read_file_by_ext(path, ext)
+
+def _read_file_by_ext(path: str, ext: str) -> str:
     if ext in TEXT_EXTS:
         return read_text_file(path)
     if ext in HTML_EXTS:
@@ -147,12 +170,20 @@ def fetch_documents(limit: Optional[int] = None) -> List[Dict[str, Any]]:
     [{"id": 1, "name": "file.pdf", "path": "/data/documents"}, ...]
     Если поле "url" присутствует — файл будет скачан и распознан.
     """
-    params = {}
-    if limit:
-        params["limit"] = limit
-    resp = requests.get(f"{API_BASE_URL}/", params=params, timeout=30)
-    resp.raise_for_status()
-    docs_meta = resp.json()
+    docs_meta = []
+    params = {"limit": DOCUMENTS_PAGE_SIZE}
+    with track_stage("fetch_metadata"):
+        # список постраничный: идём по курсору X-Next-Cursor, пока он есть
+        while True:
+            if limit:
+                params["limit"] = min(DOCUMENTS_PAGE_SIZE, limit - len(docs_meta))
+            resp = requests.get(f"{API_BASE_URL}/", params=params, timeout=30)
+            resp.raise_for_status()
+            docs_meta.extend(resp.json())
+            cursor = resp.headers.get("X-Next-Cursor")
+            if not cursor or (limit and len(docs_meta) >= limit):
+                break
+            params["after"] = cursor
 
     documents = []
     for meta in docs_meta:
@@ -165,13 +196,14 @@ def fetch_documents(limit: Optional[int] = None) -> List[Dict[str, Any]]:
         if url:
             # download remote file to temp
             try:
-                r = requests.get(url, stream=True, timeout=30)
-                r.raise_for_status()
-                suffix = os.path.splitext(filename)[1] or ".bin"
-                with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        tmp.write(chunk)
-                    tmp_path = tmp.name
+                with track_stage("download"):
+                    r = requests.get(url, stream=True, timeout=30)
+                    r.raise_for_status()
+                    suffix = os.path.splitext(filename)[1] or ".bin"
+                    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+                        for chunk in r.iter_content(chunk_size=8192):
+                            tmp.write(chunk)
+                        tmp_path = tmp.name
                 try:
                     content = read_file_auto(tmp_path)
                 finally:
@@ -190,26 +222,63 @@ def fetch_documents(limit: Optional[int] = None) -> List[Dict[str, Any]]:
             if os.path.exists(file_path):
                 content = read_file_auto(file_path)
             else:
+                record_error("download")
                 print(f"File not found: {file_path}")
                 content = ""
 
         documents.append({"id": doc_id, "title": filename, "content": content})
     return documents
 
+# -------------------- INDEX GENERATION --------------------
+# Меняется при каждом изменении индекса. Клиенты (кэш ответов в API) включают
+# её в ключ, поэтому после переиндексации старые ответы больше не находятся.
+_index_generation = int(time.time())
+_generation_lock = threading.Lock()
+
+def bump_index_generation() -> int:
+    global _index_generation
+    with _generation_lock:
+        _index_generation = max(_index_generation + 1, int(time.time()))
+        return _index_generation
+
+def index_generation() -> int:
+    return _index_generation
+
 # -------------------- Qdrant RAG (с инкрементальной индексацией) --------------------
+def doc_filter(doc_ids: Optional[List[int]]) -> Optional[Filter]:
+    """Payload-фильтр Qdrant по списку doc_id; None — без ограничений."""
+    if doc_ids is None:
+        return None
+    return Filter(must=[FieldCondition(key="doc_id", match=MatchAny(any=list(doc_ids)))])
+
 class QdrantRAG:
     def __init__(self):
-        self.model = SentenceTransformer(EMBED_MODEL)
+        with track_stage("model_load", MODEL_LOAD_SECONDS, model=EMBED_MODEL):
+            self.model = SentenceTransformer(EMBED_MODEL)
         self.dim = self.model.get_sentence_embedding_dimension()
         self.client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT, check_compatibility=False)
 
     def init_collection(self):
         colls = self.client.get_collections().collections
-        if any(c.name == COLLECTION_NAME for c in colls):
+        if not any(c.name == COLLECTION_NAME for c in colls):
+            self.client.create_collection(
+                collection_name=COLLECTION_NAME,
+                vectors_config=VectorParams(size=self.dim, distance=Distance.COSINE)
+            )
+        self.ensure_payload_index()
+
+    def ensure_payload_index(self):
+        """
+        Индекс по doc_id нужен для фильтрации по правам доступа прямо в поиске.
+        Создание идемпотентно, для старых коллекций индекс достраивается.
+        """
+        schema = self.client.get_collection(COLLECTION_NAME).payload_schema or {}
+        if "doc_id" in schema:
             return
-        self.client.create_collection(
+        self.client.create_payload_index(
             collection_name=COLLECTION_NAME,
-            vectors_config=VectorParams(size=self.dim, distance=Distance.COSINE)
+            field_name="doc_id",
+            field_schema=PayloadSchemaType.INTEGER
         )
 
     def get_indexed_doc_ids(self) -> Set[Any]:
@@ -237,6 +306,7 @@ class QdrantRAG:
                 offset = next_page
 
         except Exception as e:
+            record_error("scroll")
             print("get_indexed_doc_ids error:", e)
 
         return indexed
@@ -275,9 +345,12 @@ class QdrantRAG:
                 print(f"⚠ Document {doc_id} has no text. Skipping.")
                 continue
 
-            chunks = chunk_text(text)
+            with track_stage("chunking"):
+                chunks = chunk_text(text)
             # encode batched
-            embeddings = self.model.encode(chunks, convert_to_numpy=True)
+            with track_stage("embed_batch"):
+                embeddings = self.model.encode(chunks, convert_to_numpy=True)
+            EMBEDDED_CHUNKS.inc(len(chunks))
 
             for i, (chunk, emb) in enumerate(zip(chunks, embeddings)):
                 meta = {
@@ -291,16 +364,182 @@ class QdrantRAG:
 
         if all_points:
             # upsert все новые точки
-            self.client.upsert(collection_name=COLLECTION_NAME, points=all_points)
+            with track_stage("upsert_batch"):
+                self.client.upsert(collection_name=COLLECTION_NAME, points=all_points)
+            bump_index_generation()
             print(f"✅ Added {len(all_points)} new chunks")
         else:
             print("⚠ No new documents to index")
 
-    def search(self, query: str, top_k=5):
-        q_emb = self.model.encode(query).tolist()
-        results = self.client.search(collection_name=COLLECTION_NAME, query_vector=q_emb, limit=top_k)
+    def embed_query(self, query: str) -> List[float]:
+        with track_stage("search_encode"):
+            return self.model.encode(query).tolist()
+
+    def search_vector(self, q_emb: List[float], top_k=5, search_params: Optional[SearchParams] = None,
+                      doc_ids: Optional[List[int]] = None):
+        with track_stage("qdrant_query"):
+            return self.client.search(
+                collection_name=COLLECTION_NAME,
+                query_vector=q_emb,
+                limit=top_k,
+                search_params=search_params,
+                query_filter=doc_filter(doc_ids)
+            )
+
+    def search(self, query: str, top_k=5, search_params: Optional[SearchParams] = None,
+               doc_ids: Optional[List[int]] = None, q_emb: Optional[List[float]] = None):
+        if q_emb is None:
+            q_emb = self.embed_query(query)
+        results = self.search_vector(q_emb, top_k=top_k, search_params=search_params, doc_ids=doc_ids)
         return results
 
+    def retrieve(self, query: str, candidates=10, top_k=3, reranker: Optional["Reranker"] = None,
+                 doc_ids: Optional[List[int]] = None, q_emb: Optional[List[float]] = None,
+                 rerank_depth: Optional[int] = None):
+        """
+        Поиск candidates ближайших чанков и реранк CrossEncoder'ом.
+        doc_ids — если задан, ищем только среди этих документов.
+        q_emb — уже посчитанный эмбеддинг запроса (иначе кодируем здесь).
+        rerank_depth — сколько первых кандидатов реранкать (по умолчанию все).
+        Возвращает список (hit, rerank_score) длиной не больше top_k.
+        """
+        if doc_ids is not None and not doc_ids:
+            return []
+        hits = self.search(query, top_k=max(candidates, top_k), doc_ids=doc_ids, q_emb=q_emb)
+        return rerank_hits(reranker, query, hits, rerank_depth)[:top_k]
+
+# -------------------- USER MEMORY --------------------
+def user_filter(user_id: int, ids: Optional[List[int]] = None) -> Filter:
+    must = [FieldCondition(key="user_id", match=MatchValue(value=user_id))]
+    if ids:
+        must.append(FieldCondition(key="memory_id", match=MatchAny(any=ids)))
+    return Filter(must=must)
+
+class MemoryIndex:
+    """
+    Долговременная память пользователей: одна коллекция, точка = заметка из
+    llm_memory (id точки = id заметки). Поиск всегда с фильтром по
+    индексированному user_id, так что каждый пользователь видит только свой
+    «под-индекс», а новый пользователь не требует новой коллекции.
+    """
+    def __init__(self, rag: QdrantRAG):
+        self.model = rag.model
+        self.client = rag.client
+        self.dim = rag.dim
+
+    def init_collection(self):
+        colls = self.client.get_collections().collections
+        if not any(c.name == MEMORY_COLLECTION_NAME for c in colls):
+            self.client.create_collection(
+                collection_name=MEMORY_COLLECTION_NAME,
+                vectors_config=VectorParams(size=self.dim, distance=Distance.COSINE)
+            )
+        schema = self.client.get_collection(MEMORY_COLLECTION_NAME).payload_schema or {}
+        for field in ("user_id", "memory_id"):
+            if field not in schema:
+                self.client.create_payload_index(
+                    collection_name=MEMORY_COLLECTION_NAME,
+                    field_name=field,
+                    field_schema=PayloadSchemaType.INTEGER
+                )
+
+    def upsert(self, user_id: int, items: List[Dict[str, Any]]) -> int:
+        items = [it for it in items if (it.get("text") or "").strip()]
+        if not items:
+            return 0
+        with track_stage("memory_embed"):
+            vectors = self.model.encode([it["text"] for it in items], convert_to_numpy=True)
+        points = [
+            PointStruct(
+                id=int(it["id"]),
+                vector=vec.tolist(),
+                payload={"user_id": user_id, "memory_id": int(it["id"]), "text": it["text"]}
+            )
+            for it, vec in zip(items, vectors)
+        ]
+        with track_stage("memory_upsert"):
+            self.client.upsert(collection_name=MEMORY_COLLECTION_NAME, points=points)
+        return len(points)
+
+    def search(self, user_id: int, q_emb: List[float], top_k: int = 8):
+        with track_stage("memory_query"):
+            return self.client.search(
+                collection_name=MEMORY_COLLECTION_NAME,
+                query_vector=q_emb,
+                limit=top_k,
+                query_filter=user_filter(user_id)
+            )
+
+    def delete(self, user_id: int, ids: Optional[List[int]] = None):
+        # Удаляем по фильтру с user_id, чтобы чужие заметки не задеть даже по ошибке в id
+        self.client.delete(
+            collection_name=MEMORY_COLLECTION_NAME,
+            points_selector=FilterSelector(filter=user_filter(user_id, ids))
+        )
+
+# -------------------- RERANKER --------------------
+class Reranker:
+    def __init__(self, model_name: str = RERANK_MODEL):
+        with track_stage("model_load", MODEL_LOAD_SECONDS, model=model_name):
+            self.model = CrossEncoder(model_name)
+
+    def scores(self, query: str, texts: List[str]) -> List[float]:
+        if not texts:
+            return []
+        with track_stage("rerank"):
+            return [float(s) for s in self.model.predict([(query, t) for t in texts])]
+
+    def rerank(self, query: str, texts: List[str]) -> List[int]:
+        """Возвращает индексы texts в порядке убывания релевантности."""
+        scores = self.scores(query, texts)
+        return sorted(range(len(texts)), key=lambda i: scores[i], reverse=True)
+
+def rerank_hits(reranker: Optional[Reranker], query: str, hits, depth: Optional[int] = None):
+    """
+    Реранк первых depth кандидатов (все, если depth не задан); остальные идут
+    следом в порядке векторного поиска со rerank_score None.
+    Возвращает список (hit, rerank_score).
+    """
+    if not reranker or not hits:
+        return [(h, None) for h in hits]
+    head = hits if depth is None else hits[:depth]
+    scores = reranker.scores(query, [(h.payload or {}).get("text", "") for h in head])
+    ranked = sorted(zip(head, scores), key=lambda x: x[1], reverse=True)
+    return ranked + [(h, None) for h in hits[len(head):]]
+
+# Модели грузим один раз на процесс, а не на каждый запрос
+_rag: Optional[QdrantRAG] = None
+_reranker: Optional[Reranker] = None
+_memory: Optional[MemoryIndex] = None
+_models_lock = threading.Lock()
+
+def get_rag() -> QdrantRAG:
+    global _rag
+    if _rag is None:
+        with _models_lock:
+            if _rag is None:
+                _rag = QdrantRAG()
+    return _rag
+
+def get_reranker() -> Reranker:
+    global _reranker
+    if _reranker is None:
+        with _models_lock:
+            if _reranker is None:
+                _reranker = Reranker()
+    return _reranker
+
+def get_memory_index() -> MemoryIndex:
+    global _memory
+    if _memory is None:
+        rag = get_rag()
+        with _models_lock:
+            if _memory is None:
+                index = MemoryIndex(rag)
+                index.init_collection()
+                _memory = index
+    return _memory
+
 # -------------------- FASTAPI --------------------
 class BuildRequest(BaseModel):
     limit: Optional[int] = None
@@ -309,23 +548,71 @@ class BuildRequest(BaseModel):
 class QueryRequest(BaseModel):
     question: str
     top_k: Optional[int] = 5
+    doc_ids: Optional[List[int]] = None  # ограничить поиск этими документами
+
+class RetrieveRequest(BaseModel):
+    question: str
+    candidates: Optional[int] = 10  # сколько кандидатов достать из Qdrant
+    top_k: Optional[int] = 3        # сколько вернуть после реранка
+    rerank: Optional[bool] = True
+    rerank_depth: Optional[int] = None  # сколько первых кандидатов реранкать (None — все)
+    doc_ids: Optional[List[int]] = None  # только разрешённые пользователю документы
+    query_vector: Optional[List[float]] = None  # эмбеддинг из /embed, чтобы не считать повторно
+
+class EmbedRequest(BaseModel):
+    question: str
+
+class MemoryItem(BaseModel):
+    id: int  # id заметки в llm_memory
+    text: str
+
+class MemoryUpsertRequest(BaseModel):
+    user_id: int
+    items: List[MemoryItem]
+
+class MemorySearchRequest(BaseModel):
+    user_id: int
+    question: str
+    top_k: Optional[int] = 8
+    query_vector: Optional[List[float]] = None
+
+class MemoryDeleteRequest(BaseModel):
+    user_id: int
+    ids: Optional[List[int]] = None  # None — удалить всю память пользователя
+
+class RerankRequest(BaseModel):
+    question: str
+    documents: List[str]
+    top_k: Optional[int] = 3
 
 app = FastAPI(title="RAG Qdrant Service with PaddleOCR (incremental)")
 
+@app.on_event("startup")
+def preload_models():
+    if PRELOAD_MODELS:
+        rag = get_rag()
+        get_reranker()
+        try:
+            rag.init_collection()
+            get_memory_index()
+        except Exception as e:
+            record_error("init_collection")
+            print("init_collection error:", e)
+
 @app.post("/build")
 def build_index(req: BuildRequest):
     try:
         docs = fetch_documents(limit=req.limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed fetch_documents: {e}")
-    rag = QdrantRAG()
+    rag = get_rag()
     rag.build(docs, reindex_existing=bool(req.reindex_existing))
     return {"status": "ok", "docs_processed": len(docs)}
 
 @app.post("/search")
 def search_index(req: QueryRequest):
-    rag = QdrantRAG()
-    results = rag.search(req.question, top_k=req.top_k)
+    rag = get_rag()
+    results = [] if req.doc_ids == [] else rag.search(req.question, top_k=req.top_k, doc_ids=req.doc_ids)
     out = []
     for r in results:
         payload = r.payload or {}
@@ -336,9 +623,76 @@ def search_index(req: QueryRequest):
         })
     return {"query": req.question, "results": out}
 
+@app.post("/retrieve")
+def retrieve(req: RetrieveRequest):
+    """Поиск кандидатов + CrossEncoder-реранк за один вызов (используется Flask API)."""
+    rag = get_rag()
+    reranker = get_reranker() if req.rerank else None
+    ranked = rag.retrieve(
+        req.question,
+        candidates=req.candidates,
+        top_k=req.top_k,
+        reranker=reranker,
+        doc_ids=req.doc_ids,
+        q_emb=req.query_vector,
+        rerank_depth=req.rerank_depth
+    )
+    out = []
+    for hit, rerank_score in ranked:
+        out.append({
+            "id": hit.id,
+            "score": float(hit.score) if hasattr(hit, "score") else None,
+            "rerank_score": rerank_score,
+            "payload": hit.payload or {}
+        })
+    return {"query": req.question, "results": out, "index_generation": index_generation()}
+
+@app.post("/embed")
+def embed(req: EmbedRequest):
+    """Эмбеддинг запроса и текущее поколение индекса (для семантического кэша ответов в API)."""
+    rag = get_rag()
+    return {"vector": rag.embed_query(req.question), "index_generation": index_generation()}
+
+@app.post("/rerank")
+def rerank(req: RerankRequest):
+    reranker = get_reranker()
+    scores = reranker.scores(req.question, req.documents)
+    order = sorted(range(len(req.documents)), key=lambda i: scores[i], reverse=True)
+    out = [{"index": i, "text": req.documents[i], "score": scores[i]} for i in order[:req.top_k]]
+    return {"query": req.question, "results": out}
+
+@app.post("/memory/upsert")
+def memory_upsert(req: MemoryUpsertRequest):
+    memory = get_memory_index()
+    count = memory.upsert(req.user_id, [item.dict() for item in req.items])
+    return {"status": "ok", "upserted": count}
+
+@app.post("/memory/search")
+def memory_search(req: MemorySearchRequest):
+    memory = get_memory_index()
+    q_emb = req.query_vector if req.query_vector is not None else get_rag().embed_query(req.question)
+    hits = memory.search(req.user_id, q_emb, top_k=req.top_k)
+    out = [
+        {"id": h.id, "score": float(h.score), "text": (h.payload or {}).get("text", "")}
+        for h in hits
+    ]
+    return {"user_id": req.user_id, "results": out}
+
+@app.post("/memory/delete")
+def memory_delete(req: MemoryDeleteRequest):
+    if req.ids == []:
+        return {"status": "ok"}
+    get_memory_index().delete(req.user_id, req.ids)
+    return {"status": "ok"}
+
+@app.get("/metrics")
+def metrics():
+    payload, content_type = render_latest()
+    return Response(content=payload, media_type=content_type)
+
 @app.get("/indexed_ids")
 def indexed_ids():
-    rag = QdrantRAG()
+    rag = get_rag()
     ids = list(rag.get_indexed_doc_ids())
     return {"indexed_doc_ids": ids, "count": len(ids)}
 
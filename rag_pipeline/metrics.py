@@ -0,0 +1,75 @@
+"""
+Prometheus-метрики rag_service: латентность стадий индексации и поиска,
+ошибки по стадиям и время загрузки моделей. Отдаются через GET /metrics.
+"""
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Стадии: download, fetch_metadata, chunking, embed_batch, upsert_batch,
+# search_encode, qdrant_query, pdf_render
+STAGE_LATENCY = Histogram(
+    "rag_stage_duration_seconds",
+    "Duration of a pipeline stage",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+PARSE_LATENCY = Histogram(
+    "rag_parse_duration_seconds",
+    "Duration of text extraction per file",
+    ["file_type"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+OCR_PAGE_LATENCY = Histogram(
+    "rag_ocr_page_duration_seconds",
+    "Duration of OCR for a single page or image",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40),
+)
+MODEL_LOAD_SECONDS = Histogram(
+    "rag_model_load_seconds",
+    "Time spent loading a model",
+    ["model"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+STAGE_ERRORS = Counter(
+    "rag_stage_errors_total",
+    "Errors per pipeline stage",
+    ["stage"],
+)
+EMBEDDED_CHUNKS = Counter(
+    "rag_embedded_chunks_total",
+    "Chunks embedded during index builds",
+)
+
+
+def record_error(stage: str) -> None:
+    STAGE_ERRORS.labels(stage=stage).inc()
+
+
+@contextmanager
+def track_stage(stage: str, histogram: Optional[Histogram] = None, **labels):
+    """
+    Замеряет блок кода. По умолчанию пишет в STAGE_LATENCY{stage},
+    либо в переданную гистограмму с labels. Исключения считаются
+    ошибками стадии и пробрасываются дальше.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record_error(stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        if histogram is None:
+            STAGE_LATENCY.labels(stage=stage).observe(elapsed)
+        elif labels:
+            histogram.labels(**labels).observe(elapsed)
+        else:
+            histogram.observe(elapsed)
+
+
+def render_latest():
+    return generate_latest(), CONTENT_TYPE_LATEST